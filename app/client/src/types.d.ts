@@ -94,4 +94,5 @@ interface HealthCheckResponse {
   collections_count: number;
   version: string;
   uptime_seconds: number;
+  schema_cache_age_seconds?: number;
 }
\ No newline at end of file
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional, List, Dict, Any, Literal
 from datetime import datetime
 from enum import Enum
@@ -10,6 +10,9 @@ class RelationshipType(str, Enum):
     many_to_many = "many_to_many"
 
 class FieldRelationship(BaseModel):
+    # Immutable so detected relationships can be cached and shared between schema builds
+    model_config = ConfigDict(frozen=True)
+
     source_collection: str
     source_field: str
     target_collection: str
@@ -103,4 +106,5 @@ class HealthCheckResponse(BaseModel):
     database_connected: bool
     collections_count: int
     version: str = "1.0.0"
-    uptime_seconds: float
\ No newline at end of file
+    uptime_seconds: float
+    schema_cache_age_seconds: Optional[float] = None
\ No newline at end of file
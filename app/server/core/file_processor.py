@@ -1,11 +1,93 @@
-import json
-import pandas as pd
+import orjson
 import io
-import re
-import os
-from typing import Dict, Any, List
+import string
+from typing import TYPE_CHECKING, BinaryIO, Dict, Any, Iterator, List, Tuple, Union
+from bson import ObjectId
 from .mongo_security import validate_collection_name, MongoSecurityError
-from .mongo_processor import insert_documents, drop_collection, get_mongodb_connection, convert_objectids_to_strings
+from .mongo_processor import (
+    insert_documents,
+    drop_collection,
+    get_mongodb_database,
+    INSERT_BATCH_SIZE
+)
+
+# pyarrow and ijson are imported where they are used: each costs tens of
+# milliseconds at import time and only the CSV or large-JSON paths need them
+if TYPE_CHECKING:
+    import pyarrow as pa
+
+# JSON uploads at least this large are parsed incrementally instead of at once
+STREAM_JSON_THRESHOLD_BYTES = 16 * 1024 * 1024
+
+# Map Python types to MongoDB type names, keyed on the exact type so that
+# bool is not mistaken for int
+FIELD_TYPE_NAMES = {
+    int: 'number',
+    float: 'double',
+    bool: 'boolean',
+    list: 'array',
+    dict: 'object',
+    type(None): 'null',
+    str: 'string',
+}
+
+
+
+def field_type_name(value: Any) -> str:
+    """
+    Return the MongoDB type name for a Python value
+
+    Exact built-in types hit FIELD_TYPE_NAMES directly; subclasses (e.g.
+    IntEnum members or OrderedDict) fall back to isinstance checks, with bool
+    tested before int since bool is an int subclass.
+    """
+    type_name = FIELD_TYPE_NAMES.get(type(value))
+    if type_name is not None:
+        return type_name
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, int):
+        return 'number'
+    if isinstance(value, float):
+        return 'double'
+    if isinstance(value, list):
+        return 'array'
+    if isinstance(value, dict):
+        return 'object'
+    return 'string'
+
+
+def arrow_type_name(data_type: "pa.DataType") -> str:
+    """
+    Return the MongoDB type name for an Arrow column type
+
+    Matches field_type_name for the values to_pylist() produces, but covers the
+    whole column, so a leading empty cell does not make the field 'null'.
+    """
+    import pyarrow as pa
+
+    if pa.types.is_boolean(data_type):
+        return 'boolean'
+    if pa.types.is_integer(data_type):
+        return 'number'
+    if pa.types.is_floating(data_type):
+        return 'double'
+    if pa.types.is_null(data_type):
+        return 'null'
+    return 'string'
+
+
+class _CollectionNameTable(dict):
+    """str.translate table that maps every character it does not list to '_'"""
+
+    def __missing__(self, codepoint: int) -> str:
+        return '_'
+
+
+# Letters, digits, underscores and hyphens are kept; everything else becomes '_'
+_COLLECTION_NAME_TABLE = _CollectionNameTable(
+    (ord(char), char) for char in string.ascii_letters + string.digits + '_-'
+)
 
 
 def sanitize_collection_name(collection_name: str) -> str:
@@ -18,7 +100,7 @@ def sanitize_collection_name(collection_name: str) -> str:
         collection_name = collection_name.rsplit('.', 1)[0]
 
     # Replace bad characters with underscores
-    sanitized = re.sub(r'[^a-zA-Z0-9_-]', '_', collection_name)
+    sanitized = collection_name.translate(_COLLECTION_NAME_TABLE)
 
     # Ensure it starts with a letter or underscore
     if sanitized and not sanitized[0].isalpha() and sanitized[0] != '_':
@@ -38,6 +120,78 @@ def sanitize_collection_name(collection_name: str) -> str:
     return sanitized
 
 
+def clean_field_name(field_name: str) -> str:
+    """
+    Normalize a column or key name: lowercase, spaces and hyphens become underscores
+    """
+    return str(field_name).lower().replace(' ', '_').replace('-', '_')
+
+
+def _as_stream(content: Union[bytes, BinaryIO]) -> BinaryIO:
+    """
+    Return a stream positioned at the start of the upload
+
+    Raw bytes are wrapped in a BytesIO; file objects (such as the spooled
+    temporary file behind an UploadFile) are rewound and read in place.
+    """
+    if isinstance(content, (bytes, bytearray)):
+        return io.BytesIO(content)
+    content.seek(0)
+    return content
+
+
+def _first_non_whitespace(stream: BinaryIO) -> bytes:
+    """Read up to the first non-whitespace byte of a stream and return it (b'' at EOF)"""
+    while True:
+        chunk = stream.read(4096)
+        if not chunk:
+            return b''
+        chunk = chunk.lstrip()
+        if chunk:
+            return chunk[:1]
+
+
+def read_csv_table(csv_content: Union[bytes, BinaryIO]) -> "pa.Table":
+    """
+    Parse CSV bytes into an Arrow table using pyarrow's multithreaded reader
+
+    Empty cells become nulls. Columns Arrow would infer as dates or timestamps
+    are kept as their original text, since MongoDB cannot store datetime.date
+    values and the uploaded representation should be preserved.
+
+    Raw bytes are read through a zero-copy BufferReader, so parsing allocates
+    no Python objects; the rows only become dicts one batch at a time later.
+
+    Args:
+        csv_content: Raw CSV file bytes or a binary file object
+
+    Returns:
+        Arrow table with the original column names
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+
+    if isinstance(csv_content, (bytes, bytearray)):
+        stream = pa.BufferReader(csv_content)
+    else:
+        stream = _as_stream(csv_content)
+    read_options = pacsv.ReadOptions(use_threads=True)
+    convert_options = pacsv.ConvertOptions(strings_can_be_null=True)
+    table = pacsv.read_csv(stream, read_options=read_options, convert_options=convert_options)
+
+    temporal_columns = {
+        field.name: pa.string()
+        for field in table.schema
+        if pa.types.is_temporal(field.type)
+    }
+    if temporal_columns:
+        convert_options.column_types = temporal_columns
+        stream.seek(0)
+        table = pacsv.read_csv(stream, read_options=read_options, convert_options=convert_options)
+
+    return table
+
+
 def collection_exists(collection_name: str) -> bool:
     """
     Check if a collection exists in the MongoDB database.
@@ -48,55 +202,63 @@ def collection_exists(collection_name: str) -> bool:
     Returns:
         True if collection exists, False otherwise
     """
-    client = get_mongodb_connection()
-    db_name = os.getenv("MONGODB_DATABASE", "nlq_interface")
-    db = client[db_name]
+    db = get_mongodb_database()
 
     collection_names = db.list_collection_names()
     return collection_name in collection_names
 
 
-def infer_field_types(documents: List[Dict[str, Any]]) -> Dict[str, str]:
+def _stringify_ids(documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Convert the ObjectId _id that insert_documents adds to a string, in place
+
+    Parsed CSV and JSON uploads cannot contain ObjectIds themselves, so _id is
+    the only field that needs converting and the documents are not walked.
+    """
+    for doc in documents:
+        doc_id = doc.get('_id')
+        if doc_id.__class__ is ObjectId:
+            doc['_id'] = doc_id.binary.hex()
+    return documents
+
+
+def summarize_documents(
+    documents: List[Dict[str, Any]],
+    sample_size: int = 5
+) -> Tuple[Dict[str, str], List[Dict[str, Any]]]:
     """
-    Infer field types from a list of documents
+    Infer field types and collect JSON-safe sample documents in a single pass
 
     Args:
-        documents: List of document dictionaries
+        documents: List of (already inserted) document dictionaries
+        sample_size: Number of leading documents to return as samples
 
     Returns:
-        Dictionary mapping field names to type names
+        Tuple of (field name to type name mapping, sample documents)
     """
     field_types = {}
+    sample_data = []
 
-    for doc in documents:
+    for index, doc in enumerate(documents):
         for field_name, field_value in doc.items():
             if field_name not in field_types:
-                # Map Python types to MongoDB type names
-                python_type = type(field_value).__name__
-                if python_type in ['int', 'int64']:
-                    field_types[field_name] = 'number'
-                elif python_type in ['float', 'float64']:
-                    field_types[field_name] = 'double'
-                elif python_type == 'bool':
-                    field_types[field_name] = 'boolean'
-                elif python_type == 'list':
-                    field_types[field_name] = 'array'
-                elif python_type == 'dict':
-                    field_types[field_name] = 'object'
-                elif python_type == 'NoneType':
-                    field_types[field_name] = 'null'
-                else:
-                    field_types[field_name] = 'string'
-
-    return field_types
-
-
-def convert_csv_to_mongodb(csv_content: bytes, collection_name: str) -> Dict[str, Any]:
+                field_types[field_name] = field_type_name(field_value)
+
+        if index < sample_size:
+            sample_data.append(doc)
+
+    return field_types, _stringify_ids(sample_data)
+
+
+def convert_csv_to_mongodb(csv_content: Union[bytes, BinaryIO], collection_name: str) -> Dict[str, Any]:
     """
     Convert CSV file content to MongoDB collection
 
+    The parsed table is turned into documents one INSERT_BATCH_SIZE slice at
+    a time, so only one batch of Python dicts exists at once.
+
     Args:
-        csv_content: Raw CSV file bytes
+        csv_content: Raw CSV file bytes or a binary file object
         collection_name: Name for the collection
 
     Returns:
@@ -113,28 +275,36 @@ def convert_csv_to_mongodb(csv_content: bytes, collection_name: str) -> Dict[str
         if collection_exists(collection_name):
             drop_collection(collection_name)
 
-        # Read CSV into pandas DataFrame
-        df = pd.read_csv(io.BytesIO(csv_content))
+        # Read CSV into an Arrow table
+        table = read_csv_table(csv_content)
 
         # Clean column names
-        df.columns = [col.lower().replace(' ', '_').replace('-', '_') for col in df.columns]
-
-        # Convert DataFrame to list of dictionaries
-        # Replace NaN with None for proper JSON serialization
-        df = df.where(pd.notnull(df), None)
-        documents = df.to_dict('records')
+        table = table.rename_columns([clean_field_name(col) for col in table.column_names])
 
-        if not documents:
+        if not table.num_rows:
             raise ValueError("CSV file is empty")
 
-        # Insert documents into MongoDB
-        inserted_count = insert_documents(collection_name, documents)
-
-        # Infer schema from documents
-        schema = infer_field_types(documents)
-
-        # Get sample data (first 5 documents)
-        sample_data = [convert_objectids_to_strings(doc) for doc in documents[:5]]
+        inserted_count = 0
+        try:
+            for offset in range(0, table.num_rows, INSERT_BATCH_SIZE):
+                # Convert one slice to dictionaries (nulls are already None)
+                documents = table.slice(offset, INSERT_BATCH_SIZE).to_pylist()
+                inserted_count += insert_documents(collection_name, documents)
+
+                if not offset:
+                    # Column types come from the Arrow schema; fields added on
+                    # insert (_id) and the first 5 samples from the first batch
+                    schema = {}
+                    for field in table.schema:
+                        schema.setdefault(field.name, arrow_type_name(field.type))
+                    for field_name, field_value in documents[0].items():
+                        schema.setdefault(field_name, field_type_name(field_value))
+                    sample_data = _stringify_ids(documents[:5])
+        except Exception:
+            # Don't leave a partially imported collection behind
+            if inserted_count:
+                drop_collection(collection_name)
+            raise
 
         return {
             'collection_name': collection_name,
@@ -147,12 +317,71 @@ def convert_csv_to_mongodb(csv_content: bytes, collection_name: str) -> Dict[str
         raise Exception(f"Error converting CSV to MongoDB: {str(e)}")
 
 
-def convert_json_to_mongodb(json_content: bytes, collection_name: str) -> Dict[str, Any]:
+def iter_json_records(json_content: Union[bytes, BinaryIO]) -> Iterator[Any]:
+    """
+    Iterate over the elements of a top-level JSON array
+
+    Uploads of at least STREAM_JSON_THRESHOLD_BYTES are parsed incrementally
+    with ijson so the whole document tree is never materialized; smaller ones
+    are parsed in one go with orjson.
+
+    Args:
+        json_content: Raw JSON file bytes or a binary file object
+
+    Returns:
+        Iterator over the array elements
+
+    Raises:
+        ValueError: If the top-level JSON value is not an array
+    """
+    stream = _as_stream(json_content)
+    size = stream.seek(0, io.SEEK_END)
+    stream.seek(0)
+
+    if size >= STREAM_JSON_THRESHOLD_BYTES:
+        if _first_non_whitespace(stream) != b'[':
+            raise ValueError("JSON must be an array of objects")
+        stream.seek(0)
+        import ijson
+        return ijson.items(stream, 'item', use_float=True)
+
+    data = orjson.loads(stream.read())
+    if not isinstance(data, list):
+        raise ValueError("JSON must be an array of objects")
+    return iter(data)
+
+
+def _insert_json_batch(
+    collection_name: str,
+    batch: List[Dict[str, Any]],
+    schema: Dict[str, str],
+    sample_data: List[Dict[str, Any]]
+) -> int:
+    """
+    Insert one batch of JSON documents and fold it into the running schema and samples
+
+    Returns:
+        Number of documents inserted
+    """
+    inserted_count = insert_documents(collection_name, batch)
+
+    batch_types, batch_samples = summarize_documents(batch, sample_size=5 - len(sample_data))
+    for field_name, field_type in batch_types.items():
+        schema.setdefault(field_name, field_type)
+    sample_data.extend(batch_samples)
+
+    return inserted_count
+
+
+def convert_json_to_mongodb(json_content: Union[bytes, BinaryIO], collection_name: str) -> Dict[str, Any]:
     """
     Convert JSON file content to MongoDB collection
 
+    Records are cleaned and inserted in batches of INSERT_BATCH_SIZE while the
+    array is being parsed.
+
     Args:
-        json_content: Raw JSON file bytes
+        json_content: Raw JSON file bytes or a binary file object
         collection_name: Name for the collection
 
     Returns:
@@ -169,36 +398,44 @@ def convert_json_to_mongodb(json_content: bytes, collection_name: str) -> Dict[s
         if collection_exists(collection_name):
             drop_collection(collection_name)
 
-        # Parse JSON
-        data = json.loads(json_content.decode('utf-8'))
-
-        # Ensure it's a list of objects
-        if not isinstance(data, list):
-            raise ValueError("JSON must be an array of objects")
-
-        if not data:
+        # Parse JSON, streaming large arrays record by record
+        records = iter_json_records(json_content)
+
+        key_map = {}
+        schema = {}
+        sample_data = []
+        inserted_count = 0
+        batch = []
+
+        try:
+            for record in records:
+                if not isinstance(record, dict):
+                    raise ValueError("JSON must be an array of objects")
+
+                # Clean each distinct key once
+                document = {}
+                for key, value in record.items():
+                    cleaned_key = key_map.get(key)
+                    if cleaned_key is None:
+                        cleaned_key = key_map[key] = clean_field_name(key)
+                    document[cleaned_key] = value
+                batch.append(document)
+
+                if len(batch) >= INSERT_BATCH_SIZE:
+                    inserted_count += _insert_json_batch(collection_name, batch, schema, sample_data)
+                    batch = []
+
+            if batch:
+                inserted_count += _insert_json_batch(collection_name, batch, schema, sample_data)
+        except Exception:
+            # Don't leave a partially imported collection behind
+            if inserted_count:
+                drop_collection(collection_name)
+            raise
+
+        if not inserted_count:
             raise ValueError("JSON array is empty")
 
-        # Convert to pandas DataFrame and back to clean the data
-        df = pd.DataFrame(data)
-
-        # Clean column names
-        df.columns = [col.lower().replace(' ', '_').replace('-', '_') for col in df.columns]
-
-        # Convert DataFrame to list of dictionaries
-        # Replace NaN with None for proper JSON serialization
-        df = df.where(pd.notnull(df), None)
-        documents = df.to_dict('records')
-
-        # Insert documents into MongoDB
-        inserted_count = insert_documents(collection_name, documents)
-
-        # Infer schema from documents
-        schema = infer_field_types(documents)
-
-        # Get sample data (first 5 documents)
-        sample_data = [convert_objectids_to_strings(doc) for doc in documents[:5]]
-
         return {
             'collection_name': collection_name,
             'schema': schema,
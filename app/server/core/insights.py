@@ -1,14 +1,170 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import List, Optional, Dict, Any
 from core.data_models import ColumnInsight
 from .mongo_security import validate_collection_name, validate_field_name, MongoSecurityError
-from .mongo_processor import execute_aggregation_pipeline, get_mongodb_connection
-import os
+from .mongo_processor import execute_aggregation_pipeline, get_mongodb_database
+from .file_processor import field_type_name
+from pymongo.collection import Collection
+
+# Upper bound on concurrent per-field aggregations; the work is I/O-bound so
+# threads spend most of their time waiting on MongoDB round-trips.
+MAX_INSIGHT_WORKERS = 16
+
+
+def build_field_insight_pipeline(field_name: str) -> List[Dict[str, Any]]:
+    """
+    Build a single $facet pipeline computing every statistic for one field
+
+    Args:
+        field_name: Name of the field to analyze
+
+    Returns:
+        Aggregation pipeline with 'distinct', 'nulls', 'stats' and 'common' facets
+    """
+    return [
+        {
+            "$facet": {
+                # Distinct count without materializing the set of values
+                "distinct": [
+                    {"$match": {field_name: {"$exists": True}}},
+                    {"$group": {"_id": f"${field_name}"}},
+                    {"$count": "unique_count"}
+                ],
+                # Null or missing values
+                "nulls": [
+                    {"$match": {field_name: None}},
+                    {"$count": "null_count"}
+                ],
+                # Min, max, avg over numeric values only
+                "stats": [
+                    {
+                        "$match": {
+                            field_name: {"$exists": True, "$ne": None, "$type": ["int", "double", "long", "decimal"]}
+                        }
+                    },
+                    {
+                        "$group": {
+                            "_id": None,
+                            "min_val": {"$min": f"${field_name}"},
+                            "max_val": {"$max": f"${field_name}"},
+                            "avg_val": {"$avg": f"${field_name}"}
+                        }
+                    }
+                ],
+                # Most common values (for all types)
+                "common": [
+                    {
+                        "$match": {
+                            field_name: {"$exists": True, "$ne": None}
+                        }
+                    },
+                    {
+                        "$sortByCount": f"${field_name}"
+                    },
+                    {
+                        "$limit": 5
+                    }
+                ]
+            }
+        }
+    ]
+
+
+@lru_cache(maxsize=1024)
+def _is_valid_field_name(field_name: str) -> bool:
+    """Check a field name against the security rules, memoized across requests"""
+    try:
+        validate_field_name(field_name)
+        return True
+    except MongoSecurityError:
+        return False
+
+
+def _probe_field_types(collection: Collection, field_names: List[str]) -> Dict[str, str]:
+    """
+    Determine field types from as few sample documents as possible
+
+    The first document having any of the fields set is probed first, so the
+    lookup stops at the first match even when fields are sparse or never
+    appear together; only fields that are missing or null in it fall back to
+    a per-field lookup.
+
+    Args:
+        collection: Collection to sample
+        field_names: Fields whose type should be determined
+
+    Returns:
+        Dictionary mapping field names to type names ('unknown' if never set)
+    """
+    probe_filter = {"$or": [{field_name: {"$exists": True, "$ne": None}} for field_name in field_names]}
+    probe_doc = collection.find_one(probe_filter, {field_name: 1 for field_name in field_names}) or {}
+
+    field_types = {}
+    for field_name in field_names:
+        field_value = probe_doc.get(field_name)
+        if field_value is None:
+            sample_doc = collection.find_one({field_name: {"$exists": True, "$ne": None}}, {field_name: 1})
+            field_value = sample_doc.get(field_name) if sample_doc else None
+
+        if field_value is None:
+            field_types[field_name] = "unknown"
+        else:
+            field_types[field_name] = field_type_name(field_value)
+
+    return field_types
+
+
+def _field_insight(collection_name: str, field_name: str, field_type: str) -> ColumnInsight:
+    """
+    Compute the insight for a single field with one aggregation round-trip
+
+    Args:
+        collection_name: Name of the (already validated) collection
+        field_name: Name of the (already validated) field to analyze
+        field_type: Type name of the field from the sample probe
+
+    Returns:
+        ColumnInsight for the field
+    """
+    try:
+        facet_result = execute_aggregation_pipeline(collection_name, build_field_insight_pipeline(field_name))
+        facets = facet_result[0] if facet_result else {}
+    except:
+        facets = {}
+
+    distinct_result = facets.get("distinct") or []
+    nulls_result = facets.get("nulls") or []
+    insight = ColumnInsight.model_construct(
+        column_name=field_name,
+        data_type=field_type,
+        unique_values=distinct_result[0]["unique_count"] if distinct_result else 0,
+        null_count=nulls_result[0]["null_count"] if nulls_result else 0
+    )
+
+    # Type-specific insights for numeric fields
+    stats_result = facets.get("stats") or []
+    if field_type in ['number', 'double'] and stats_result:
+        insight.min_value = stats_result[0].get("min_val")
+        insight.max_value = stats_result[0].get("max_val")
+        insight.avg_value = stats_result[0].get("avg_val")
+
+    common_result = facets.get("common") or []
+    if common_result:
+        insight.most_common = [
+            {"value": doc["_id"], "count": doc["count"]}
+            for doc in common_result
+        ]
+
+    return insight
 
 
 def generate_insights(collection_name: str, field_names: Optional[List[str]] = None) -> List[ColumnInsight]:
     """
     Generate statistical insights for MongoDB collection fields
 
+    Fields are analyzed concurrently, each with a single $facet aggregation.
+
     Args:
         collection_name: Name of the collection to analyze
         field_names: Optional list of specific fields to analyze
@@ -24,9 +180,7 @@ def generate_insights(collection_name: str, field_names: Optional[List[str]] = N
         validate_collection_name(collection_name)
 
         # Get database connection
-        client = get_mongodb_connection()
-        db_name = os.getenv("MONGODB_DATABASE", "nlq_interface")
-        db = client[db_name]
+        db = get_mongodb_database()
         collection = db[collection_name]
 
         # Sample documents to determine fields if not specified
@@ -34,159 +188,29 @@ def generate_insights(collection_name: str, field_names: Optional[List[str]] = N
             sample_doc = collection.find_one()
             if not sample_doc:
                 return []
-            field_names = [key for key in sample_doc.keys() if key != '_id']
+            # Skip fields with invalid names
+            field_names = [key for key in sample_doc.keys() if _is_valid_field_name(key)]
         else:
             # Validate provided field names
             for field in field_names:
-                try:
-                    validate_field_name(field)
-                except MongoSecurityError:
+                if not _is_valid_field_name(field):
                     raise Exception(f"Invalid field name: {field}")
 
-        insights = []
-
-        for field_name in field_names:
-            # Skip _id field
-            if field_name == '_id':
-                continue
-
-            # Validate field name
-            try:
-                validate_field_name(field_name)
-            except MongoSecurityError:
-                # Skip fields with invalid names
-                continue
-
-            # Get distinct count and null count using aggregation
-            distinct_pipeline = [
-                {
-                    "$group": {
-                        "_id": None,
-                        "unique_values": {"$addToSet": f"${field_name}"},
-                        "null_count": {
-                            "$sum": {
-                                "$cond": [
-                                    {"$or": [
-                                        {"$eq": [f"${field_name}", None]},
-                                        {"$eq": [{"$type": f"${field_name}"}, "missing"]}
-                                    ]},
-                                    1,
-                                    0
-                                ]
-                            }
-                        }
-                    }
-                },
-                {
-                    "$project": {
-                        "_id": 0,
-                        "unique_count": {"$size": "$unique_values"},
-                        "null_count": 1
-                    }
-                }
-            ]
-
-            try:
-                distinct_result = execute_aggregation_pipeline(collection_name, distinct_pipeline)
-                unique_values = distinct_result[0]["unique_count"] if distinct_result else 0
-                null_count = distinct_result[0]["null_count"] if distinct_result else 0
-            except:
-                unique_values = 0
-                null_count = 0
-
-            # Determine field type from sample document
-            sample_doc = collection.find_one({field_name: {"$exists": True, "$ne": None}})
-            field_type = "unknown"
-            if sample_doc and field_name in sample_doc:
-                field_value = sample_doc[field_name]
-                python_type = type(field_value).__name__
-                if python_type in ['int', 'int64']:
-                    field_type = 'number'
-                elif python_type in ['float', 'float64']:
-                    field_type = 'double'
-                elif python_type == 'bool':
-                    field_type = 'boolean'
-                elif python_type == 'list':
-                    field_type = 'array'
-                elif python_type == 'dict':
-                    field_type = 'object'
-                else:
-                    field_type = 'string'
-
-            insight = ColumnInsight(
-                column_name=field_name,
-                data_type=field_type,
-                unique_values=unique_values,
-                null_count=null_count
-            )
-
-            # Type-specific insights for numeric fields
-            if field_type in ['number', 'double']:
-                # Get min, max, avg using aggregation
-                stats_pipeline = [
-                    {
-                        "$match": {
-                            field_name: {"$exists": True, "$ne": None, "$type": ["int", "double", "long", "decimal"]}
-                        }
-                    },
-                    {
-                        "$group": {
-                            "_id": None,
-                            "min_val": {"$min": f"${field_name}"},
-                            "max_val": {"$max": f"${field_name}"},
-                            "avg_val": {"$avg": f"${field_name}"}
-                        }
-                    }
-                ]
-
-                try:
-                    stats_result = execute_aggregation_pipeline(collection_name, stats_pipeline)
-                    if stats_result:
-                        insight.min_value = stats_result[0].get("min_val")
-                        insight.max_value = stats_result[0].get("max_val")
-                        insight.avg_value = stats_result[0].get("avg_val")
-                except:
-                    pass  # Skip if aggregation fails
-
-            # Most common values (for all types)
-            common_pipeline = [
-                {
-                    "$match": {
-                        field_name: {"$exists": True, "$ne": None}
-                    }
-                },
-                {
-                    "$group": {
-                        "_id": f"${field_name}",
-                        "count": {"$sum": 1}
-                    }
-                },
-                {
-                    "$sort": {"count": -1}
-                },
-                {
-                    "$limit": 5
-                },
-                {
-                    "$project": {
-                        "value": "$_id",
-                        "count": 1,
-                        "_id": 0
-                    }
-                }
-            ]
-
-            try:
-                common_result = execute_aggregation_pipeline(collection_name, common_pipeline)
-                if common_result:
-                    insight.most_common = [
-                        {"value": doc["value"], "count": doc["count"]}
-                        for doc in common_result
-                    ]
-            except:
-                pass  # Skip if aggregation fails
-
-            insights.append(insight)
+        # Skip _id field
+        field_names = [field for field in field_names if field != '_id']
+        if not field_names:
+            return []
+
+        # Determine field types once for the whole request
+        field_types = _probe_field_types(collection, field_names)
+
+        # executor.map preserves the order of field_names
+        max_workers = min(MAX_INSIGHT_WORKERS, len(field_names))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            insights = list(executor.map(
+                lambda field_name: _field_insight(collection_name, field_name, field_types[field_name]),
+                field_names
+            ))
 
         return insights
 
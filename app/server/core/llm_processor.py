@@ -1,46 +1,30 @@
 import os
-import json
-from typing import Dict, Any, Union, List
-from openai import OpenAI
-from anthropic import Anthropic
+import hashlib
+import orjson
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Any, Union, List, Optional, Tuple
+from anthropic import AsyncAnthropic
+from openai import AsyncOpenAI
 from core.data_models import QueryRequest
 
 
-def generate_mongodb_query_with_openai(query_text: str, schema_info: Dict[str, Any]) -> Dict[str, Any]:
-    """
-    Generate MongoDB query using OpenAI API
+# Static instructions and examples shared by every provider. They come first
+# in the prompt so providers can cache them as a prefix across requests.
+OPENAI_SYSTEM_ROLE = "You are a MongoDB expert. Convert natural language to MongoDB queries. Always respond with valid JSON."
 
-    Returns a dictionary with:
-    - query_type: "find" or "aggregate"
-    - collection: collection name
-    - query: the actual MongoDB query (filter for find, pipeline for aggregate)
-    """
-    try:
-        # Get API key from environment
-        api_key = os.environ.get("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY environment variable not set")
-
-        client = OpenAI(api_key=api_key)
-
-        # Format schema for prompt
-        schema_description = format_schema_for_prompt(schema_info)
-
-        # Create prompt
-        prompt = f"""Given the following MongoDB collections:
-
-{schema_description}
-
-Convert this natural language query to a MongoDB query: "{query_text}"
+QUERY_INSTRUCTIONS = """You convert natural language queries into MongoDB queries.
 
 You must respond with a valid JSON object in this exact format:
-{{
+{
     "query_type": "find" or "aggregate",
     "collection": "collection_name",
-    "query": {{}} for find queries OR [] for aggregation pipelines,
-    "sort": {{}},
+    "query": {} for find queries OR [] for aggregation pipelines,
+    "sort": {},
     "limit": number
-}}
+}
 
 For simple queries, use "find" with a filter object.
 For complex queries (grouping, counting, aggregations), use "aggregate" with a pipeline array.
@@ -48,63 +32,63 @@ For complex queries (grouping, counting, aggregations), use "aggregate" with a p
 Examples:
 
 Simple query: "Show all products"
-{{
+{
     "query_type": "find",
     "collection": "products",
-    "query": {{}},
+    "query": {},
     "limit": 100
-}}
+}
 
 Filter query: "Find products with price greater than 50"
-{{
+{
     "query_type": "find",
     "collection": "products",
-    "query": {{"price": {{"$gt": 50}}}},
+    "query": {"price": {"$gt": 50}},
     "limit": 100
-}}
+}
 
 Aggregation: "Count users by country"
-{{
+{
     "query_type": "aggregate",
     "collection": "users",
     "query": [
-        {{"$group": {{"_id": "$country", "count": {{"$sum": 1}}}}}}
+        {"$group": {"_id": "$country", "count": {"$sum": 1}}}
     ]
-}}
+}
 
 Cross-collection query: "Show me users who can afford products over $500"
-{{
+{
     "query_type": "aggregate",
     "collection": "users",
     "query": [
-        {{"$match": {{"money": {{"$gte": 500}}}}}},
-        {{"$lookup": {{
+        {"$match": {"money": {"$gte": 500}}},
+        {"$lookup": {
             "from": "products",
-            "let": {{"user_money": "$money"}},
+            "let": {"user_money": "$money"},
             "pipeline": [
-                {{"$match": {{"$expr": {{"$lte": ["$price", "$$user_money"]}}}}}},
-                {{"$match": {{"price": {{"$gte": 500}}}}}}
+                {"$match": {"$expr": {"$lte": ["$price", "$$user_money"]}}},
+                {"$match": {"price": {"$gte": 500}}}
             ],
             "as": "affordable_products"
-        }}}},
-        {{"$match": {{"affordable_products": {{"$ne": []}}}}}}
+        }},
+        {"$match": {"affordable_products": {"$ne": []}}}
     ]
-}}
+}
 
 Cross-collection query: "Find products in cities where users live"
-{{
+{
     "query_type": "aggregate",
     "collection": "products",
     "query": [
-        {{"$lookup": {{
+        {"$lookup": {
             "from": "users",
             "localField": "location",
             "foreignField": "city",
             "as": "local_users"
-        }}}},
-        {{"$match": {{"local_users": {{"$ne": []}}}}}}
+        }},
+        {"$match": {"local_users": {"$ne": []}}}
     ]
-}}
+}
 
 MongoDB operators available:
 - Comparison: $eq, $ne, $gt, $gte, $lt, $lte, $in, $nin
@@ -116,195 +100,335 @@ MongoDB operators available:
 IMPORTANT: When a query requires data from multiple collections, use $lookup in an aggregation pipeline.
 Check the "Relationships between collections" section to find valid joins.
 Use query_type "aggregate" for cross-collection queries.
+"""
+
+# Per-database part of the prompt; it follows the instructions and stays the
+# same for every question until the schema changes
+QUERY_SCHEMA_TEMPLATE = """Given the following MongoDB collections:
+
+{schema}"""
+
+# Per-request part of the prompt, always last
+QUERY_REQUEST_TEMPLATE = """Convert this natural language query to a MongoDB query: "{query}"
 
 Return ONLY the JSON object, no explanations.
 """
 
-        # Call OpenAI API
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a MongoDB expert. Convert natural language to MongoDB queries. Always respond with valid JSON."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.1,
-            max_tokens=1000,
-            response_format={"type": "json_object"}
-        )
 
-        result_text = response.choices[0].message.content.strip()
+# Attempts each SDK makes after a transient failure (connection errors, 408,
+# 409, 429 and 5xx responses), with its own exponential backoff. Other errors
+# fail immediately and are reported to the caller.
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
 
-        # Parse JSON response
-        result = json.loads(result_text)
+# Async provider clients are created once per API key and reused so their
+# HTTP connection pools keep TLS sessions alive across requests. Clients for a
+# replaced key are kept rather than closed, since requests already in flight
+# may still be using them; close_llm_clients() releases them all at shutdown.
+# Being async, an in-flight LLM call does not hold a server thread.
+_openai_clients: Dict[str, AsyncOpenAI] = {}
+_anthropic_clients: Dict[str, AsyncAnthropic] = {}
+_client_lock = threading.Lock()
 
-        # Validate result structure
-        if "query_type" not in result or "collection" not in result or "query" not in result:
-            raise ValueError("Invalid query structure returned from LLM")
 
-        return result
+def get_openai_client(api_key: str) -> AsyncOpenAI:
+    """
+    Get or create the shared OpenAI client for the given API key
+    """
+    with _client_lock:
+        client = _openai_clients.get(api_key)
+        if client is None:
+            client = _openai_clients[api_key] = AsyncOpenAI(api_key=api_key, max_retries=LLM_MAX_RETRIES)
+        return client
 
-    except Exception as e:
-        raise Exception(f"Error generating MongoDB query with OpenAI: {str(e)}")
+
+def get_anthropic_client(api_key: str) -> AsyncAnthropic:
+    """
+    Get or create the shared Anthropic client for the given API key
+    """
+    with _client_lock:
+        client = _anthropic_clients.get(api_key)
+        if client is None:
+            client = _anthropic_clients[api_key] = AsyncAnthropic(api_key=api_key, max_retries=LLM_MAX_RETRIES)
+        return client
+
+
+def reset_llm_clients():
+    """Drop the shared provider clients so the next call creates new ones"""
+    with _client_lock:
+        _openai_clients.clear()
+        _anthropic_clients.clear()
 
 
-def generate_mongodb_query_with_anthropic(query_text: str, schema_info: Dict[str, Any]) -> Dict[str, Any]:
+async def close_llm_clients():
+    """Close every shared provider client and its connection pool (app shutdown)"""
+    with _client_lock:
+        clients = [*_openai_clients.values(), *_anthropic_clients.values()]
+        _openai_clients.clear()
+        _anthropic_clients.clear()
+
+    for client in clients:
+        await client.close()
+
+
+# Generated queries keyed by (provider, prompt digest). The prompt embeds both
+# the schema description and the question, so a schema change never hits a
+# stale entry; those simply age out of the LRU. Entries also expire after
+# QUERY_CACHE_TTL_SECONDS so provider or model updates are eventually picked
+# up. Results are stored as JSON bytes so every hit hands the caller its own
+# copy to mutate.
+QUERY_CACHE_SIZE = 1024
+QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "3600"))
+# key -> (monotonic timestamp, encoded query)
+_query_cache: "OrderedDict[Tuple[str, bytes], Tuple[float, bytes]]" = OrderedDict()
+_query_cache_lock = threading.Lock()
+
+
+def _query_cache_key(provider: str, prefix: str, query_text: str) -> Tuple[str, bytes]:
     """
-    Generate MongoDB query using Anthropic API
+    Cache key for a provider, prompt prefix and question (not cryptographic)
+
+    Whitespace in the question is collapsed so that re-typed questions
+    differing only in spacing share an entry; letter case is kept because it
+    can matter inside values ("named Alice").
+    """
+    digest = hashlib.blake2b(prefix.encode(), digest_size=16)
+    digest.update(b"\0")
+    digest.update(" ".join(query_text.split()).encode())
+    return provider, digest.digest()
+
+
+def _get_cached_query(key: Tuple[str, bytes]) -> Optional[Dict[str, Any]]:
+    """Return a fresh copy of a previously generated query, or None"""
+    with _query_cache_lock:
+        cached = _query_cache.get(key)
+        if cached is None:
+            return None
+        if time.monotonic() - cached[0] >= QUERY_CACHE_TTL_SECONDS:
+            del _query_cache[key]
+            return None
+        _query_cache.move_to_end(key)
+    return orjson.loads(cached[1])
+
+
+def _cache_query(key: Tuple[str, bytes], result: Dict[str, Any]) -> None:
+    """Remember a generated query, evicting the least recently used entry"""
+    entry = (time.monotonic(), orjson.dumps(result))
+    with _query_cache_lock:
+        _query_cache[key] = entry
+        _query_cache.move_to_end(key)
+        if len(_query_cache) > QUERY_CACHE_SIZE:
+            _query_cache.popitem(last=False)
+
+
+def clear_query_cache():
+    """Forget every generated query"""
+    with _query_cache_lock:
+        _query_cache.clear()
+
+
+def build_query_prompt_parts(query_text: str, schema_info: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    Split the query-generation prompt into its reusable prefix and the question
+
+    The prefix (instructions, then schema) only changes with the schema, so
+    providers can serve it from their prompt cache on repeated questions.
+    """
+    schema_description = format_schema_for_prompt(schema_info)
+    prefix = QUERY_INSTRUCTIONS + "\n" + QUERY_SCHEMA_TEMPLATE.format(schema=schema_description)
+    return prefix, QUERY_REQUEST_TEMPLATE.format(query=query_text)
+
+
+def build_query_prompt(query_text: str, schema_info: Dict[str, Any]) -> str:
+    """
+    Build the query-generation prompt shared by every provider
+    """
+    return "\n\n".join(build_query_prompt_parts(query_text, schema_info))
+
+
+async def _call_openai(prefix: str, request_text: str, api_key: str) -> str:
+    """
+    Send the prompt to OpenAI and return the raw response text
+
+    OpenAI caches long prompt prefixes automatically on an exact match, so
+    the instructions and schema make up the whole system message and the
+    question is the only content that varies between calls.
+    """
+    client = get_openai_client(api_key)
+
+    response = await client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": OPENAI_SYSTEM_ROLE + "\n\n" + prefix},
+            {"role": "user", "content": request_text}
+        ],
+        temperature=0.1,
+        max_tokens=1000,
+        response_format={"type": "json_object"}
+    )
+
+    return response.choices[0].message.content
+
+
+async def _call_anthropic(prefix: str, request_text: str, api_key: str) -> str:
+    """
+    Send the prompt to Anthropic and return the raw response text
+
+    The prefix goes in the system prompt marked with an ephemeral
+    cache_control breakpoint, so repeat questions against the same schema
+    reuse it instead of paying for those input tokens again.
+    """
+    client = get_anthropic_client(api_key)
+
+    response = await client.messages.create(
+        model="claude-3-5-haiku-20241022",
+        max_tokens=1000,
+        temperature=0.1,
+        system=[
+            {"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}}
+        ],
+        messages=[
+            {"role": "user", "content": request_text}
+        ]
+    )
+
+    return response.content[0].text
+
+
+# provider -> (display name, API key environment variable, transport call)
+_PROVIDERS = {
+    "openai": ("OpenAI", "OPENAI_API_KEY", _call_openai),
+    "anthropic": ("Anthropic", "ANTHROPIC_API_KEY", _call_anthropic),
+}
+
+
+def parse_query_response(result_text: str) -> Dict[str, Any]:
+    """
+    Parse the LLM response text into a MongoDB query dictionary
+
+    Raises:
+        ValueError: If the response does not have the expected structure
+    """
+    result_text = result_text.strip()
+
+    # Clean up markdown if present (plain str operations, no regex)
+    result_text = result_text.removeprefix("```json").removeprefix("```").removesuffix("```")
+
+    # Parse JSON response
+    result = orjson.loads(result_text.strip())
+
+    # Validate result structure
+    if "query_type" not in result or "collection" not in result or "query" not in result:
+        raise ValueError("Invalid query structure returned from LLM")
+
+    return result
+
+
+async def generate_mongodb_query_with_provider(provider: str, query_text: str, schema_info: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Generate MongoDB query using the given LLM provider ("openai" or "anthropic")
 
     Returns a dictionary with:
     - query_type: "find" or "aggregate"
     - collection: collection name
     - query: the actual MongoDB query (filter for find, pipeline for aggregate)
+
+    Repeating a question against an unchanged schema returns the cached query
+    without calling the provider; the caller still validates it before use.
     """
+    display_name, api_key_env, call_provider = _PROVIDERS[provider]
+
     try:
         # Get API key from environment
-        api_key = os.environ.get("ANTHROPIC_API_KEY")
+        api_key = os.environ.get(api_key_env)
         if not api_key:
-            raise ValueError("ANTHROPIC_API_KEY environment variable not set")
-
-        client = Anthropic(api_key=api_key)
+            raise ValueError(f"{api_key_env} environment variable not set")
 
-        # Format schema for prompt
-        schema_description = format_schema_for_prompt(schema_info)
+        prefix, request_text = build_query_prompt_parts(query_text, schema_info)
+        cache_key = _query_cache_key(provider, prefix, query_text)
+        cached = _get_cached_query(cache_key)
+        if cached is not None:
+            return cached
 
-        # Create prompt
-        prompt = f"""Given the following MongoDB collections:
-
-{schema_description}
-
-Convert this natural language query to a MongoDB query: "{query_text}"
+        result = parse_query_response(await call_provider(prefix, request_text, api_key))
+        _cache_query(cache_key, result)
+        return result
 
-You must respond with a valid JSON object in this exact format:
-{{
-    "query_type": "find" or "aggregate",
-    "collection": "collection_name",
-    "query": {{}} for find queries OR [] for aggregation pipelines,
-    "sort": {{}},
-    "limit": number
-}}
+    except Exception as e:
+        raise Exception(f"Error generating MongoDB query with {display_name}: {str(e)}")
 
-For simple queries, use "find" with a filter object.
-For complex queries (grouping, counting, aggregations), use "aggregate" with a pipeline array.
 
-Examples:
+async def generate_mongodb_query_with_openai(query_text: str, schema_info: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Generate MongoDB query using OpenAI API
+    """
+    return await generate_mongodb_query_with_provider("openai", query_text, schema_info)
 
-Simple query: "Show all products"
-{{
-    "query_type": "find",
-    "collection": "products",
-    "query": {{}},
-    "limit": 100
-}}
 
-Filter query: "Find products with price greater than 50"
-{{
-    "query_type": "find",
-    "collection": "products",
-    "query": {{"price": {{"$gt": 50}}}},
-    "limit": 100
-}}
+async def generate_mongodb_query_with_anthropic(query_text: str, schema_info: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Generate MongoDB query using Anthropic API
+    """
+    return await generate_mongodb_query_with_provider("anthropic", query_text, schema_info)
 
-Aggregation: "Count users by country"
-{{
-    "query_type": "aggregate",
-    "collection": "users",
-    "query": [
-        {{"$group": {{"_id": "$country", "count": {{"$sum": 1}}}}}}
-    ]
-}}
 
-Cross-collection query: "Show me users who can afford products over $500"
-{{
-    "query_type": "aggregate",
-    "collection": "users",
-    "query": [
-        {{"$match": {{"money": {{"$gte": 500}}}}}},
-        {{"$lookup": {{
-            "from": "products",
-            "let": {{"user_money": "$money"}},
-            "pipeline": [
-                {{"$match": {{"$expr": {{"$lte": ["$price", "$$user_money"]}}}}}},
-                {{"$match": {{"price": {{"$gte": 500}}}}}}
-            ],
-            "as": "affordable_products"
-        }}}},
-        {{"$match": {{"affordable_products": {{"$ne": []}}}}}}
-    ]
-}}
+class _SchemaPromptKey:
+    """
+    Hashable handle on a schema, compared by content fingerprint so that
+    format_schema_for_prompt can be memoized with functools.lru_cache
+    """
+    __slots__ = ('digest', 'collections', 'relationships')
 
-Cross-collection query: "Find products in cities where users live"
-{{
-    "query_type": "aggregate",
-    "collection": "products",
-    "query": [
-        {{"$lookup": {{
-            "from": "users",
-            "localField": "location",
-            "foreignField": "city",
-            "as": "local_users"
-        }}}},
-        {{"$match": {{"local_users": {{"$ne": []}}}}}}
-    ]
-}}
+    def __init__(self, collections: Dict[str, Any], relationships: List[Any]):
+        self.digest = _schema_fingerprint(collections, relationships)
+        self.collections = collections
+        self.relationships = relationships
 
-MongoDB operators available:
-- Comparison: $eq, $ne, $gt, $gte, $lt, $lte, $in, $nin
-- Logical: $and, $or, $not, $nor
-- Aggregation stages: $match, $group, $sort, $limit, $project, $count, $lookup
-- Aggregation operators: $sum, $avg, $min, $max, $count
-- For cross-collection queries: Use $lookup stage in aggregation pipeline
+    def __hash__(self) -> int:
+        return hash(self.digest)
 
-IMPORTANT: When a query requires data from multiple collections, use $lookup in an aggregation pipeline.
-Check the "Relationships between collections" section to find valid joins.
-Use query_type "aggregate" for cross-collection queries.
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, _SchemaPromptKey) and self.digest == other.digest
 
-Return ONLY the JSON object, no explanations.
-"""
 
-        # Call Anthropic API
-        response = client.messages.create(
-            model="claude-3-5-haiku-20241022",
-            max_tokens=1000,
-            temperature=0.1,
-            messages=[
-                {"role": "user", "content": prompt}
-            ]
-        )
-
-        result_text = response.content[0].text.strip()
-
-        # Clean up markdown if present
-        if result_text.startswith("```json"):
-            result_text = result_text[7:]
-        if result_text.startswith("```"):
-            result_text = result_text[3:]
-        if result_text.endswith("```"):
-            result_text = result_text[:-3]
-
-        # Parse JSON response
-        result = json.loads(result_text.strip())
-
-        # Validate result structure
-        if "query_type" not in result or "collection" not in result or "query" not in result:
-            raise ValueError("Invalid query structure returned from LLM")
+def _fingerprint_default(value: Any) -> Any:
+    """JSON fallback for fingerprinting: dump Pydantic models, stringify the rest"""
+    if hasattr(value, 'model_dump'):
+        return value.model_dump(mode='json')
+    return str(value)
 
-        return result
 
-    except Exception as e:
-        raise Exception(f"Error generating MongoDB query with Anthropic: {str(e)}")
+def _schema_fingerprint(collections: Dict[str, Any], relationships: List[Any]) -> bytes:
+    """
+    Content fingerprint of a schema and its relationships (not cryptographic)
+    """
+    payload = orjson.dumps([collections, relationships], default=_fingerprint_default, option=orjson.OPT_NON_STR_KEYS)
+    return hashlib.blake2b(payload, digest_size=16).digest()
 
 
 def format_schema_for_prompt(schema_info: Dict[str, Any], relationships: List[Any] = None) -> str:
     """
     Format MongoDB database schema for LLM prompt, including relationship information
-    """
-    lines = []
 
+    Results are memoized on a fingerprint of the schema content, so repeated
+    queries against an unchanged database skip the formatting work.
+    """
     # Handle new format where schema_info might have 'collections' key
     collections = schema_info.get('collections', schema_info)
     if relationships is None:
         relationships = schema_info.get('relationships', [])
 
+    return _format_schema_cached(_SchemaPromptKey(collections, relationships))
+
+
+@lru_cache(maxsize=32)
+def _format_schema_cached(key: _SchemaPromptKey) -> str:
+    """
+    Render the schema description for a fingerprinted schema
+    """
+    lines = []
+    collections = key.collections
+    relationships = key.relationships
+
     for collection_name, collection_info in collections.items():
         lines.append(f"Collection: {collection_name}")
         lines.append(f"Document count: {collection_info.get('count', 0)}")
@@ -312,15 +436,16 @@ def format_schema_for_prompt(schema_info: Dict[str, Any], relationships: List[An
 
         fields = collection_info.get('fields', {})
         for field_name, field_info in fields.items():
+            if field_name == '_id':
+                continue
             field_type = field_info.get('type', 'unknown')
             sample = field_info.get('sample', '')
-            if field_name != '_id':
-                lines.append(f"  - {field_name} ({field_type}) - example: {sample}")
+            lines.append(f"  - {field_name} ({field_type}) - example: {sample}")
 
         lines.append("")
 
     # Add relationships section
-    if relationships and len(relationships) > 0:
+    if relationships:
         lines.append("Relationships between collections:")
         for rel in relationships:
             # Handle both dict and object formats
@@ -341,7 +466,7 @@ def format_schema_for_prompt(schema_info: Dict[str, Any], relationships: List[An
     return "\n".join(lines)
 
 
-def generate_mongodb_query(request: QueryRequest, schema_info: Dict[str, Any]) -> Dict[str, Any]:
+async def generate_mongodb_query(request: QueryRequest, schema_info: Dict[str, Any]) -> Dict[str, Any]:
     """
     Route to appropriate LLM provider based on API key availability and request preference.
     Priority: 1) OpenAI API key exists, 2) Anthropic API key exists, 3) request.llm_provider
@@ -351,12 +476,12 @@ def generate_mongodb_query(request: QueryRequest, schema_info: Dict[str, Any]) -
 
     # Check API key availability first (OpenAI priority)
     if openai_key:
-        return generate_mongodb_query_with_openai(request.query, schema_info)
+        return await generate_mongodb_query_with_openai(request.query, schema_info)
     elif anthropic_key:
-        return generate_mongodb_query_with_anthropic(request.query, schema_info)
+        return await generate_mongodb_query_with_anthropic(request.query, schema_info)
 
     # Fall back to request preference if both keys available or neither available
     if request.llm_provider == "openai":
-        return generate_mongodb_query_with_openai(request.query, schema_info)
+        return await generate_mongodb_query_with_openai(request.query, schema_info)
     else:
-        return generate_mongodb_query_with_anthropic(request.query, schema_info)
+        return await generate_mongodb_query_with_anthropic(request.query, schema_info)
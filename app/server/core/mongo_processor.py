@@ -5,11 +5,19 @@ This module handles all MongoDB database operations including connection managem
 query execution, schema retrieval, and collection statistics.
 """
 
+import base64
 import os
-from typing import Any, Dict, List, Optional
-from pymongo import MongoClient
-from pymongo.errors import PyMongoError, ConnectionFailure, OperationFailure
-from bson import ObjectId
+import time
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from pymongo import AsyncMongoClient, MongoClient, WriteConcern
+from pymongo.asynchronous.database import AsyncDatabase
+from pymongo.database import Database
+from pymongo.errors import BulkWriteError, PyMongoError, ConnectionFailure, OperationFailure
+from bson import Decimal128, ObjectId
+from bson.codec_options import CodecOptions, TypeDecoder, TypeRegistry
 from dotenv import load_dotenv
 
 from .mongo_security import (
@@ -27,31 +35,161 @@ load_dotenv()
 # Global MongoDB client (singleton pattern for connection pooling)
 _mongo_client: Optional[MongoClient] = None
 
+# Default database handle, cached alongside the client
+_mongo_db: Optional[Database] = None
+
+# Async client for request handlers running on the event loop
+_async_mongo_client: Optional[AsyncMongoClient] = None
+
+# Default database handle on the async client
+_async_mongo_db: Optional[AsyncDatabase] = None
+
+# Number of documents sent per insert_many call during bulk uploads
+INSERT_BATCH_SIZE = 1000
+
+# Uploads are acknowledged by the primary alone instead of the server default
+# (majority on replica sets); a failed import is simply uploaded again
+IMPORT_WRITE_CONCERN = WriteConcern(w=1)
+
+# Number of documents sampled per collection to infer its schema
+SCHEMA_SAMPLE_SIZE = 10
+
+# Top-level sample values are trimmed server-side to keep schema payloads small
+SAMPLE_STRING_LENGTH = 256
+SAMPLE_ARRAY_LENGTH = 3
+
+# Upper bound on concurrent collection samples in get_database_schema
+MAX_SCHEMA_WORKERS = 16
+
+# How long get_database_schema may serve a cached result
+SCHEMA_CACHE_TTL_SECONDS = float(os.getenv("SCHEMA_TTL_SECONDS", "60"))
+
+# (monotonic timestamp, schema) of the last get_database_schema result
+_schema_cache: Optional[Tuple[float, Dict[str, Any]]] = None
+
+# Schema field types and the relationships detected for them; reused across
+# schema rebuilds until the field types change
+_relationship_cache: Optional[Tuple[Dict[str, Dict[str, str]], List[Any]]] = None
+
+
+class _ObjectIdAsString(TypeDecoder):
+    """Decode BSON ObjectIds straight to their hex string"""
+    bson_type = ObjectId
+
+    def transform_bson(self, value: ObjectId) -> str:
+        return str(value)
+
+
+# Codec options for query results headed to JSON responses: ObjectIds are
+# decoded as strings by the driver, so no post-processing walk is needed
+JSON_CODEC_OPTIONS = CodecOptions(type_registry=TypeRegistry([_ObjectIdAsString()]))
+
+
+# Leaf types that can never hold an ObjectId, skipped without isinstance
+_SCALAR_TYPES = frozenset({str, int, float, bool, type(None)})
+
 
 def convert_objectids_to_strings(data: Any) -> Any:
     """
-    Recursively convert all BSON ObjectId instances to strings in a data structure.
+    Convert all BSON ObjectId instances to strings in a data structure.
 
-    This function traverses dictionaries, lists, and nested structures to find and
-    convert any ObjectId instances to their string representation, making the data
-    JSON-serializable for FastAPI/Pydantic responses.
+    Dictionaries and lists are walked with an explicit stack and updated in
+    place, so documents fresh off a cursor are converted without copying
+    every container. This makes the data JSON-serializable for
+    FastAPI/Pydantic responses.
+
+    Query results skip this walk entirely (see JSON_CODEC_OPTIONS); it only
+    handles small payloads such as schema samples and index specs.
 
     Args:
         data: Any data structure (dict, list, ObjectId, or primitive type)
 
     Returns:
-        A new data structure with all ObjectIds converted to strings.
-        Primitive types are returned as-is.
+        The same data structure with all ObjectIds converted to strings.
+        A bare ObjectId is returned as a string; primitives are returned as-is.
     """
     if isinstance(data, ObjectId):
-        return str(data)
-    elif isinstance(data, dict):
-        return {key: convert_objectids_to_strings(value) for key, value in data.items()}
-    elif isinstance(data, list):
-        return [convert_objectids_to_strings(item) for item in data]
-    else:
+        return data.binary.hex()
+    if not isinstance(data, (dict, list)):
         return data
 
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        items = node.items() if isinstance(node, dict) else enumerate(node)
+        for key, value in items:
+            # Exact type checks cover plain documents; isinstance only runs
+            # for scalars and subclasses such as SON or custom ObjectIds.
+            # binary.hex() is what str(ObjectId) returns, minus the dispatch
+            value_type = type(value)
+            if value_type is dict or value_type is list:
+                stack.append(value)
+            elif value_type is ObjectId:
+                node[key] = value.binary.hex()
+            elif value_type in _SCALAR_TYPES:
+                continue
+            elif isinstance(value, (dict, list)):
+                stack.append(value)
+            elif isinstance(value, ObjectId):
+                node[key] = value.binary.hex()
+
+    return data
+
+
+def _client_options() -> Dict[str, Any]:
+    """Connection pool, timeout and compression settings shared by both clients"""
+    return {
+        "serverSelectionTimeoutMS": 5000,
+        "connectTimeoutMS": 5000,
+        "maxPoolSize": int(os.getenv("MONGODB_MAX_POOL_SIZE", "50")),
+        "minPoolSize": int(os.getenv("MONGODB_MIN_POOL_SIZE", "5")),
+        "maxIdleTimeMS": 60_000,
+        # zstd/snappy can be listed first when their modules are installed;
+        # the server picks the first compressor it also supports
+        "compressors": os.getenv("MONGODB_COMPRESSORS", "zlib"),
+        "appname": "nlq-interface",
+        "retryReads": True,
+    }
+
+
+def to_json_bytes(data: Any) -> bytes:
+    """
+    Serialize query results to JSON in a single orjson pass.
+
+    datetimes are handled natively; ObjectId and Decimal128 values that reach
+    this point are written as strings instead of needing a conversion walk.
+
+    Args:
+        data: JSON-like structure of query results
+
+    Returns:
+        UTF-8 encoded JSON
+    """
+    return orjson.dumps(data, default=_json_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _json_default(value: Any) -> Any:
+    """
+    orjson fallback for BSON types without a native JSON form
+
+    bytes and bson.Binary are decoded as UTF-8 like FastAPI's encoder does,
+    falling back to base64 for non-text payloads. Other bson scalars
+    (Timestamp, Regex, MinKey, ...) are written as their str(); anything
+    else is still rejected.
+    """
+    if type(value) is ObjectId:
+        return value.binary.hex()
+    if isinstance(value, (ObjectId, Decimal128)):
+        return str(value)
+    if isinstance(value, bytes):
+        try:
+            return value.decode()
+        except UnicodeDecodeError:
+            return base64.b64encode(value).decode("ascii")
+    if type(value).__module__.startswith("bson."):
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
 
 def get_mongodb_connection() -> MongoClient:
     """
@@ -68,11 +206,7 @@ def get_mongodb_connection() -> MongoClient:
     if _mongo_client is None:
         mongodb_uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
         try:
-            _mongo_client = MongoClient(
-                mongodb_uri,
-                serverSelectionTimeoutMS=5000,
-                connectTimeoutMS=5000,
-            )
+            _mongo_client = MongoClient(mongodb_uri, **_client_options())
             # Test the connection
             _mongo_client.admin.command('ping')
         except ConnectionFailure as e:
@@ -81,12 +215,160 @@ def get_mongodb_connection() -> MongoClient:
     return _mongo_client
 
 
+def get_mongodb_database() -> Database:
+    """
+    Get the application database (MONGODB_DATABASE) on the shared client.
+
+    Returns:
+        Database handle, cached until the client changes or is closed
+
+    Raises:
+        ConnectionFailure: If unable to connect to MongoDB
+    """
+    global _mongo_db
+
+    client = get_mongodb_connection()
+    if _mongo_db is None or _mongo_db.client is not client:
+        _mongo_db = client[os.getenv("MONGODB_DATABASE", "nlq_interface")]
+
+    return _mongo_db
+
+
 def close_mongodb_connection():
     """Close the MongoDB connection if it exists"""
-    global _mongo_client
+    global _mongo_client, _mongo_db
     if _mongo_client is not None:
         _mongo_client.close()
         _mongo_client = None
+    _mongo_db = None
+
+
+def get_async_mongodb_database() -> AsyncDatabase:
+    """
+    Get the application database on the shared async client.
+
+    The client connects lazily on its first operation, so this never blocks.
+
+    Returns:
+        AsyncDatabase handle for MONGODB_DATABASE, cached with the client
+    """
+    global _async_mongo_client, _async_mongo_db
+
+    if _async_mongo_client is None:
+        mongodb_uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
+        _async_mongo_client = AsyncMongoClient(mongodb_uri, **_client_options())
+        _async_mongo_db = _async_mongo_client[os.getenv("MONGODB_DATABASE", "nlq_interface")]
+
+    return _async_mongo_db
+
+
+async def close_async_mongodb_connection():
+    """Close the async MongoDB client if it exists"""
+    global _async_mongo_client, _async_mongo_db
+    if _async_mongo_client is not None:
+        await _async_mongo_client.close()
+        _async_mongo_client = None
+    _async_mongo_db = None
+
+
+def _iter_cursor(cursor, error_message: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yield documents from a cursor, rewrapping OperationFailure.
+
+    PyMongo fetches the cursor in batches, so only the current batch is held
+    in memory while iterating.
+
+    Args:
+        cursor: PyMongo cursor or command cursor
+        error_message: Prefix for OperationFailure raised during iteration
+
+    Yields:
+        Documents as decoded by the cursor
+    """
+    try:
+        yield from cursor
+    except OperationFailure as e:
+        raise OperationFailure(f"{error_message}: {str(e)}")
+
+
+def _validate_find_arguments(
+    collection_name: str,
+    filter_query: Optional[Dict[str, Any]],
+    projection: Optional[Dict[str, Any]],
+    sort: Optional[Dict[str, int]]
+) -> Dict[str, Any]:
+    """
+    Validate the inputs of a find query.
+
+    Returns:
+        The filter query, defaulting to {}
+
+    Raises:
+        MongoSecurityError: If validation fails
+    """
+    validate_collection_name(collection_name)
+
+    if filter_query is None:
+        filter_query = {}
+
+    if filter_query:
+        validate_query_structure(filter_query)
+
+    if projection:
+        validate_projection(projection)
+
+    if sort:
+        validate_sort_specification(sort)
+
+    return filter_query
+
+
+def iter_mongodb_query(
+    collection_name: str,
+    filter_query: Optional[Dict[str, Any]] = None,
+    projection: Optional[Dict[str, Any]] = None,
+    sort: Optional[Dict[str, int]] = None,
+    limit: int = 100,
+    batch_size: Optional[int] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Execute a MongoDB find query safely and stream the results.
+
+    Inputs are validated before this returns; documents are fetched lazily.
+
+    Args:
+        collection_name: Name of the collection to query
+        filter_query: MongoDB filter query dictionary (default: {})
+        projection: Fields to include/exclude in results
+        sort: Sort specification (field -> direction mapping)
+        limit: Maximum number of documents to return
+        batch_size: Documents per server round-trip (default: driver default)
+
+    Returns:
+        Iterator over documents matching the query, with ObjectIds as strings
+
+    Raises:
+        MongoSecurityError: If validation fails
+        OperationFailure: If the query fails
+    """
+    filter_query = _validate_find_arguments(collection_name, filter_query, projection, sort)
+
+    # Get database
+    db = get_mongodb_database()
+    collection = db.get_collection(collection_name, codec_options=JSON_CODEC_OPTIONS)
+
+    # Build cursor
+    cursor = collection.find(filter_query, projection)
+
+    if sort:
+        cursor = cursor.sort(list(sort.items()))
+
+    cursor = cursor.limit(limit)
+
+    if batch_size:
+        cursor = cursor.batch_size(batch_size)
+
+    return _iter_cursor(cursor, "MongoDB query failed")
 
 
 def execute_mongodb_query(
@@ -113,47 +395,152 @@ def execute_mongodb_query(
         MongoSecurityError: If validation fails
         OperationFailure: If the query fails
     """
-    # Validate inputs
-    validate_collection_name(collection_name)
+    return list(iter_mongodb_query(collection_name, filter_query, projection, sort, limit))
 
-    if filter_query is None:
-        filter_query = {}
 
-    if filter_query:
-        validate_query_structure(filter_query)
+# Logical operators whose sub-queries still reference the document's own fields
+_MATCH_LOGICAL_OPERATORS = frozenset({"$and", "$or", "$nor"})
 
-    if projection:
-        validate_projection(projection)
 
-    if sort:
-        validate_sort_specification(sort)
+def _match_field_paths(query: Dict[str, Any]) -> Optional[set]:
+    """
+    Collect the field paths a $match filter reads.
 
-    # Get database
-    client = get_mongodb_connection()
-    db_name = os.getenv("MONGODB_DATABASE", "nlq_interface")
-    db = client[db_name]
-    collection = db[collection_name]
+    Returns:
+        Set of dotted field paths, or None when the filter uses an operator
+        (such as $expr or $text) whose dependencies can't be determined
+    """
+    paths = set()
+    stack = [query]
+    while stack:
+        node = stack.pop()
+        for key, value in node.items():
+            if key in _MATCH_LOGICAL_OPERATORS and isinstance(value, list):
+                stack.extend(item for item in value if isinstance(item, dict))
+            elif key.startswith("$"):
+                return None
+            else:
+                paths.add(key)
+    return paths
+
+
+def _paths_overlap(paths: set, field: str) -> bool:
+    """Check whether any path equals, contains or lies under the given field"""
+    return any(
+        path == field or path.startswith(field + ".") or field.startswith(path + ".")
+        for path in paths
+    )
+
+
+def _stage_outputs(stage: Dict[str, Any]) -> Optional[List[str]]:
+    """
+    Return the fields a $lookup or $unwind stage writes, or None for other stages.
 
-    try:
-        # Build cursor
-        cursor = collection.find(filter_query, projection)
+    Malformed specs also give None, so nothing is reordered around them and
+    MongoDB reports the error when the pipeline runs.
+    """
+    if "$lookup" in stage:
+        spec = stage["$lookup"]
+        output = spec.get("as") if isinstance(spec, dict) else None
+        return [output] if isinstance(output, str) else None
+    if "$unwind" in stage:
+        spec = stage["$unwind"]
+        if isinstance(spec, str):
+            return [spec.lstrip("$")]
+        path = spec.get("path") if isinstance(spec, dict) else None
+        if not isinstance(path, str):
+            return None
+        index_field = spec.get("includeArrayIndex")
+        if index_field is not None and not isinstance(index_field, str):
+            return None
+        outputs = [path.lstrip("$")]
+        if index_field:
+            outputs.append(index_field)
+        return outputs
+    return None
+
+
+def _optimize_pipeline(pipeline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Rewrite a validated pipeline so filters run as early as possible.
 
-        if sort:
-            cursor = cursor.sort(list(sort.items()))
+    Each $match is moved above preceding $lookup and $unwind stages whose
+    output fields it does not read, so fewer documents flow through the
+    joins, and adjacent $match stages are merged with $and. Results are
+    unchanged because those stages never alter the fields being filtered.
 
-        cursor = cursor.limit(limit)
+    Args:
+        pipeline: Aggregation stages, already validated
 
-        # Convert cursor to list and handle ObjectId serialization
-        results = []
-        for doc in cursor:
-            # Convert all ObjectIds to strings for JSON serialization
-            doc = convert_objectids_to_strings(doc)
-            results.append(doc)
+    Returns:
+        A new, equivalent list of stages
+    """
+    optimized: List[Dict[str, Any]] = []
 
-        return results
+    for stage in pipeline:
+        if "$match" not in stage:
+            optimized.append(stage)
+            continue
 
+        match = stage["$match"]
+        paths = _match_field_paths(match)
+        position = len(optimized)
+
+        if paths is not None:
+            while position > 0:
+                outputs = _stage_outputs(optimized[position - 1])
+                if outputs is None or any(_paths_overlap(paths, field) for field in outputs):
+                    break
+                position -= 1
+
+        previous = optimized[position - 1] if position > 0 else None
+        if previous is not None and "$match" in previous:
+            optimized[position - 1] = {"$match": {"$and": [previous["$match"], match]}}
+        else:
+            optimized.insert(position, stage)
+
+    return optimized
+
+
+def iter_aggregation_pipeline(
+    collection_name: str,
+    pipeline: List[Dict[str, Any]],
+    batch_size: Optional[int] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Execute a MongoDB aggregation pipeline safely and stream the results.
+
+    Args:
+        collection_name: Name of the collection to query
+        pipeline: List of aggregation stages
+        batch_size: Documents per server round-trip (default: driver default)
+
+    Returns:
+        Iterator over documents from the aggregation result, with ObjectIds as strings
+
+    Raises:
+        MongoSecurityError: If validation fails
+        OperationFailure: If the aggregation fails
+    """
+    # Validate inputs
+    validate_collection_name(collection_name)
+    validate_aggregation_pipeline(pipeline)
+    pipeline = _optimize_pipeline(pipeline)
+
+    # Get database
+    db = get_mongodb_database()
+    collection = db.get_collection(collection_name, codec_options=JSON_CODEC_OPTIONS)
+
+    try:
+        # aggregate() runs the pipeline and fetches the first batch immediately
+        if batch_size:
+            cursor = collection.aggregate(pipeline, batchSize=batch_size)
+        else:
+            cursor = collection.aggregate(pipeline)
     except OperationFailure as e:
-        raise OperationFailure(f"MongoDB query failed: {str(e)}")
+        raise OperationFailure(f"MongoDB aggregation failed: {str(e)}")
+
+    return _iter_cursor(cursor, "MongoDB aggregation failed")
 
 
 def execute_aggregation_pipeline(
@@ -174,43 +561,252 @@ def execute_aggregation_pipeline(
         MongoSecurityError: If validation fails
         OperationFailure: If the aggregation fails
     """
-    # Validate inputs
-    validate_collection_name(collection_name)
-    validate_aggregation_pipeline(pipeline)
+    return list(iter_aggregation_pipeline(collection_name, pipeline))
 
-    # Get database
-    client = get_mongodb_connection()
-    db_name = os.getenv("MONGODB_DATABASE", "nlq_interface")
-    db = client[db_name]
-    collection = db[collection_name]
+
+async def execute_mongodb_query_async(
+    collection_name: str,
+    filter_query: Optional[Dict[str, Any]] = None,
+    projection: Optional[Dict[str, Any]] = None,
+    sort: Optional[Dict[str, int]] = None,
+    limit: int = 100
+) -> List[Dict[str, Any]]:
+    """
+    Execute a MongoDB find query safely without blocking the event loop.
+
+    Args:
+        collection_name: Name of the collection to query
+        filter_query: MongoDB filter query dictionary (default: {})
+        projection: Fields to include/exclude in results
+        sort: Sort specification (field -> direction mapping)
+        limit: Maximum number of documents to return
+
+    Returns:
+        List of documents matching the query, with ObjectIds as strings
+
+    Raises:
+        MongoSecurityError: If validation fails
+        OperationFailure: If the query fails
+    """
+    filter_query = _validate_find_arguments(collection_name, filter_query, projection, sort)
+
+    db = get_async_mongodb_database()
+    collection = db.get_collection(collection_name, codec_options=JSON_CODEC_OPTIONS)
+
+    cursor = collection.find(filter_query, projection)
+
+    if sort:
+        cursor = cursor.sort(list(sort.items()))
+
+    cursor = cursor.limit(limit)
 
     try:
-        # Execute aggregation
-        cursor = collection.aggregate(pipeline)
+        return await cursor.to_list(None)
+    except OperationFailure as e:
+        raise OperationFailure(f"MongoDB query failed: {str(e)}")
 
-        # Convert cursor to list and handle ObjectId serialization
-        results = []
-        for doc in cursor:
-            # Convert all ObjectIds to strings for JSON serialization
-            doc = convert_objectids_to_strings(doc)
-            results.append(doc)
 
-        return results
+async def execute_aggregation_pipeline_async(
+    collection_name: str,
+    pipeline: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """
+    Execute a MongoDB aggregation pipeline safely without blocking the event loop.
 
+    Args:
+        collection_name: Name of the collection to query
+        pipeline: List of aggregation stages
+
+    Returns:
+        List of documents from the aggregation result, with ObjectIds as strings
+
+    Raises:
+        MongoSecurityError: If validation fails
+        OperationFailure: If the aggregation fails
+    """
+    validate_collection_name(collection_name)
+    validate_aggregation_pipeline(pipeline)
+    pipeline = _optimize_pipeline(pipeline)
+
+    db = get_async_mongodb_database()
+    collection = db.get_collection(collection_name, codec_options=JSON_CODEC_OPTIONS)
+
+    try:
+        cursor = await collection.aggregate(pipeline)
+        return await cursor.to_list(None)
     except OperationFailure as e:
         raise OperationFailure(f"MongoDB aggregation failed: {str(e)}")
 
 
-def get_database_schema() -> Dict[str, Any]:
+def _trimmed_sample(value_expr: str) -> Dict[str, Any]:
+    """Aggregation expression that shortens long strings and arrays, keeping their type"""
+    return {"$switch": {
+        "branches": [
+            {
+                "case": {"$eq": [{"$type": value_expr}, "string"]},
+                "then": {"$substrCP": [value_expr, 0, SAMPLE_STRING_LENGTH]}
+            },
+            {
+                "case": {"$isArray": value_expr},
+                "then": {"$slice": [value_expr, SAMPLE_ARRAY_LENGTH]}
+            }
+        ],
+        "default": value_expr
+    }}
+
+
+def build_schema_sample_pipeline() -> List[Dict[str, Any]]:
     """
-    Get schema information for all collections in the database.
+    Build the aggregation that infers a collection's fields server-side.
+
+    The first SCHEMA_SAMPLE_SIZE documents are split into key/value pairs and
+    grouped by key, so only one sample value per field comes back, alongside
+    the first few documents and the sample size. Top-level strings and arrays
+    in the returned samples are trimmed so large blobs never leave the server.
 
     Returns:
-        Dictionary containing collection names and their schemas
+        Single-$facet aggregation pipeline
     """
-    client = get_mongodb_connection()
-    db_name = os.getenv("MONGODB_DATABASE", "nlq_interface")
-    db = client[db_name]
+    return [
+        {"$limit": SCHEMA_SAMPLE_SIZE},
+        {"$facet": {
+            "fields": [
+                {"$project": {"kv": {"$objectToArray": "$$ROOT"}}},
+                {"$unwind": {"path": "$kv", "includeArrayIndex": "position"}},
+                {"$group": {
+                    "_id": "$kv.k",
+                    "sample": {"$first": "$kv.v"},
+                    "position": {"$min": "$position"}
+                }},
+                {"$sort": {"position": 1, "_id": 1}},
+                {"$set": {"sample": _trimmed_sample("$sample")}}
+            ],
+            "sample_data": [
+                {"$limit": 3},
+                {"$replaceWith": {"$arrayToObject": {"$map": {
+                    "input": {"$objectToArray": "$$ROOT"},
+                    "as": "kv",
+                    "in": {"k": "$$kv.k", "v": _trimmed_sample("$$kv.v")}
+                }}}}
+            ],
+            "sampled": [{"$count": "n"}]
+        }}
+    ]
+
+
+def _sample_collection(db, collection_name: str) -> Tuple[str, Dict[str, Any]]:
+    """
+    Sample a collection and infer its schema entry.
+
+    Args:
+        db: PyMongo database handle
+        collection_name: Name of the collection to sample
+
+    Returns:
+        Tuple of (collection name, schema entry with count, fields and sample_data)
+    """
+    collection = db[collection_name]
+
+    # Infer the schema server-side; one row per field comes back
+    facet_result = list(collection.aggregate(build_schema_sample_pipeline()))
+    facets = facet_result[0] if facet_result else {}
+    sampled = facets.get("sampled") or []
+    sample_size = sampled[0]["n"] if sampled else 0
+
+    if not sample_size:
+        return collection_name, {
+            "count": 0,
+            "fields": {}
+        }
+
+    fields = {}
+    for row in facets.get("fields", []):
+        field_value = row.get("sample")
+        fields[row["_id"]] = {
+            "type": type(field_value).__name__,
+            "sample": convert_objectids_to_strings(field_value)
+        }
+
+    # A short sample already holds the whole collection, so skip the
+    # extra round-trip for its count
+    if sample_size < SCHEMA_SAMPLE_SIZE:
+        count = sample_size
+    else:
+        count = collection.estimated_document_count()
+
+    return collection_name, {
+        "count": count,
+        "fields": fields,
+        "sample_data": [convert_objectids_to_strings(doc) for doc in facets.get("sample_data", [])]
+    }
+
+
+def invalidate_schema_cache(relationships: bool = False):
+    """
+    Forget the cached get_database_schema result
+
+    Args:
+        relationships: Also forget the last relationship detection
+    """
+    global _schema_cache, _relationship_cache
+    _schema_cache = None
+    if relationships:
+        _relationship_cache = None
+
+
+def get_schema_cache_age() -> Optional[float]:
+    """Seconds since the cached schema was built, or None if nothing is cached or it expired"""
+    cached = _schema_cache
+    if cached is None:
+        return None
+    age = time.monotonic() - cached[0]
+    return age if age < SCHEMA_CACHE_TTL_SECONDS else None
+
+
+def _detect_relationships(db: Database, schema: Dict[str, Any], redetect: bool) -> List[Any]:
+    """
+    Relationships for a schema, reusing the last detection while field types are unchanged.
+
+    Args:
+        db: Database the schema was sampled from
+        schema: Per-collection schema entries as built by _sample_collection
+        redetect: Run detection even if the cached result matches
+
+    Returns:
+        List of detected FieldRelationship objects (empty if detection fails)
+    """
+    global _relationship_cache
+
+    # Build schema_info for relationship detection
+    schema_info = {
+        coll_name: {
+            field_name: field_data["type"]
+            for field_name, field_data in coll_data.get("fields", {}).items()
+        }
+        for coll_name, coll_data in schema.items()
+    }
+
+    cached = _relationship_cache
+    if not redetect and cached is not None and cached[0] == schema_info:
+        return cached[1]
+
+    try:
+        relationships = detect_all_relationships(schema_info, db, min_confidence=0.3)
+    except Exception as e:
+        # Log but don't fail if relationship detection fails
+        import logging
+        logging.error(f"Relationship detection failed: {e}")
+        return []
+
+    _relationship_cache = (schema_info, relationships)
+    return relationships
+
+
+def _build_database_schema(redetect_relationships: bool) -> Dict[str, Any]:
+    """Sample every collection, attach relationships and cache the result"""
+    global _schema_cache
+
+    db = get_mongodb_database()
 
     schema = {}
 
@@ -218,68 +814,70 @@ def get_database_schema() -> Dict[str, Any]:
         # Get all collection names
         collection_names = db.list_collection_names()
 
-        for collection_name in collection_names:
-            # Skip system collections
-            if collection_name.startswith("system."):
-                continue
+        # Skip system collections
+        collection_names = [name for name in collection_names if not name.startswith("system.")]
 
-            collection = db[collection_name]
+        # Sample collections concurrently; executor.map preserves name order
+        if collection_names:
+            max_workers = min(MAX_SCHEMA_WORKERS, len(collection_names))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for collection_name, entry in executor.map(partial(_sample_collection, db), collection_names):
+                    schema[collection_name] = entry
 
-            # Get sample documents to infer schema
-            sample_docs = list(collection.find().limit(10))
+        # Detect relationships between collections
+        relationships = _detect_relationships(db, schema, redetect_relationships)
 
-            if not sample_docs:
-                schema[collection_name] = {
-                    "count": 0,
-                    "fields": {}
-                }
-                continue
+        result = {"collections": schema, "relationships": relationships}
+        _schema_cache = (time.monotonic(), result)
+        return result
 
-            # Infer schema from sample documents
-            fields = {}
-            for doc in sample_docs:
-                for field_name, field_value in doc.items():
-                    if field_name not in fields:
-                        fields[field_name] = {
-                            "type": type(field_value).__name__,
-                            "sample": convert_objectids_to_strings(field_value)
-                        }
-
-            schema[collection_name] = {
-                "count": collection.count_documents({}),
-                "fields": fields,
-                "sample_data": [convert_objectids_to_strings(doc) for doc in sample_docs[:3]]
-            }
+    except PyMongoError as e:
+        raise PyMongoError(f"Failed to retrieve database schema: {str(e)}")
 
-        # Detect relationships between collections
-        relationships = []
-        try:
-            # Build schema_info for relationship detection
-            schema_info = {}
-            for coll_name, coll_data in schema.items():
-                schema_info[coll_name] = {
-                    field_name: field_data["type"]
-                    for field_name, field_data in coll_data.get("fields", {}).items()
-                }
 
-            # Detect relationships
-            relationships = detect_all_relationships(schema_info, db, min_confidence=0.3)
+def get_database_schema() -> Dict[str, Any]:
+    """
+    Get schema information for all collections in the database.
+
+    Results are cached for SCHEMA_CACHE_TTL_SECONDS; collection writes made
+    through this module invalidate the cache immediately. Relationship
+    detection is only re-run when collection fields change, or by
+    refresh_database_schema().
+
+    Document counts come from collection metadata (estimated_document_count),
+    so they can drift after an unclean shutdown or on sharded clusters.
 
-        except Exception as e:
-            # Log but don't fail if relationship detection fails
-            import logging
-            logging.error(f"Relationship detection failed: {e}")
+    Returns:
+        Dictionary containing collection names and their schemas
+    """
+    cached = _schema_cache
+    if cached is not None and time.monotonic() - cached[0] < SCHEMA_CACHE_TTL_SECONDS:
+        return cached[1]
 
-        return {"collections": schema, "relationships": relationships}
+    return _build_database_schema(redetect_relationships=False)
 
+
+def refresh_database_schema() -> None:
+    """
+    Rebuild the cached schema and re-run relationship detection.
+
+    Meant to run as a background task after uploads and deletions, so the
+    next request finds a warm cache with up-to-date value overlaps.
+    """
+    try:
+        _build_database_schema(redetect_relationships=True)
     except PyMongoError as e:
-        raise PyMongoError(f"Failed to retrieve database schema: {str(e)}")
+        import logging
+        logging.error(f"Background schema refresh failed: {e}")
 
 
 def get_collection_stats(collection_name: str) -> Dict[str, Any]:
     """
     Get statistics for a specific collection.
 
+    The document count is read from collection metadata rather than counted,
+    so it may be approximate.
+
     Args:
         collection_name: Name of the collection
 
@@ -291,16 +889,14 @@ def get_collection_stats(collection_name: str) -> Dict[str, Any]:
     """
     validate_collection_name(collection_name)
 
-    client = get_mongodb_connection()
-    db_name = os.getenv("MONGODB_DATABASE", "nlq_interface")
-    db = client[db_name]
+    db = get_mongodb_database()
     collection = db[collection_name]
 
     try:
         stats = {
             "name": collection_name,
-            "count": collection.count_documents({}),
-            "indexes": [idx for idx in collection.list_indexes()],
+            "count": collection.estimated_document_count(),
+            "indexes": convert_objectids_to_strings(list(collection.list_indexes())),
         }
 
         # Get collection stats from MongoDB
@@ -329,9 +925,7 @@ def drop_collection(collection_name: str) -> bool:
     """
     validate_collection_name(collection_name)
 
-    client = get_mongodb_connection()
-    db_name = os.getenv("MONGODB_DATABASE", "nlq_interface")
-    db = client[db_name]
+    db = get_mongodb_database()
 
     try:
         db.drop_collection(collection_name)
@@ -340,6 +934,9 @@ def drop_collection(collection_name: str) -> bool:
     except OperationFailure as e:
         raise OperationFailure(f"Failed to drop collection: {str(e)}")
 
+    finally:
+        invalidate_schema_cache()
+
 
 def create_collection(collection_name: str) -> bool:
     """
@@ -356,9 +953,7 @@ def create_collection(collection_name: str) -> bool:
     """
     validate_collection_name(collection_name)
 
-    client = get_mongodb_connection()
-    db_name = os.getenv("MONGODB_DATABASE", "nlq_interface")
-    db = client[db_name]
+    db = get_mongodb_database()
 
     try:
         db.create_collection(collection_name)
@@ -367,35 +962,67 @@ def create_collection(collection_name: str) -> bool:
     except OperationFailure as e:
         raise OperationFailure(f"Failed to create collection: {str(e)}")
 
+    finally:
+        invalidate_schema_cache()
+
 
-def insert_documents(collection_name: str, documents: List[Dict[str, Any]]) -> int:
+def insert_documents(
+    collection_name: str,
+    documents: List[Dict[str, Any]],
+    bypass_document_validation: bool = True
+) -> int:
     """
     Insert multiple documents into a collection.
 
+    Documents are sent in unordered batches of INSERT_BATCH_SIZE, so one bad
+    document does not stop the rest of its batch, with IMPORT_WRITE_CONCERN.
+
     Args:
         collection_name: Name of the collection
         documents: List of documents to insert
+        bypass_document_validation: Skip collection validators (upload
+            collections have none, so this only saves server work)
 
     Returns:
         Number of documents inserted
 
     Raises:
         MongoSecurityError: If collection name is invalid
-        OperationFailure: If insertion fails
+        OperationFailure: If insertion fails; for write errors the message
+            includes how many documents were inserted before stopping
     """
     validate_collection_name(collection_name)
 
     if not documents:
         return 0
 
-    client = get_mongodb_connection()
-    db_name = os.getenv("MONGODB_DATABASE", "nlq_interface")
-    db = client[db_name]
-    collection = db[collection_name]
+    db = get_mongodb_database()
+    collection = db.get_collection(collection_name, write_concern=IMPORT_WRITE_CONCERN)
 
+    inserted_count = 0
     try:
-        result = collection.insert_many(documents)
-        return len(result.inserted_ids)
-
+        # Unordered batches let the server apply writes without serializing them.
+        # Plain dicts are passed on purpose: the driver's C extension encodes them
+        # to BSON while building each batch, so pre-encoding into RawBSONDocument
+        # would only add a second pass.
+        for start in range(0, len(documents), INSERT_BATCH_SIZE):
+            result = collection.insert_many(
+                documents[start:start + INSERT_BATCH_SIZE],
+                ordered=False,
+                bypass_document_validation=bypass_document_validation
+            )
+            inserted_count += len(result.inserted_ids)
+        return inserted_count
+
+    except BulkWriteError as e:
+        inserted_count += e.details.get("nInserted", 0)
+        write_errors = len(e.details.get("writeErrors", []))
+        raise OperationFailure(
+            f"Failed to insert documents: {write_errors} write errors, "
+            f"{inserted_count} of {len(documents)} documents inserted"
+        )
     except OperationFailure as e:
         raise OperationFailure(f"Failed to insert documents: {str(e)}")
+
+    finally:
+        invalidate_schema_cache()
@@ -6,18 +6,59 @@ and other security vulnerabilities. It validates collection names, field names,
 and regex patterns to ensure safe MongoDB operations.
 """
 
+import json
 import re
-from typing import Any, Dict, List
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+# Compiled once at import; validation runs on every MongoDB API call
+_COLLECTION_NAME_RE = re.compile(r'^[a-zA-Z0-9_-]+$')
+
+# Reserved namespace; checked with str.startswith rather than a regex
+_SYSTEM_PREFIX = "system."
+
+# Query operators that execute server-side JavaScript
+_DANGEROUS_OPERATORS = frozenset({"$where"})
+
+# Query operators the LLM may generate
+_ALLOWED_OPERATORS = frozenset({
+    "$eq", "$ne", "$gt", "$gte", "$lt", "$lte",
+    "$in", "$nin", "$and", "$or", "$not", "$nor",
+    "$exists", "$type", "$regex", "$options",
+    "$all", "$elemMatch", "$size",
+    "$mod", "$text", "$search"
+})
+
+# Aggregation stages that execute server-side JavaScript
+_DANGEROUS_STAGES = frozenset({"$function", "$accumulator"})
+
+# Aggregation stages the LLM may generate
+_ALLOWED_STAGES = frozenset({
+    "$match", "$group", "$project", "$sort", "$limit", "$skip",
+    "$unwind", "$lookup", "$addFields", "$count", "$sortByCount",
+    "$facet", "$bucket", "$bucketAuto", "$sample", "$replaceRoot",
+    "$out", "$merge", "$geoNear", "$graphLookup", "$redact",
+    "$replaceWith", "$set", "$unset"
+})
+
+# Nested quantifiers that cause catastrophic backtracking (ReDoS)
+_NESTED_QUANTIFIERS = ("(.*)*", "(.+)+")
+
+# Maximum number of chained * or + quantifiers on one line of a regex
+MAX_CHAINED_QUANTIFIERS = 2
 
 class MongoSecurityError(Exception):
     """Exception raised for MongoDB security violations"""
     pass
 
 
+@lru_cache(maxsize=4096)
 def validate_collection_name(collection_name: str) -> str:
     """
     Validate MongoDB collection name to prevent injection attacks.
 
+    Valid names are memoized; invalid names raise and are not cached.
+
     MongoDB collection names:
     - Cannot be empty
     - Cannot contain null characters
@@ -43,14 +84,14 @@ def validate_collection_name(collection_name: str) -> str:
     if '\x00' in collection_name:
         raise MongoSecurityError("Collection name cannot contain null characters")
 
-    if collection_name.startswith("system."):
+    if collection_name.startswith(_SYSTEM_PREFIX):
         raise MongoSecurityError("Collection name cannot start with 'system.' (reserved namespace)")
 
     if "$" in collection_name:
         raise MongoSecurityError("Collection name cannot contain '$' character")
 
     # Allow only alphanumeric, underscores, and hyphens
-    if not re.match(r'^[a-zA-Z0-9_-]+$', collection_name):
+    if not _COLLECTION_NAME_RE.match(collection_name):
         raise MongoSecurityError(
             "Collection name can only contain letters, numbers, underscores, and hyphens"
         )
@@ -58,10 +99,13 @@ def validate_collection_name(collection_name: str) -> str:
     return collection_name
 
 
+@lru_cache(maxsize=4096)
 def validate_field_name(field_name: str) -> str:
     """
     Validate MongoDB field name to prevent injection attacks.
 
+    Valid names are memoized; invalid names raise and are not cached.
+
     MongoDB field names:
     - Cannot be empty
     - Cannot contain null characters
@@ -99,7 +143,7 @@ def validate_query_structure(query: Dict[str, Any], allow_operators: bool = True
     """
     Validate MongoDB query structure to prevent NoSQL injection.
 
-    This function recursively validates query structures to ensure they don't contain
+    This function walks nested query structures to ensure they don't contain
     dangerous operations like $where with JavaScript code execution.
 
     Args:
@@ -115,51 +159,48 @@ def validate_query_structure(query: Dict[str, Any], allow_operators: bool = True
     if not isinstance(query, dict):
         raise MongoSecurityError("Query must be a dictionary")
 
-    dangerous_operators = ["$where"]
-
-    for key, value in query.items():
-        # Check for dangerous operators
-        if key in dangerous_operators:
-            raise MongoSecurityError(f"Dangerous operator not allowed: {key}")
-
-        # Validate MongoDB operators
-        if key.startswith("$"):
-            if not allow_operators:
-                raise MongoSecurityError(f"Operators not allowed in this context: {key}")
-
-            # List of allowed operators
-            allowed_operators = [
-                "$eq", "$ne", "$gt", "$gte", "$lt", "$lte",
-                "$in", "$nin", "$and", "$or", "$not", "$nor",
-                "$exists", "$type", "$regex", "$options",
-                "$all", "$elemMatch", "$size",
-                "$mod", "$text", "$search"
-            ]
-
-            if key not in allowed_operators:
-                raise MongoSecurityError(f"Unknown or disallowed operator: {key}")
-        else:
-            # Validate field names (non-operator keys)
-            validate_field_name(key)
+    # Walk nested documents with an explicit stack; only the top level can
+    # disallow operators
+    stack = [(query, allow_operators)]
+    while stack:
+        node, operators_allowed = stack.pop()
 
-        # Recursively validate nested structures
-        if isinstance(value, dict):
-            validate_query_structure(value, allow_operators=True)
-        elif isinstance(value, list):
-            for item in value:
-                if isinstance(item, dict):
-                    validate_query_structure(item, allow_operators=True)
+        for key, value in node.items():
+            # Check for dangerous operators
+            if key in _DANGEROUS_OPERATORS:
+                raise MongoSecurityError(f"Dangerous operator not allowed: {key}")
 
+            # Validate MongoDB operators
+            if key.startswith("$"):
+                if not operators_allowed:
+                    raise MongoSecurityError(f"Operators not allowed in this context: {key}")
 
-def validate_lookup_stage(lookup_stage: Dict[str, Any]) -> Dict[str, Any]:
+                if key not in _ALLOWED_OPERATORS:
+                    raise MongoSecurityError(f"Unknown or disallowed operator: {key}")
+            else:
+                # Validate field names (non-operator keys)
+                validate_field_name(key)
+
+            # Queue nested structures
+            if isinstance(value, dict):
+                stack.append((value, True))
+            elif isinstance(value, list):
+                for item in value:
+                    if isinstance(item, dict):
+                        stack.append((item, True))
+
+    return query
+
+
+def _validate_lookup_fields(lookup_stage: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
     """
-    Validate MongoDB $lookup stage to prevent security issues.
+    Validate the fields of a $lookup stage, leaving any nested pipeline to the caller.
 
     Args:
         lookup_stage: The $lookup stage configuration
 
     Returns:
-        The validated lookup stage
+        The nested pipeline for pipeline-style lookups, otherwise None
 
     Raises:
         MongoSecurityError: If the $lookup stage is invalid or dangerous
@@ -171,12 +212,8 @@ def validate_lookup_stage(lookup_stage: Dict[str, Any]) -> Dict[str, Any]:
     if "from" not in lookup_stage:
         raise MongoSecurityError("$lookup stage must have 'from' field")
 
-    from_collection = lookup_stage["from"]
-    validate_collection_name(from_collection)
-
-    # Prevent lookup from system collections
-    if from_collection.startswith("system."):
-        raise MongoSecurityError("$lookup cannot reference system collections")
+    # Also rejects system collections, so no separate prefix check is needed
+    validate_collection_name(lookup_stage["from"])
 
     # Validate 'as' field
     if "as" not in lookup_stage:
@@ -201,9 +238,6 @@ def validate_lookup_stage(lookup_stage: Dict[str, Any]) -> Dict[str, Any]:
         if not isinstance(nested_pipeline, list):
             raise MongoSecurityError("$lookup 'pipeline' must be a list")
 
-        # Recursively validate nested pipeline
-        validate_aggregation_pipeline(nested_pipeline)
-
         # Validate 'let' variables if present
         if "let" in lookup_stage:
             let_vars = lookup_stage["let"]
@@ -212,16 +246,82 @@ def validate_lookup_stage(lookup_stage: Dict[str, Any]) -> Dict[str, Any]:
             for var_name in let_vars.keys():
                 if not var_name or not isinstance(var_name, str):
                     raise MongoSecurityError("$lookup 'let' variable names must be non-empty strings")
+        return nested_pipeline
     else:
         raise MongoSecurityError("$lookup must have either localField/foreignField or pipeline")
 
+    return None
+
+
+def validate_lookup_stage(lookup_stage: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Validate MongoDB $lookup stage to prevent security issues.
+
+    Args:
+        lookup_stage: The $lookup stage configuration
+
+    Returns:
+        The validated lookup stage
+
+    Raises:
+        MongoSecurityError: If the $lookup stage is invalid or dangerous
+    """
+    nested_pipeline = _validate_lookup_fields(lookup_stage)
+    if nested_pipeline is not None:
+        validate_aggregation_pipeline(nested_pipeline)
+
     return lookup_stage
 
 
+def _validate_pipeline_stages(pipeline: List[Dict[str, Any]]) -> None:
+    """Check every stage of a pipeline and of its nested $lookup pipelines."""
+    # $lookup sub-pipelines are queued rather than validated recursively;
+    # a sub-pipeline object shared by several joins is only queued once.
+    # Tracked by id() because comparing nested lists by value recurses
+    pending = [pipeline]
+    queued = set()
+    while pending:
+        for stage in pending.pop():
+            if not isinstance(stage, dict):
+                raise MongoSecurityError("Each aggregation stage must be a dictionary")
+
+            if len(stage) != 1:
+                raise MongoSecurityError("Each aggregation stage must have exactly one operator")
+
+            stage_name = next(iter(stage))
+
+            if stage_name in _DANGEROUS_STAGES:
+                raise MongoSecurityError(f"Dangerous aggregation stage not allowed: {stage_name}")
+
+            if not stage_name.startswith("$"):
+                raise MongoSecurityError(f"Invalid aggregation stage (must start with $): {stage_name}")
+
+            if stage_name not in _ALLOWED_STAGES:
+                raise MongoSecurityError(f"Unknown or disallowed aggregation stage: {stage_name}")
+
+            # Special validation for $lookup stages
+            if stage_name == "$lookup":
+                nested_pipeline = _validate_lookup_fields(stage["$lookup"])
+                if nested_pipeline is not None and id(nested_pipeline) not in queued:
+                    queued.add(id(nested_pipeline))
+                    pending.append(nested_pipeline)
+
+
+@lru_cache(maxsize=1024)
+def _validate_pipeline_cached(pipeline_json: str) -> None:
+    """Validate a pipeline given as canonical JSON; only successes are cached."""
+    _validate_pipeline_stages(json.loads(pipeline_json))
+
+
 def validate_aggregation_pipeline(pipeline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """
     Validate MongoDB aggregation pipeline to prevent security issues.
 
+    Pipelines that serialize to JSON are validated once per distinct canonical
+    form; anything else (dates, ObjectIds, nesting too deep for the recursive
+    JSON encoder, ...) goes through the uncached path, which walks the stages
+    iteratively and never copies them.
+
     Args:
         pipeline: List of aggregation stage dictionaries
 
@@ -234,39 +334,58 @@ def validate_aggregation_pipeline(pipeline: List[Dict[str, Any]]) -> List[Dict[s
     if not isinstance(pipeline, list):
         raise MongoSecurityError("Aggregation pipeline must be a list")
 
-    dangerous_stages = ["$function", "$accumulator"]
+    if not pipeline:
+        return pipeline
 
-    allowed_stages = [
-        "$match", "$group", "$project", "$sort", "$limit", "$skip",
-        "$unwind", "$lookup", "$addFields", "$count", "$sortByCount",
-        "$facet", "$bucket", "$bucketAuto", "$sample", "$replaceRoot",
-        "$out", "$merge", "$geoNear", "$graphLookup", "$redact",
-        "$replaceWith", "$set", "$unset"
-    ]
+    try:
+        pipeline_json = json.dumps(pipeline, sort_keys=True, separators=(",", ":"))
+    except (TypeError, ValueError, RecursionError):
+        _validate_pipeline_stages(pipeline)
+    else:
+        _validate_pipeline_cached(pipeline_json)
 
-    for stage in pipeline:
-        if not isinstance(stage, dict):
-            raise MongoSecurityError("Each aggregation stage must be a dictionary")
+    return pipeline
 
-        if len(stage) != 1:
-            raise MongoSecurityError("Each aggregation stage must have exactly one operator")
 
-        stage_name = list(stage.keys())[0]
+def _has_chained_quantifiers(pattern: str) -> bool:
+    """
+    Detect more than MAX_CHAINED_QUANTIFIERS * (or +) quantifiers on one line.
 
-        if stage_name in dangerous_stages:
-            raise MongoSecurityError(f"Dangerous aggregation stage not allowed: {stage_name}")
+    A quantifier counts when at least one other character precedes it since the
+    previous counted one, so "a*b*c*" chains three stars while "a**" chains one.
+    This is a single linear scan, so the check itself cannot backtrack.
 
-        if not stage_name.startswith("$"):
-            raise MongoSecurityError(f"Invalid aggregation stage (must start with $): {stage_name}")
+    Args:
+        pattern: The regex pattern to inspect
 
-        if stage_name not in allowed_stages:
-            raise MongoSecurityError(f"Unknown or disallowed aggregation stage: {stage_name}")
+    Returns:
+        True if either quantifier is chained too many times
+    """
+    stars = pluses = 0
+    star_pending = plus_pending = False
+
+    for char in pattern:
+        if char == "\n":
+            stars = pluses = 0
+            star_pending = plus_pending = False
+            continue
+
+        if char == "*" and star_pending:
+            stars += 1
+            star_pending = False
+        else:
+            star_pending = True
 
-        # Special validation for $lookup stages
-        if stage_name == "$lookup":
-            validate_lookup_stage(stage["$lookup"])
+        if char == "+" and plus_pending:
+            pluses += 1
+            plus_pending = False
+        else:
+            plus_pending = True
 
-    return pipeline
+        if stars > MAX_CHAINED_QUANTIFIERS or pluses > MAX_CHAINED_QUANTIFIERS:
+            return True
+
+    return False
 
 
 def sanitize_regex_pattern(pattern: str) -> str:
@@ -297,16 +416,11 @@ def sanitize_regex_pattern(pattern: str) -> str:
         raise MongoSecurityError("Regex pattern has too many nested groups (max 20)")
 
     # Check for excessive repetition operators
-    dangerous_patterns = [
-        r"(.+\*){3,}",  # Multiple consecutive * operators
-        r"(.+\+){3,}",  # Multiple consecutive + operators
-        r"\(\.\*\)\*",  # Nested (.*)*
-        r"\(\.\+\)\+",  # Nested (.+)+
-    ]
-
-    for dangerous_pattern in dangerous_patterns:
-        if re.search(dangerous_pattern, pattern):
-            raise MongoSecurityError("Regex pattern contains potentially dangerous repetition")
+    if any(nested in pattern for nested in _NESTED_QUANTIFIERS):
+        raise MongoSecurityError("Regex pattern contains potentially dangerous repetition")
+
+    if _has_chained_quantifiers(pattern):
+        raise MongoSecurityError("Regex pattern contains potentially dangerous repetition")
 
     return pattern
 
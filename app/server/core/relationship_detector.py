@@ -5,14 +5,23 @@ This module automatically detects relationships between MongoDB collections
 by analyzing field names, data types, and value overlaps.
 """
 
-from typing import Dict, List, Any, Set, Optional
+from bisect import bisect_left
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import combinations, islice
+from typing import Dict, List, Any, Iterable, Set, Optional
 from core.data_models import FieldRelationship, RelationshipType
 from pymongo import MongoClient
 from pymongo.database import Database
+from pymongo.errors import OperationFailure
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Upper bound on collections sampled concurrently for value overlap
+MAX_SAMPLING_WORKERS = 8
+
 
 def detect_id_field_relationships(
     schema_info: Dict[str, Dict[str, str]],
@@ -31,32 +40,42 @@ def detect_id_field_relationships(
     """
     relationships = []
 
+    # Resolve a field prefix to a collection: exact name first, then the
+    # plural form, then the singular form (later updates take precedence)
+    collection_for_prefix = {name + 's': name for name in schema_info}
+    collection_for_prefix.update({name[:-1]: name for name in schema_info if name.endswith('s')})
+    collection_for_prefix.update({name: name for name in schema_info})
+
+    # Collections a bare field name may refer to, in schema order
+    collections_for_field_name: Dict[str, List[str]] = {}
+    for name in schema_info:
+        aliases = {name, name.rstrip('s')}
+        if name.endswith('s'):
+            aliases.add(name[:-1])
+        for alias in aliases:
+            collections_for_field_name.setdefault(alias, []).append(name)
+
+    reference_field = {
+        name: 'id' if 'id' in fields else '_id'
+        for name, fields in schema_info.items()
+    }
+
     for source_collection, fields in schema_info.items():
         for field_name, field_type in fields.items():
-            # Check for _id pattern
+            # Check for _id pattern (endswith + slice is about twice as fast as
+            # a compiled-regex fullmatch for this test)
             if field_name.endswith('_id') and field_name != '_id':
                 potential_target = field_name[:-3]  # Remove '_id' suffix
-
-                # Try exact match first
-                target_collection = None
-                if potential_target in schema_info:
-                    target_collection = potential_target
-                # Try plural form
-                elif potential_target + 's' in schema_info:
-                    target_collection = potential_target + 's'
-                # Try singular form (remove trailing 's')
-                elif potential_target.endswith('s') and potential_target[:-1] in schema_info:
-                    target_collection = potential_target[:-1]
+                target_collection = collection_for_prefix.get(potential_target)
 
                 if target_collection:
                     # Look for matching ID field in target collection
+                    target_fields = schema_info[target_collection]
                     target_field = None
-                    if 'id' in schema_info[target_collection]:
+                    if 'id' in target_fields:
                         target_field = 'id'
-                    elif field_name in schema_info[target_collection]:
+                    elif field_name in target_fields:
                         target_field = field_name  # Same field name in target
-                    elif potential_target + '_id' in schema_info[target_collection]:
-                        target_field = potential_target + '_id'
 
                     if target_field:
                         relationships.append(FieldRelationship(
@@ -69,24 +88,29 @@ def detect_id_field_relationships(
                         ))
 
             # Check for collection name pattern (e.g., 'user' field when 'users' collection exists)
-            for potential_target in schema_info.keys():
+            for potential_target in collections_for_field_name.get(field_name, ()):
                 if potential_target != source_collection:
-                    # Check singular/plural matching
-                    if (field_name == potential_target or
-                        field_name == potential_target.rstrip('s') or
-                        field_name + 's' == potential_target):
-                        relationships.append(FieldRelationship(
-                            source_collection=source_collection,
-                            source_field=field_name,
-                            target_collection=potential_target,
-                            target_field='id' if 'id' in schema_info[potential_target] else '_id',
-                            relationship_type=RelationshipType.one_to_many,
-                            confidence_score=0.7
-                        ))
+                    relationships.append(FieldRelationship(
+                        source_collection=source_collection,
+                        source_field=field_name,
+                        target_collection=potential_target,
+                        target_field=reference_field[potential_target],
+                        relationship_type=RelationshipType.one_to_many,
+                        confidence_score=0.7
+                    ))
 
     return relationships
 
 
+# Common synonyms for entities
+_ENTITY_SYNONYMS = {
+    'customer': 'user',
+    'client': 'user',
+    'item': 'product',
+    'good': 'product',
+}
+
+
 def detect_name_based_relationships(
     schema_info: Dict[str, Dict[str, str]]
 ) -> List[FieldRelationship]:
@@ -102,44 +126,246 @@ def detect_name_based_relationships(
     """
     relationships = []
 
-    # Common synonyms for entities
-    synonyms = {
-        'customer': 'user',
-        'client': 'user',
-        'item': 'product',
-        'good': 'product',
-    }
+    # Collections a prefix may name: those starting with it (a contiguous run
+    # of the sorted names, found by bisection) plus those whose singular form
+    # equals it, reported in schema order. Resolved once per distinct prefix.
+    position = {name: index for index, name in enumerate(schema_info)}
+    sorted_names = sorted(schema_info)
+    by_singular = defaultdict(list)
+    for name in schema_info:
+        by_singular[name.rstrip('s')].append(name)
+    targets_for_prefix: Dict[str, List[str]] = {}
 
     for source_collection, fields in schema_info.items():
         for field_name, field_type in fields.items():
             # Look for patterns like 'customer_name', 'user_email', etc.
             if '_' in field_name:
-                parts = field_name.split('_')
-                potential_target_prefix = parts[0]  # e.g., 'customer', 'user', 'product'
-                field_suffix = '_'.join(parts[1:])  # e.g., 'name', 'email', 'id'
+                # e.g., 'customer' / 'user' / 'product' and 'name' / 'email' / 'id'
+                potential_target_prefix, _, field_suffix = field_name.partition('_')
 
                 # Check synonyms
-                if potential_target_prefix in synonyms:
-                    potential_target_prefix = synonyms[potential_target_prefix]
+                potential_target_prefix = _ENTITY_SYNONYMS.get(potential_target_prefix, potential_target_prefix)
 
                 # Check if there's a collection matching the prefix
-                for potential_target in schema_info.keys():
-                    if (potential_target.startswith(potential_target_prefix) or
-                        potential_target.rstrip('s') == potential_target_prefix):
-                        # Check if the target collection has the referenced field
-                        if field_suffix in schema_info[potential_target]:
-                            relationships.append(FieldRelationship(
-                                source_collection=source_collection,
-                                source_field=field_name,
-                                target_collection=potential_target,
-                                target_field=field_suffix,
-                                relationship_type=RelationshipType.one_to_many,
-                                confidence_score=0.75
-                            ))
+                potential_targets = targets_for_prefix.get(potential_target_prefix)
+                if potential_targets is None:
+                    matches = set(by_singular.get(potential_target_prefix, ()))
+                    for name in islice(sorted_names, bisect_left(sorted_names, potential_target_prefix), None):
+                        if not name.startswith(potential_target_prefix):
+                            break
+                        matches.add(name)
+                    potential_targets = targets_for_prefix[potential_target_prefix] = sorted(matches, key=position.__getitem__)
+
+                for potential_target in potential_targets:
+                    # Check if the target collection has the referenced field
+                    if field_suffix in schema_info[potential_target]:
+                        relationships.append(FieldRelationship(
+                            source_collection=source_collection,
+                            source_field=field_name,
+                            target_collection=potential_target,
+                            target_field=field_suffix,
+                            relationship_type=RelationshipType.one_to_many,
+                            confidence_score=0.75
+                        ))
 
     return relationships
 
 
+# Type names (from schema samples or upload inference) grouped into classes whose
+# values can compare equal; names not listed here are never used to prune
+_TYPE_CLASSES = {
+    'int': 'number', 'float': 'number', 'Int64': 'number', 'Decimal128': 'number',
+    'number': 'number', 'double': 'number', 'long': 'number', 'decimal': 'number',
+    'str': 'string', 'string': 'string',
+    'ObjectId': 'objectId', 'objectId': 'objectId',
+    'datetime': 'date', 'date': 'date',
+    'bool': 'bool', 'boolean': 'bool',
+}
+
+# Arrays and documents are unhashable once sampled, so they never overlap
+_UNCOMPARABLE_TYPES = frozenset({'list', 'dict', 'array', 'object'})
+
+
+def _types_compatible(first_type: str, second_type: str) -> bool:
+    """
+    Whether fields of these types could share values.
+
+    Unknown or null sample types are treated as compatible, so a field is only
+    pruned when both types are known to differ.
+    """
+    if first_type in _UNCOMPARABLE_TYPES or second_type in _UNCOMPARABLE_TYPES:
+        return False
+    first_class = _TYPE_CLASSES.get(first_type)
+    second_class = _TYPE_CLASSES.get(second_type)
+    return first_class is None or second_class is None or first_class == second_class
+
+
+def _value_set(docs: Iterable[Dict[str, Any]], field: str) -> Set[Any]:
+    """Collect the distinct non-null values of a field; unhashable values yield an empty set."""
+    try:
+        return {doc.get(field) for doc in docs if doc.get(field) is not None}
+    except TypeError:
+        return set()
+
+
+def _overlap_ratio(source_values: Set[Any], target_values: Set[Any]) -> float:
+    """Fraction of source values that also appear among the target values."""
+    if not source_values or not target_values:
+        return 0.0
+    return min(len(source_values & target_values) / len(source_values), 1.0)
+
+
+def _distinct_sample_stages(field: str, sample_size: int) -> List[Dict[str, Any]]:
+    """
+    Stages returning the distinct values of a field among its first sample_size documents.
+
+    Values are deduplicated server-side and come back as {"_id": value}, so
+    only one small document per distinct value crosses the wire.
+    """
+    return [
+        {"$match": {field: {"$exists": True, "$ne": None}}},
+        {"$limit": sample_size},
+        {"$group": {"_id": f"${field}"}}
+    ]
+
+
+def _overlap_stages(
+    source_field: str,
+    target_collection: str,
+    target_field: str,
+    sample_size: int
+) -> List[Dict[str, Any]]:
+    """
+    Stages computing the value overlap of two sampled fields on the server.
+
+    Both sides are sampled as in _distinct_sample_stages and collected into
+    arrays; the target side is joined in with a pipeline $lookup, so the
+    whole comparison is one round-trip returning a single small document
+    {"source_count": n, "overlap": m}.
+    """
+    collect = {"$group": {"_id": None, "values": {"$push": "$_id"}}}
+    return _distinct_sample_stages(source_field, sample_size) + [
+        collect,
+        {"$lookup": {
+            "from": target_collection,
+            "pipeline": _distinct_sample_stages(target_field, sample_size) + [collect],
+            "as": "target"
+        }},
+        {"$project": {
+            "_id": 0,
+            "source_count": {"$size": "$values"},
+            "overlap": {"$size": {"$setIntersection": [
+                "$values",
+                {"$ifNull": [{"$arrayElemAt": ["$target.values", 0]}, []]}
+            ]}}
+        }}
+    ]
+
+
+def _sample_field_values(
+    db: Database,
+    collection: str,
+    field: str,
+    sample_size: int = 100
+) -> Set[Any]:
+    """Sample the distinct values of a single field."""
+    docs = db[collection].aggregate(_distinct_sample_stages(field, sample_size))
+    return _value_set(docs, "_id")
+
+
+def _sample_fields_individually(
+    db: Database,
+    collection: str,
+    fields: List[str],
+    sample_size: int
+) -> Dict[str, Set[Any]]:
+    """Sample each field with its own aggregation; a failing field yields an empty set."""
+    values = {}
+    for field in fields:
+        try:
+            values[field] = _sample_field_values(db, collection, field, sample_size)
+        except Exception as field_error:
+            logger.error(f"Error sampling {collection}.{field}: {field_error}")
+            values[field] = set()
+    return values
+
+
+def _sample_field_values_batch(
+    db: Database,
+    collection: str,
+    fields: List[str],
+    sample_size: int = 100
+) -> Dict[str, Set[Any]]:
+    """
+    Sample the values of several fields of one collection in a single round-trip.
+
+    Each field gets its own $facet branch. $facet consumes its whole input,
+    so the input is first bounded to documents holding at least one of the
+    fields, sample_size per field in total, and the scan stops there. That
+    budget is shared: a dense field can use it up before a sparse one reaches
+    sample_size documents. When the input was cut at the limit, any field
+    whose branch saw fewer than sample_size documents is therefore sampled
+    again on its own, so every field gets what a per-field find().limit()
+    would return. If the combined facet output is rejected by the server
+    (e.g. it exceeds the 16MB document limit), all fields are sampled one by
+    one instead.
+
+    No indexes are created for sampling: building one per sampled field would
+    scan the collection once per field and leave write overhead behind on
+    uploaded data.
+
+    Args:
+        db: MongoDB database instance
+        collection: Name of the collection to sample
+        fields: Field names to sample
+        sample_size: Number of documents to sample per field
+
+    Returns:
+        Dictionary mapping each field to its set of sampled values
+    """
+    input_limit = sample_size * len(fields)
+
+    # Branch names are positional so that field names never clash with
+    # $facet's restrictions on output field names. Each branch also counts
+    # the documents behind its values to detect fields starved by the limit.
+    facet: Dict[str, List[Dict[str, Any]]] = {"input": [{"$count": "n"}]}
+    for i, field in enumerate(fields):
+        facet[f"f{i}"] = _distinct_sample_stages(field, sample_size)[:-1] + [
+            {"$group": {"_id": f"${field}", "n": {"$sum": 1}}}
+        ]
+    pipeline = [
+        {"$match": {"$or": [{field: {"$exists": True, "$ne": None}} for field in fields]}},
+        {"$limit": input_limit},
+        {"$facet": facet}
+    ]
+
+    try:
+        result = next(iter(db[collection].aggregate(pipeline)), None) or {}
+    except OperationFailure as e:
+        logger.warning(f"Batched sampling of {collection} failed, sampling fields one by one: {e}")
+        return _sample_fields_individually(db, collection, fields, sample_size)
+    except Exception as e:
+        logger.error(f"Error sampling field values from {collection}: {e}")
+        return {field: set() for field in fields}
+
+    input_count = result.get("input") or [{"n": 0}]
+    input_cut = input_count[0]["n"] >= input_limit
+
+    values = {}
+    starved = []
+    for i, field in enumerate(fields):
+        docs = result.get(f"f{i}", [])
+        if input_cut and sum(doc.get("n", 0) for doc in docs) < sample_size:
+            starved.append(field)
+        else:
+            values[field] = _value_set(docs, "_id")
+
+    if starved:
+        values.update(_sample_fields_individually(db, collection, starved, sample_size))
+
+    return {field: values[field] for field in fields}
+
+
 def detect_value_overlap_relationships(
     source_collection: str,
     source_field: str,
@@ -151,6 +377,11 @@ def detect_value_overlap_relationships(
     """
     Calculate value overlap percentage between two fields by sampling data.
 
+    Standalone check for a single field pair; detect_all_relationships does
+    not call it and scores its pairs from per-collection batched samples.
+    The overlap is computed server-side in one aggregation that returns the
+    two counts.
+
     Args:
         source_collection: Name of the source collection
         source_field: Name of the field in source collection
@@ -163,39 +394,12 @@ def detect_value_overlap_relationships(
         Confidence score between 0.0 and 1.0 based on value overlap
     """
     try:
-        # Sample values from source collection
-        source_docs = list(db[source_collection].find(
-            {source_field: {"$exists": True, "$ne": None}},
-            {source_field: 1, "_id": 0}
-        ).limit(sample_size))
-
-        if not source_docs:
+        result = next(iter(db[source_collection].aggregate(
+            _overlap_stages(source_field, target_collection, target_field, sample_size)
+        )), None)
+        if not result or not result["source_count"]:
             return 0.0
-
-        source_values = {doc.get(source_field) for doc in source_docs if doc.get(source_field) is not None}
-
-        if not source_values:
-            return 0.0
-
-        # Sample values from target collection
-        target_docs = list(db[target_collection].find(
-            {target_field: {"$exists": True, "$ne": None}},
-            {target_field: 1, "_id": 0}
-        ).limit(sample_size))
-
-        if not target_docs:
-            return 0.0
-
-        target_values = {doc.get(target_field) for doc in target_docs if doc.get(target_field) is not None}
-
-        if not target_values:
-            return 0.0
-
-        # Calculate overlap
-        overlap = source_values.intersection(target_values)
-        overlap_ratio = len(overlap) / len(source_values)
-
-        return min(overlap_ratio, 1.0)
+        return min(result["overlap"] / result["source_count"], 1.0)
 
     except Exception as e:
         logger.error(f"Error calculating value overlap: {e}")
@@ -260,62 +464,92 @@ def detect_all_relationships(
             all_relationships.append(rel)
             seen_pairs.add(pair_key)
 
-    # Detect name-based relationships
-    name_relationships = detect_name_based_relationships(schema_info)
+    # Detect name-based relationships whose field types could hold equal values
+    name_relationships = [
+        rel for rel in detect_name_based_relationships(schema_info)
+        if _types_compatible(
+            schema_info[rel.source_collection][rel.source_field],
+            schema_info[rel.target_collection][rel.target_field]
+        )
+    ]
+
+    # Detect common field name overlaps (like 'city', 'location', 'category')
+    common_fields = ['city', 'location', 'category', 'name', 'email', 'status']
+    field_to_collections = defaultdict(list)
+    for coll, fields in schema_info.items():
+        for field_name in fields:
+            field_to_collections[field_name].append(coll)
+    common_field_pairs = [
+        (common_field, source_coll, target_coll)
+        for common_field in common_fields
+        for source_coll, target_coll in combinations(field_to_collections.get(common_field, ()), 2)
+        if _types_compatible(schema_info[source_coll][common_field], schema_info[target_coll][common_field])
+    ]
+
+    # Gather every (collection, field) that needs a value sample, then sample
+    # each collection once instead of issuing two queries per candidate pair
+    probes: Dict[str, List[str]] = {}
+    for rel in name_relationships:
+        pair_key = (rel.source_collection, rel.source_field, rel.target_collection, rel.target_field)
+        if pair_key not in seen_pairs:
+            probes.setdefault(rel.source_collection, []).append(rel.source_field)
+            probes.setdefault(rel.target_collection, []).append(rel.target_field)
+    for common_field, source_coll, target_coll in common_field_pairs:
+        probes.setdefault(source_coll, []).append(common_field)
+        probes.setdefault(target_coll, []).append(common_field)
+
+    sampled_values: Dict[tuple, Set[Any]] = {}
+    if probes:
+        # Collections are sampled concurrently; pymongo releases the GIL on I/O
+        collections = list(probes)
+        fields_per_collection = [list(dict.fromkeys(probes[coll])) for coll in collections]
+        max_workers = min(MAX_SAMPLING_WORKERS, len(collections))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            batches = executor.map(partial(_sample_field_values_batch, db), collections, fields_per_collection)
+            for coll, values_by_field in zip(collections, batches):
+                for field, values in values_by_field.items():
+                    sampled_values[(coll, field)] = values
+
+    # Verify name-based relationships with value overlap
     for rel in name_relationships:
         pair_key = (rel.source_collection, rel.source_field, rel.target_collection, rel.target_field)
         if pair_key not in seen_pairs:
-            # Verify with value overlap
-            overlap_confidence = detect_value_overlap_relationships(
-                rel.source_collection,
-                rel.source_field,
-                rel.target_collection,
-                rel.target_field,
-                db
+            overlap_confidence = _overlap_ratio(
+                sampled_values[(rel.source_collection, rel.source_field)],
+                sampled_values[(rel.target_collection, rel.target_field)]
             )
 
             # Update confidence based on value overlap
             if overlap_confidence > 0.2:  # At least 20% overlap
-                rel.confidence_score = (rel.confidence_score + overlap_confidence) / 2
+                rel = rel.model_copy(update={
+                    "confidence_score": (rel.confidence_score + overlap_confidence) / 2
+                })
                 if rel.confidence_score >= min_confidence:
                     all_relationships.append(rel)
                     seen_pairs.add(pair_key)
 
-    # Detect common field name overlaps (like 'city', 'location', 'category')
-    common_fields = ['city', 'location', 'category', 'name', 'email', 'status']
-    for common_field in common_fields:
-        collections_with_field = [
-            coll for coll, fields in schema_info.items()
-            if common_field in fields
-        ]
+    # Check pairwise common-field relationships
+    for common_field, source_coll, target_coll in common_field_pairs:
+        # Common-field pairs are undirected, so one key covers both orders
+        pair_key = frozenset(((source_coll, common_field), (target_coll, common_field)))
+
+        if pair_key not in seen_pairs:
+            # Check value overlap
+            overlap_confidence = _overlap_ratio(
+                sampled_values[(source_coll, common_field)],
+                sampled_values[(target_coll, common_field)]
+            )
 
-        if len(collections_with_field) >= 2:
-            # Check pairwise relationships
-            for i, source_coll in enumerate(collections_with_field):
-                for target_coll in collections_with_field[i+1:]:
-                    pair_key = (source_coll, common_field, target_coll, common_field)
-                    reverse_pair_key = (target_coll, common_field, source_coll, common_field)
-
-                    if pair_key not in seen_pairs and reverse_pair_key not in seen_pairs:
-                        # Check value overlap
-                        overlap_confidence = detect_value_overlap_relationships(
-                            source_coll,
-                            common_field,
-                            target_coll,
-                            common_field,
-                            db
-                        )
-
-                        if overlap_confidence >= min_confidence:
-                            all_relationships.append(FieldRelationship(
-                                source_collection=source_coll,
-                                source_field=common_field,
-                                target_collection=target_coll,
-                                target_field=common_field,
-                                relationship_type=RelationshipType.many_to_many,
-                                confidence_score=overlap_confidence
-                            ))
-                            seen_pairs.add(pair_key)
+            if overlap_confidence >= min_confidence:
+                all_relationships.append(FieldRelationship(
+                    source_collection=source_coll,
+                    source_field=common_field,
+                    target_collection=target_coll,
+                    target_field=common_field,
+                    relationship_type=RelationshipType.many_to_many,
+                    confidence_score=overlap_confidence
+                ))
+                seen_pairs.add(pair_key)
 
     logger.info(f"Detected {len(all_relationships)} relationships across {len(schema_info)} collections")
 
@@ -1,8 +1,9 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import BackgroundTasks, FastAPI, File, UploadFile, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, Response
 from datetime import datetime
-import os
-import traceback
 from typing import Optional
 from dotenv import load_dotenv
 import logging
@@ -38,14 +39,18 @@ from core.data_models import (
 
 # Import core modules
 from core.file_processor import convert_csv_to_mongodb, convert_json_to_mongodb
-from core.llm_processor import generate_mongodb_query
+from core.llm_processor import generate_mongodb_query, close_llm_clients
 from core.mongo_processor import (
-    get_mongodb_connection,
-    execute_mongodb_query,
-    execute_aggregation_pipeline,
+    get_mongodb_database,
+    execute_mongodb_query_async,
+    execute_aggregation_pipeline_async,
     get_database_schema,
+    get_schema_cache_age,
+    refresh_database_schema,
     drop_collection,
-    close_mongodb_connection
+    close_mongodb_connection,
+    close_async_mongodb_connection,
+    to_json_bytes
 )
 from core.insights import generate_insights
 from core.mongo_security import validate_collection_name, MongoSecurityError
@@ -53,9 +58,14 @@ from core.mongo_security import validate_collection_name, MongoSecurityError
 app = FastAPI(
     title="Natural Language MongoDB Query Interface",
     description="Convert natural language to MongoDB queries",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
+# Compress large JSON payloads (query results, schemas); added first so the
+# CORS middleware stays outermost
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # CORS configuration for frontend
 app.add_middleware(
     CORSMiddleware,
@@ -73,26 +83,26 @@ app_start_time = datetime.now()
 async def startup_event():
     """Verify MongoDB connection on startup"""
     try:
-        client = get_mongodb_connection()
-        db_name = os.getenv("MONGODB_DATABASE", "nlq_interface")
-        db = client[db_name]
+        db = get_mongodb_database()
         # Test connection
         db.command('ping')
-        logger.info(f"[SUCCESS] Connected to MongoDB database: {db_name}")
+        logger.info("[SUCCESS] Connected to MongoDB database: %s", db.name)
     except Exception as e:
-        logger.error(f"[ERROR] Failed to connect to MongoDB: {str(e)}")
+        logger.error("[ERROR] Failed to connect to MongoDB: %s", e)
         raise
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    """Close MongoDB connection on shutdown"""
+    """Close MongoDB and LLM provider connections on shutdown"""
     close_mongodb_connection()
+    await close_async_mongodb_connection()
     logger.info("[INFO] MongoDB connection closed")
+    await close_llm_clients()
 
 
 @app.post("/api/upload", response_model=FileUploadResponse)
-async def upload_file(file: UploadFile = File(...)) -> FileUploadResponse:
+async def upload_file(background_tasks: BackgroundTasks, file: UploadFile = File(...)) -> FileUploadResponse:
     """Upload and convert .json or .csv file to MongoDB collection"""
     try:
         # Validate file type
@@ -102,14 +112,13 @@ async def upload_file(file: UploadFile = File(...)) -> FileUploadResponse:
         # Generate collection name from filename
         collection_name = file.filename.rsplit('.', 1)[0].lower().replace(' ', '_')
 
-        # Read file content
-        content = await file.read()
-
-        # Convert to MongoDB based on file type
+        # Convert to MongoDB based on file type, reading straight from the
+        # spooled upload file instead of copying it into memory. Parsing and
+        # inserting block, so they run in the threadpool.
         if file.filename.endswith('.csv'):
-            result = convert_csv_to_mongodb(content, collection_name)
+            result = await run_in_threadpool(convert_csv_to_mongodb, file.file, collection_name)
         else:
-            result = convert_json_to_mongodb(content, collection_name)
+            result = await run_in_threadpool(convert_json_to_mongodb, file.file, collection_name)
 
         response = FileUploadResponse(
             collection_name=result['collection_name'],
@@ -117,11 +126,13 @@ async def upload_file(file: UploadFile = File(...)) -> FileUploadResponse:
             document_count=result['document_count'],
             sample_data=result['sample_data']
         )
-        logger.info(f"[SUCCESS] File upload: {response.collection_name}, {response.document_count} documents")
+        logger.info("[SUCCESS] File upload: %s, %d documents", response.collection_name, response.document_count)
+
+        # Rebuild the schema and its relationships after responding
+        background_tasks.add_task(refresh_database_schema)
         return response
     except Exception as e:
-        logger.error(f"[ERROR] File upload failed: {str(e)}")
-        logger.error(f"[ERROR] Full traceback:\n{traceback.format_exc()}")
+        logger.exception("[ERROR] File upload failed: %s", e)
         return FileUploadResponse(
             collection_name="",
             schema={},
@@ -132,14 +143,14 @@ async def upload_file(file: UploadFile = File(...)) -> FileUploadResponse:
 
 
 @app.post("/api/query", response_model=QueryResponse)
-async def process_natural_language_query(request: QueryRequest) -> QueryResponse:
+async def process_natural_language_query(request: QueryRequest):
     """Process natural language query and return MongoDB results"""
     try:
-        # Get database schema
-        schema_info = get_database_schema()
+        # Get database schema (blocking pymongo calls when not cached)
+        schema_info = await run_in_threadpool(get_database_schema)
 
         # Generate MongoDB query using routing logic
-        mongo_query = generate_mongodb_query(request, schema_info)
+        mongo_query = await generate_mongodb_query(request, schema_info)
 
         # Extract query components
         query_type = mongo_query.get('query_type', 'find')
@@ -162,33 +173,32 @@ async def process_natural_language_query(request: QueryRequest) -> QueryResponse
                         collections_involved.append(lookup_collection)
 
         if is_cross_collection:
-            logger.info(f"[INFO] Cross-collection query detected: {', '.join(collections_involved)}")
+            logger.info("[INFO] Cross-collection query detected: %s", ', '.join(collections_involved))
 
         # Execute MongoDB query
-        start_time = time.time()
+        start_time = time.perf_counter_ns()
 
         if query_type == 'aggregate':
             # Execute aggregation pipeline
             if is_cross_collection:
-                logger.info(f"[INFO] Executing cross-collection aggregation with {len(query)} stages")
-            results = execute_aggregation_pipeline(collection_name, query)
+                logger.info("[INFO] Executing cross-collection aggregation with %d stages", len(query))
+            results = await execute_aggregation_pipeline_async(collection_name, query)
         else:
             # Execute find query
-            results = execute_mongodb_query(
+            results = await execute_mongodb_query_async(
                 collection_name=collection_name,
                 filter_query=query,
                 sort=sort,
                 limit=limit
             )
 
-        execution_time = (time.time() - start_time) * 1000
+        execution_time = (time.perf_counter_ns() - start_time) / 1_000_000
 
         # Extract field names from results
-        fields = []
-        if results:
-            fields = list(results[0].keys())
+        fields = list(results[0].keys()) if results else []
 
-        response = QueryResponse(
+        # Built from trusted server-side data, so skip re-validating it
+        response = QueryResponse.model_construct(
             mongodb_query=mongo_query,
             results=results,
             fields=fields,
@@ -196,15 +206,20 @@ async def process_natural_language_query(request: QueryRequest) -> QueryResponse
             execution_time_ms=execution_time
         )
 
-        log_msg = f"[SUCCESS] Query processed: collection={collection_name}, documents={len(results)}, time={execution_time:.2f}ms"
         if is_cross_collection:
-            log_msg += f", cross-collection=True, collections={len(collections_involved)}"
-        logger.info(log_msg)
+            logger.info(
+                "[SUCCESS] Query processed: collection=%s, documents=%d, time=%.2fms, cross-collection=True, collections=%d",
+                collection_name, len(results), execution_time, len(collections_involved)
+            )
+        else:
+            logger.info(
+                "[SUCCESS] Query processed: collection=%s, documents=%d, time=%.2fms",
+                collection_name, len(results), execution_time
+            )
 
-        return response
+        return Response(content=to_json_bytes(response.model_dump()), media_type="application/json")
     except Exception as e:
-        logger.error(f"[ERROR] Query processing failed: {str(e)}")
-        logger.error(f"[ERROR] Full traceback:\n{traceback.format_exc()}")
+        logger.exception("[ERROR] Query processing failed: %s", e)
         return QueryResponse(
             mongodb_query={},
             results=[],
@@ -216,10 +231,10 @@ async def process_natural_language_query(request: QueryRequest) -> QueryResponse
 
 
 @app.get("/api/schema", response_model=DatabaseSchemaResponse)
-async def get_database_schema_endpoint() -> DatabaseSchemaResponse:
+async def get_database_schema_endpoint():
     """Get current database schema and collection information"""
     try:
-        schema_result = get_database_schema()
+        schema_result = await run_in_threadpool(get_database_schema)
         collections = []
 
         # Handle new format with collections and relationships
@@ -229,28 +244,28 @@ async def get_database_schema_endpoint() -> DatabaseSchemaResponse:
         for collection_name, collection_info in schema_collections.items():
             fields = []
             for field_name, field_info in collection_info.get('fields', {}).items():
-                fields.append(FieldInfo(
+                fields.append(FieldInfo.model_construct(
                     name=field_name,
                     type=field_info.get('type', 'unknown'),
                     sample=field_info.get('sample')
                 ))
 
-            collections.append(CollectionSchema(
+            collections.append(CollectionSchema.model_construct(
                 name=collection_name,
                 fields=fields,
                 document_count=collection_info.get('count', 0)
             ))
 
-        response = DatabaseSchemaResponse(
+        # Built from get_database_schema output, so skip re-validating it
+        response = DatabaseSchemaResponse.model_construct(
             collections=collections,
             total_collections=len(collections),
             relationships=relationships
         )
-        logger.info(f"[SUCCESS] Schema retrieved: {len(collections)} collections, {len(relationships)} relationships")
-        return response
+        logger.info("[SUCCESS] Schema retrieved: %d collections, %d relationships", len(collections), len(relationships))
+        return Response(content=to_json_bytes(response.model_dump()), media_type="application/json")
     except Exception as e:
-        logger.error(f"[ERROR] Schema retrieval failed: {str(e)}")
-        logger.error(f"[ERROR] Full traceback:\n{traceback.format_exc()}")
+        logger.exception("[ERROR] Schema retrieval failed: %s", e)
         return DatabaseSchemaResponse(
             collections=[],
             total_collections=0,
@@ -260,20 +275,19 @@ async def get_database_schema_endpoint() -> DatabaseSchemaResponse:
 
 
 @app.post("/api/insights", response_model=InsightsResponse)
-async def generate_insights_endpoint(request: InsightsRequest) -> InsightsResponse:
+async def generate_insights_endpoint(request: InsightsRequest):
     """Generate statistical insights for collection fields"""
     try:
-        insights = generate_insights(request.collection_name, request.field_names)
-        response = InsightsResponse(
+        insights = await run_in_threadpool(generate_insights, request.collection_name, request.field_names)
+        response = InsightsResponse.model_construct(
             collection_name=request.collection_name,
             insights=insights,
             generated_at=datetime.now()
         )
-        logger.info(f"[SUCCESS] Insights generated for collection: {request.collection_name}, insights count: {len(insights)}")
-        return response
+        logger.info("[SUCCESS] Insights generated for collection: %s, insights count: %d", request.collection_name, len(insights))
+        return Response(content=to_json_bytes(response.model_dump()), media_type="application/json")
     except Exception as e:
-        logger.error(f"[ERROR] Insights generation failed: {str(e)}")
-        logger.error(f"[ERROR] Full traceback:\n{traceback.format_exc()}")
+        logger.exception("[ERROR] Insights generation failed: %s", e)
         return InsightsResponse(
             collection_name=request.collection_name,
             insights=[],
@@ -287,16 +301,17 @@ async def health_check() -> HealthCheckResponse:
     """Health check endpoint with database status"""
     try:
         # Check database connection
-        client = get_mongodb_connection()
-        db_name = os.getenv("MONGODB_DATABASE", "nlq_interface")
-        db = client[db_name]
+        db = get_mongodb_database()
 
         # Test connection
-        db.command('ping')
+        await run_in_threadpool(db.command, 'ping')
 
-        # Get collection count
-        collections = db.list_collection_names()
-        collection_count = len([c for c in collections if not c.startswith('system.')])
+        # Get collection count, leaving system collections out server-side
+        collections = await run_in_threadpool(
+            db.list_collection_names,
+            filter={"name": {"$not": {"$regex": r"^system\."}}}
+        )
+        collection_count = len(collections)
 
         uptime = (datetime.now() - app_start_time).total_seconds()
 
@@ -304,13 +319,13 @@ async def health_check() -> HealthCheckResponse:
             status="ok",
             database_connected=True,
             collections_count=collection_count,
-            uptime_seconds=uptime
+            uptime_seconds=uptime,
+            schema_cache_age_seconds=get_schema_cache_age()
         )
-        logger.info(f"[SUCCESS] Health check: OK, {collection_count} collections, uptime: {uptime:.2f}s")
+        logger.info("[SUCCESS] Health check: OK, %d collections, uptime: %.2fs", collection_count, uptime)
         return response
     except Exception as e:
-        logger.error(f"[ERROR] Health check failed: {str(e)}")
-        logger.error(f"[ERROR] Full traceback:\n{traceback.format_exc()}")
+        logger.exception("[ERROR] Health check failed: %s", e)
         return HealthCheckResponse(
             status="error",
             database_connected=False,
@@ -320,7 +335,7 @@ async def health_check() -> HealthCheckResponse:
 
 
 @app.delete("/api/collection/{collection_name}")
-async def delete_collection(collection_name: str):
+async def delete_collection(collection_name: str, background_tasks: BackgroundTasks):
     """Delete a collection from the database"""
     try:
         # Validate collection name using security module
@@ -330,25 +345,24 @@ async def delete_collection(collection_name: str):
             raise HTTPException(400, str(e))
 
         # Check if collection exists
-        client = get_mongodb_connection()
-        db_name = os.getenv("MONGODB_DATABASE", "nlq_interface")
-        db = client[db_name]
-        collections = db.list_collection_names()
+        db = get_mongodb_database()
+        collections = await run_in_threadpool(db.list_collection_names)
 
         if collection_name not in collections:
             raise HTTPException(404, f"Collection '{collection_name}' not found")
 
         # Drop the collection
-        drop_collection(collection_name)
+        await run_in_threadpool(drop_collection, collection_name)
+
+        background_tasks.add_task(refresh_database_schema)
 
         response = {"message": f"Collection '{collection_name}' deleted successfully"}
-        logger.info(f"[SUCCESS] Collection deleted: {collection_name}")
+        logger.info("[SUCCESS] Collection deleted: %s", collection_name)
         return response
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"[ERROR] Collection deletion failed: {str(e)}")
-        logger.error(f"[ERROR] Full traceback:\n{traceback.format_exc()}")
+        logger.exception("[ERROR] Collection deletion failed: %s", e)
         raise HTTPException(500, f"Error deleting collection: {str(e)}")
 
 
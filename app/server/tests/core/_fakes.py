@@ -0,0 +1,97 @@
+"""
+Lightweight stand-ins for pymongo objects used by unit tests.
+
+Unlike MagicMock chains these are plain classes: attribute access costs
+nothing, isinstance/type checks see ordinary objects, and the calls a test
+cares about are recorded in simple lists.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+class FakeCursor:
+    """Iterable cursor whose chaining methods record their argument and return itself"""
+
+    def __init__(self, documents: Iterable[Dict[str, Any]] = ()):
+        self._documents = documents
+        self.sorts: List[Any] = []
+        self.limits: List[int] = []
+
+    def __iter__(self):
+        return iter(self._documents)
+
+    def sort(self, key_or_list: Any, *args, **kwargs) -> "FakeCursor":
+        self.sorts.append(key_or_list)
+        return self
+
+    def limit(self, limit: int) -> "FakeCursor":
+        self.limits.append(limit)
+        return self
+
+    def batch_size(self, batch_size: int) -> "FakeCursor":
+        return self
+
+
+class FakeCollection:
+    """
+    Collection answering find() with fixed documents and aggregate() with queued results.
+
+    Each aggregate() call takes the next entry of aggregate_results (raising
+    it if it is an exception); once the queue is empty it returns no documents.
+    """
+
+    def __init__(
+        self,
+        documents: Iterable[Dict[str, Any]] = (),
+        aggregate_results: Iterable[Any] = ()
+    ):
+        self.documents = documents
+        self.aggregate_results = list(aggregate_results)
+        self.find_calls: List[Tuple[tuple, Dict[str, Any]]] = []
+        self.cursors: List[FakeCursor] = []
+        self.aggregate_calls: List[Tuple[Any, Dict[str, Any]]] = []
+
+    def find(self, *args, **kwargs) -> FakeCursor:
+        self.find_calls.append((args, kwargs))
+        self.cursors.append(FakeCursor(self.documents))
+        return self.cursors[-1]
+
+    def aggregate(self, pipeline: List[Dict[str, Any]], **kwargs) -> FakeCursor:
+        self.aggregate_calls.append((pipeline, kwargs))
+        result = self.aggregate_results.pop(0) if self.aggregate_results else ()
+        if isinstance(result, Exception):
+            raise result
+        return FakeCursor(result)
+
+
+class FakeDB:
+    """Database handing out FakeCollections by name, created on first access"""
+
+    def __init__(self, collections: Optional[Dict[str, FakeCollection]] = None):
+        self.collections = dict(collections or {})
+        self.accessed: List[str] = []
+        self.get_collection_calls: List[Tuple[str, Dict[str, Any]]] = []
+        self.client = None
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        self.accessed.append(name)
+        return self.collections.setdefault(name, FakeCollection())
+
+    def get_collection(self, name: str, **kwargs) -> FakeCollection:
+        self.get_collection_calls.append((name, kwargs))
+        return self[name]
+
+
+class FakeClient:
+    """Client returning the same FakeDB for any database name"""
+
+    def __init__(self, db: FakeDB):
+        self.db = db
+
+    def __getitem__(self, name: str) -> FakeDB:
+        return self.db
+
+
+def fake_client(**collections: FakeCollection) -> FakeClient:
+    """Client over a FakeDB holding the given collections, e.g. fake_client(users=FakeCollection(docs))"""
+    return FakeClient(FakeDB(collections))
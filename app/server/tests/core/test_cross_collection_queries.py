@@ -2,6 +2,8 @@
 Integration tests for cross-collection query generation and execution
 """
 
+import re
+
 import pytest
 from unittest.mock import Mock, MagicMock, patch
 from core.llm_processor import format_schema_for_prompt
@@ -9,9 +11,9 @@ from core.mongo_security import validate_aggregation_pipeline, validate_lookup_s
 from core.data_models import FieldRelationship, RelationshipType
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def sample_schema_with_relationships():
-    """Sample schema including relationships"""
+    """Sample schema including relationships (read-only, so built once per module)"""
     return {
         "collections": {
             "users": {
@@ -96,64 +98,40 @@ def test_valid_lookup_with_pipeline_syntax():
     assert result == valid_pipeline
 
 
-def test_invalid_lookup_missing_from():
-    """Test that $lookup without 'from' field is rejected"""
-    invalid_lookup = {
-        "localField": "city",
-        "foreignField": "location",
-        "as": "local_products"
-    }
-
-    with pytest.raises(MongoSecurityError, match="must have 'from' field"):
-        validate_lookup_stage(invalid_lookup)
-
-
-def test_invalid_lookup_system_collection():
-    """Test that $lookup to system collections is blocked"""
-    invalid_lookup = {
-        "from": "system.users",
-        "localField": "user_id",
-        "foreignField": "_id",
-        "as": "user_info"
-    }
-
-    with pytest.raises(MongoSecurityError, match="(cannot reference system collections|cannot start with 'system\\..*reserved)"):
-        validate_lookup_stage(invalid_lookup)
-
-
-def test_invalid_lookup_missing_as():
-    """Test that $lookup without 'as' field is rejected"""
-    invalid_lookup = {
-        "from": "products",
-        "localField": "city",
-        "foreignField": "location"
-    }
-
-    with pytest.raises(MongoSecurityError, match="must have 'as' field"):
-        validate_lookup_stage(invalid_lookup)
-
-
-def test_invalid_lookup_missing_fields():
-    """Test that $lookup without localField/foreignField or pipeline is rejected"""
-    invalid_lookup = {
-        "from": "products",
-        "as": "products_list"
-    }
-
-    with pytest.raises(MongoSecurityError, match="must have either localField/foreignField or pipeline"):
-        validate_lookup_stage(invalid_lookup)
-
-
-def test_invalid_lookup_dangerous_collection_name():
-    """Test that $lookup with invalid collection name is blocked"""
-    invalid_lookup = {
-        "from": "products$injection",
-        "localField": "city",
-        "foreignField": "location",
-        "as": "products_list"
-    }
-
-    with pytest.raises(MongoSecurityError, match="cannot contain.*\\$"):
+# Error patterns are compiled once here rather than on every pytest.raises
+INVALID_LOOKUPS = (
+    pytest.param(
+        {"localField": "city", "foreignField": "location", "as": "local_products"},
+        re.compile("must have 'from' field"),
+        id="missing_from",
+    ),
+    pytest.param(
+        {"from": "system.users", "localField": "user_id", "foreignField": "_id", "as": "user_info"},
+        re.compile("(cannot reference system collections|cannot start with 'system\\..*reserved)"),
+        id="system_collection",
+    ),
+    pytest.param(
+        {"from": "products", "localField": "city", "foreignField": "location"},
+        re.compile("must have 'as' field"),
+        id="missing_as",
+    ),
+    pytest.param(
+        {"from": "products", "as": "products_list"},
+        re.compile("must have either localField/foreignField or pipeline"),
+        id="missing_fields",
+    ),
+    pytest.param(
+        {"from": "products$injection", "localField": "city", "foreignField": "location", "as": "products_list"},
+        re.compile("cannot contain.*\\$"),
+        id="dangerous_collection_name",
+    ),
+)
+
+
+@pytest.mark.parametrize("invalid_lookup, error", INVALID_LOOKUPS)
+def test_invalid_lookup(invalid_lookup, error):
+    """Test that malformed or unsafe $lookup stages are rejected"""
+    with pytest.raises(MongoSecurityError, match=error):
         validate_lookup_stage(invalid_lookup)
 
 
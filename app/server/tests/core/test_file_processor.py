@@ -1,30 +1,46 @@
 import pytest
 import json
-import pandas as pd
-import os
-import io
+import orjson
+import tempfile
+import tracemalloc
+import numpy as np
+from collections import OrderedDict
 from pathlib import Path
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch
 from bson import ObjectId
-from core.file_processor import convert_csv_to_mongodb, convert_json_to_mongodb
+from core.file_processor import convert_csv_to_mongodb, convert_json_to_mongodb, sanitize_collection_name, summarize_documents
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def test_assets_dir():
     """Get the path to test assets directory"""
     return Path(__file__).parent.parent / "assets"
 
 
+@pytest.fixture(scope="session")
+def test_users_csv(test_assets_dir):
+    """Contents of test_users.csv, read once per session"""
+    return (test_assets_dir / "test_users.csv").read_bytes()
+
+
+@pytest.fixture(scope="session")
+def column_names_csv(test_assets_dir):
+    """Contents of column_names.csv, read once per session"""
+    return (test_assets_dir / "column_names.csv").read_bytes()
+
+
+@pytest.fixture(scope="session")
+def test_products_json(test_assets_dir):
+    """Contents of test_products.json, read once per session"""
+    return (test_assets_dir / "test_products.json").read_bytes()
+
+
 class TestFileProcessor:
 
-    def test_convert_csv_to_mongodb_success(self, test_assets_dir):
+    def test_convert_csv_to_mongodb_success(self, test_users_csv):
         # Load real CSV file
-        csv_file = test_assets_dir / "test_users.csv"
-        with open(csv_file, 'rb') as f:
-            csv_data = f.read()
-
         table_name = "users"
-        result = convert_csv_to_mongodb(csv_data, table_name)
+        result = convert_csv_to_mongodb(test_users_csv, table_name)
 
         # Verify return structure
         assert result['collection_name'] == table_name
@@ -43,20 +59,17 @@ class TestFileProcessor:
         assert 'email' in result['schema']
         
         # Verify sample data structure and content
-        john_data = next((item for item in result['sample_data'] if item['name'] == 'John Doe'), None)
+        by_name = {item['name']: item for item in result['sample_data']}
+        john_data = by_name.get('John Doe')
         assert john_data is not None
         assert john_data['age'] == 25
         assert john_data['city'] == 'New York'
         assert john_data['email'] == 'john@example.com'
     
-    def test_convert_csv_to_mongodb_field_cleaning(self, test_assets_dir):
+    def test_convert_csv_to_mongodb_field_cleaning(self, column_names_csv):
         # Test column name cleaning with real file
-        csv_file = test_assets_dir / "column_names.csv"
-        with open(csv_file, 'rb') as f:
-            csv_data = f.read()
-
         table_name = "test_users"
-        result = convert_csv_to_mongodb(csv_data, table_name)
+        result = convert_csv_to_mongodb(column_names_csv, table_name)
         
         # Verify columns were cleaned in the schema
         assert 'full_name' in result['schema']
@@ -80,20 +93,16 @@ class TestFileProcessor:
 
         table_name = "inconsistent_table"
 
-        # Pandas will fail on inconsistent CSV data
+        # The CSV parser will fail on inconsistent CSV data
         with pytest.raises(Exception) as exc_info:
             convert_csv_to_mongodb(csv_data, table_name)
 
         assert "Error converting CSV to MongoDB" in str(exc_info.value)
     
-    def test_convert_json_to_mongodb_success(self, test_assets_dir):
+    def test_convert_json_to_mongodb_success(self, test_products_json):
         # Load real JSON file
-        json_file = test_assets_dir / "test_products.json"
-        with open(json_file, 'rb') as f:
-            json_data = f.read()
-
         table_name = "products"
-        result = convert_json_to_mongodb(json_data, table_name)
+        result = convert_json_to_mongodb(test_products_json, table_name)
 
         # Verify return structure
         assert result['collection_name'] == table_name
@@ -113,7 +122,8 @@ class TestFileProcessor:
         assert 'in_stock' in result['schema']
         
         # Verify sample data structure and content
-        laptop_data = next((item for item in result['sample_data'] if item['name'] == 'Laptop'), None)
+        by_name = {item['name']: item for item in result['sample_data']}
+        laptop_data = by_name.get('Laptop')
         assert laptop_data is not None
         assert laptop_data['price'] == 999.99
         assert laptop_data['category'] == 'Electronics'
@@ -178,9 +188,8 @@ class TestFileProcessor:
                 assert isinstance(doc['_id'], str)
                 assert not isinstance(doc['_id'], ObjectId)
 
-        # Verify the entire result is JSON-serializable
-        json_str = json.dumps(result)
-        assert json_str is not None
+        # Verify the entire result is JSON-serializable by the response encoder
+        assert orjson.dumps(result)
 
     @patch('core.file_processor.insert_documents')
     @patch('core.file_processor.collection_exists')
@@ -211,6 +220,251 @@ class TestFileProcessor:
                 assert isinstance(doc['_id'], str)
                 assert not isinstance(doc['_id'], ObjectId)
 
-        # Verify the entire result is JSON-serializable
-        json_str = json.dumps(result)
-        assert json_str is not None
\ No newline at end of file
+        # Verify the entire result is JSON-serializable by the response encoder
+        assert orjson.dumps(result)
+
+    @patch('core.file_processor.insert_documents')
+    @patch('core.file_processor.collection_exists')
+    def test_json_upload_normalizes_keys_without_pandas(self, mock_collection_exists, mock_insert_documents):
+        """Test that JSON keys are cleaned, missing keys stay absent and native types are kept"""
+        mock_collection_exists.return_value = False
+        mock_insert_documents.side_effect = lambda collection_name, documents: len(documents)
+
+        json_data = b'[{"Full Name": "Ann", "Unit-Price": 3}, {"Full Name": "Bob", "In Stock": true, "Unit-Price": null}]'
+
+        result = convert_json_to_mongodb(json_data, "test_collection")
+
+        documents = mock_insert_documents.call_args[0][1]
+        assert documents[0] == {"full_name": "Ann", "unit_price": 3}
+        assert documents[1] == {"full_name": "Bob", "in_stock": True, "unit_price": None}
+        assert isinstance(documents[0]["unit_price"], int)
+        assert result['schema'] == {"full_name": "string", "unit_price": "number", "in_stock": "boolean"}
+
+    @patch('core.file_processor.STREAM_JSON_THRESHOLD_BYTES', 0)
+    @patch('core.file_processor.INSERT_BATCH_SIZE', 2)
+    @patch('core.file_processor.insert_documents')
+    @patch('core.file_processor.collection_exists')
+    def test_json_upload_streams_large_arrays_in_batches(self, mock_collection_exists, mock_insert_documents):
+        """Test that large JSON arrays are parsed incrementally and inserted batch by batch"""
+        mock_collection_exists.return_value = False
+        mock_insert_documents.side_effect = lambda collection_name, documents: len(documents)
+
+        json_data = json.dumps([{"Name": f"P{i}", "Price": i + 0.5} for i in range(5)]).encode('utf-8')
+
+        result = convert_json_to_mongodb(json_data, "test_collection")
+
+        assert result['document_count'] == 5
+        assert [len(call.args[1]) for call in mock_insert_documents.call_args_list] == [2, 2, 1]
+        assert result['schema'] == {"name": "string", "price": "double"}
+        assert isinstance(result['sample_data'][0]['price'], float)
+        assert len(result['sample_data']) == 5
+
+    @patch('core.file_processor.STREAM_JSON_THRESHOLD_BYTES', 0)
+    @patch('core.file_processor.INSERT_BATCH_SIZE', 2)
+    @patch('core.file_processor.insert_documents')
+    @patch('core.file_processor.collection_exists')
+    def test_streamed_json_schema_includes_late_fields(self, mock_collection_exists, mock_insert_documents):
+        """Test that keys first seen after the first batch still reach the schema"""
+        mock_collection_exists.return_value = False
+        mock_insert_documents.side_effect = lambda collection_name, documents: len(documents)
+
+        records = [{"name": f"P{i}"} for i in range(4)] + [{"name": "P4", "Discount": 0.1}]
+        json_data = json.dumps(records).encode('utf-8')
+
+        result = convert_json_to_mongodb(json_data, "test_collection")
+
+        assert result['schema'] == {"name": "string", "discount": "double"}
+
+    @patch('core.file_processor.STREAM_JSON_THRESHOLD_BYTES', 0)
+    @patch('core.file_processor.collection_exists')
+    def test_streamed_json_must_be_array(self, mock_collection_exists):
+        """Test that the streaming parser still rejects non-array JSON"""
+        mock_collection_exists.return_value = False
+
+        with pytest.raises(Exception, match="JSON must be an array of objects"):
+            convert_json_to_mongodb(b'{"name": "John"}', "test_collection")
+
+    @patch('core.file_processor.STREAM_JSON_THRESHOLD_BYTES', 0)
+    @patch('core.file_processor.insert_documents')
+    @patch('core.file_processor.collection_exists')
+    def test_json_upload_reads_from_file_object(self, mock_collection_exists, mock_insert_documents):
+        """Test that an upload's spooled file is parsed in place, whatever its position"""
+        mock_collection_exists.return_value = False
+        mock_insert_documents.side_effect = lambda collection_name, documents: len(documents)
+
+        upload = tempfile.SpooledTemporaryFile()
+        upload.write(b'  [{"Name": "Ann"}, {"Name": "Bob"}]')
+
+        result = convert_json_to_mongodb(upload, "test_collection")
+
+        assert result['document_count'] == 2
+        assert result['schema'] == {"name": "string"}
+
+    @patch('core.file_processor.INSERT_BATCH_SIZE', 2)
+    @patch('core.file_processor.insert_documents')
+    @patch('core.file_processor.collection_exists')
+    def test_csv_upload_inserts_file_object_in_batches(self, mock_collection_exists, mock_insert_documents):
+        """Test that CSV rows are converted and inserted one batch at a time"""
+        mock_collection_exists.return_value = False
+        mock_insert_documents.side_effect = lambda collection_name, documents: len(documents)
+
+        upload = tempfile.SpooledTemporaryFile()
+        upload.write(b"Name,Joined\nAnn,2020-01-01\nBob,2021-02-03\nCid,2022-03-04")
+
+        result = convert_csv_to_mongodb(upload, "test_collection")
+
+        assert result['document_count'] == 3
+        assert [len(call.args[1]) for call in mock_insert_documents.call_args_list] == [2, 1]
+        assert result['schema'] == {"name": "string", "joined": "string"}
+        assert len(result['sample_data']) == 2
+
+    @patch('core.file_processor.INSERT_BATCH_SIZE', 1)
+    @patch('core.file_processor.drop_collection')
+    @patch('core.file_processor.insert_documents')
+    @patch('core.file_processor.collection_exists')
+    def test_csv_upload_drops_partial_import_on_failure(self, mock_collection_exists, mock_insert_documents, mock_drop_collection):
+        """Test that a failed batch removes the rows already inserted"""
+        mock_collection_exists.return_value = False
+        mock_insert_documents.side_effect = [1, Exception("write failed")]
+
+        with pytest.raises(Exception, match="write failed"):
+            convert_csv_to_mongodb(b"name\nAnn\nBob", "test_collection")
+
+        mock_drop_collection.assert_called_once_with("test_collection")
+
+    @patch('core.file_processor.collection_exists')
+    def test_csv_upload_memory_stays_bounded(self, mock_collection_exists):
+        """Test that a large CSV never exists as Python objects all at once"""
+        mock_collection_exists.return_value = False
+        rows = b"".join(b"user%d,user%d@example.com,%d\n" % (i, i, i % 90) for i in range(100_000))
+        csv_data = b"name,email,age\n" + rows
+
+        # A plain function, since a Mock would keep every batch in call_args_list
+        with patch('core.file_processor.insert_documents', new=lambda name, documents: len(documents)):
+            convert_csv_to_mongodb(b"name\nwarm-up", "test_collection")
+            tracemalloc.start()
+            try:
+                result = convert_csv_to_mongodb(csv_data, "test_collection")
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+        assert result['document_count'] == 100_000
+        assert peak < len(csv_data) // 4
+
+    @patch('core.file_processor.drop_collection')
+    @patch('core.file_processor.insert_documents')
+    @patch('core.file_processor.collection_exists')
+    def test_reupload_drops_collection_before_inserting(self, mock_collection_exists, mock_insert_documents, mock_drop_collection):
+        """Test that both converters replace an existing collection rather than appending to it"""
+        mock_collection_exists.return_value = True
+        events = []
+        mock_drop_collection.side_effect = lambda name: events.append(("drop", name))
+
+        def record_insert(name, documents):
+            events.append(("insert", name))
+            return len(documents)
+
+        mock_insert_documents.side_effect = record_insert
+
+        convert_csv_to_mongodb(b"name\nAnn\nBob", "people")
+        convert_json_to_mongodb(b'[{"name": "Ann"}, {"name": "Bob"}]', "people")
+
+        assert events == [("drop", "people"), ("insert", "people")] * 2
+
+    @patch('core.file_processor.insert_documents')
+    @patch('core.file_processor.collection_exists')
+    def test_csv_upload_replaces_missing_values_with_none(self, mock_collection_exists, mock_insert_documents):
+        """Test that empty CSV cells become None and values are native Python types"""
+        mock_collection_exists.return_value = False
+        mock_insert_documents.side_effect = lambda collection_name, documents: len(documents)
+
+        csv_data = b"Name,Age,Home City\nJohn,25,NYC\nJane,,LA"
+
+        convert_csv_to_mongodb(csv_data, "test_collection")
+
+        documents = mock_insert_documents.call_args[0][1]
+        assert documents[0]['name'] == 'John'
+        assert documents[0]['home_city'] == 'NYC'
+        assert documents[1]['age'] is None
+        assert type(documents[0]['age']) in (int, float)
+
+    @patch('core.file_processor.insert_documents')
+    @patch('core.file_processor.collection_exists')
+    def test_csv_schema_uses_column_types(self, mock_collection_exists, mock_insert_documents):
+        """Test that CSV field types come from whole columns, not the first row"""
+        mock_collection_exists.return_value = False
+        mock_insert_documents.side_effect = lambda collection_name, documents: len(documents)
+
+        csv_data = b"name,age,score,active,notes\nJohn,,1.5,true,\nJane,30,2,false,"
+
+        result = convert_csv_to_mongodb(csv_data, "test_collection")
+
+        assert result['schema'] == {
+            "name": "string", "age": "number", "score": "double", "active": "boolean", "notes": "null"
+        }
+        assert result['sample_data'][0]['age'] is None
+
+    @patch('core.file_processor.insert_documents')
+    @patch('core.file_processor.collection_exists')
+    def test_csv_upload_keeps_dates_as_text(self, mock_collection_exists, mock_insert_documents, column_names_csv):
+        """Test that date-like CSV columns are stored as their original strings"""
+        mock_collection_exists.return_value = False
+        mock_insert_documents.side_effect = lambda collection_name, documents: len(documents)
+
+        result = convert_csv_to_mongodb(column_names_csv, "test_collection")
+
+        assert result['sample_data'][0]['birth_date'] == '1990-01-15'
+        assert result['schema']['birth_date'] == 'string'
+
+    def test_summarize_documents_types_from_first_value_per_field(self):
+        """Test type names for each supported Python type, with bool kept distinct from int"""
+        documents = [
+            {"count": 1, "price": 2.5, "active": True, "tags": [], "meta": {}, "note": None, "name": "a"},
+            {"count": "one", "extra": b"bytes"}
+        ]
+
+        schema, _ = summarize_documents(documents, sample_size=0)
+
+        assert schema == {
+            "count": "number",
+            "price": "double",
+            "active": "boolean",
+            "tags": "array",
+            "meta": "object",
+            "note": "null",
+            "name": "string",
+            "extra": "string"
+        }
+
+    def test_summarize_documents_handles_subclasses(self):
+        """Test that subclasses of the built-in types are classified like their base type"""
+        class Flag(int):
+            pass
+
+        documents = [{"flag": Flag(1), "ordered": OrderedDict(a=1), "score": np.float64(0.5)}]
+
+        schema, _ = summarize_documents(documents, sample_size=0)
+
+        assert schema == {"flag": "number", "ordered": "object", "score": "double"}
+
+    def test_sanitize_collection_name_replaces_bad_characters(self):
+        """Test that anything outside letters, digits, '_' and '-' becomes an underscore"""
+        assert sanitize_collection_name("orders_(32).csv") == "orders__32_"
+        assert sanitize_collection_name("my data-set") == "my_data-set"
+        assert sanitize_collection_name("café") == "caf_"
+        assert sanitize_collection_name("2024 sales") == "_2024_sales"
+
+    def test_summarize_documents_single_pass(self):
+        """Test that types and JSON-safe samples come from one pass"""
+        obj_id = ObjectId()
+        documents = [{"_id": obj_id, "n": 1}] + [{"_id": ObjectId(), "n": i, "late": True} for i in range(10)]
+
+        schema, sample_data = summarize_documents(documents, sample_size=1)
+
+        assert schema == {"_id": "string", "n": "number", "late": "boolean"}
+        assert sample_data == [{"_id": str(obj_id), "n": 1}]
+
+        _, sample_data = summarize_documents(documents, sample_size=3)
+
+        assert len(sample_data) == 3
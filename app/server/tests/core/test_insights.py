@@ -0,0 +1,167 @@
+"""
+Tests for per-field insight generation.
+"""
+
+import pytest
+from unittest.mock import patch, MagicMock
+from core.insights import generate_insights, build_field_insight_pipeline
+
+
+def make_database(sample_docs):
+    """Build a mocked Database whose collection.find_one returns the given documents"""
+    mock_collection = MagicMock()
+
+    def matches(doc, filter_query):
+        if "$or" in filter_query:
+            return any(matches(doc, clause) for clause in filter_query["$or"])
+        return all(doc.get(field) is not None for field in filter_query)
+
+    def find_one(filter_query=None, projection=None):
+        if not filter_query:
+            return sample_docs[0] if sample_docs else None
+        return next((doc for doc in sample_docs if matches(doc, filter_query)), None)
+
+    mock_collection.find_one.side_effect = find_one
+    mock_db = MagicMock()
+    mock_db.__getitem__.return_value = mock_collection
+    return mock_db
+
+
+def facet_result_for(pipeline):
+    """Return canned $facet output keyed on the analyzed field"""
+    field_name = next(iter(pipeline[0]["$facet"]["common"][0]["$match"]))
+    if field_name == "price":
+        return [{
+            "distinct": [{"unique_count": 3}],
+            "nulls": [],
+            "stats": [{"min_val": 10, "max_val": 30, "avg_val": 20.0}],
+            "common": [{"_id": 10, "count": 2}]
+        }]
+    return [{
+        "distinct": [{"unique_count": 2}],
+        "nulls": [{"null_count": 1}],
+        "stats": [],
+        "common": [{"_id": "Electronics", "count": 2}, {"_id": "Books", "count": 1}]
+    }]
+
+
+class TestGenerateInsights:
+
+    def test_build_field_insight_pipeline_is_single_facet(self):
+        pipeline = build_field_insight_pipeline("price")
+
+        assert len(pipeline) == 1
+        assert set(pipeline[0]["$facet"].keys()) == {"distinct", "nulls", "stats", "common"}
+
+    def test_distinct_count_does_not_use_add_to_set(self):
+        distinct = build_field_insight_pipeline("price")[0]["$facet"]["distinct"]
+
+        assert distinct[-1] == {"$count": "unique_count"}
+        assert "$addToSet" not in str(distinct)
+
+    def test_most_common_uses_sort_by_count(self):
+        common = build_field_insight_pipeline("category")[0]["$facet"]["common"]
+
+        assert common[1] == {"$sortByCount": "$category"}
+        assert common[2] == {"$limit": 5}
+
+    @patch('core.insights.execute_aggregation_pipeline')
+    @patch('core.insights.get_mongodb_database')
+    def test_one_aggregation_per_field_in_order(self, mock_get_database, mock_execute):
+        sample_docs = [{"_id": "1", "price": 10, "category": "Electronics"}]
+        mock_get_database.return_value = make_database(sample_docs)
+        mock_execute.side_effect = lambda collection_name, pipeline: facet_result_for(pipeline)
+
+        insights = generate_insights("products")
+
+        assert [insight.column_name for insight in insights] == ["price", "category"]
+        assert mock_execute.call_count == 2
+
+        price, category = insights
+        assert price.data_type == "number"
+        assert price.unique_values == 3
+        assert price.min_value == 10
+        assert price.max_value == 30
+        assert price.avg_value == 20.0
+        assert price.most_common == [{"value": 10, "count": 2}]
+
+        assert category.data_type == "string"
+        assert category.null_count == 1
+        assert category.min_value is None
+        assert category.most_common[0] == {"value": "Electronics", "count": 2}
+
+    @patch('core.insights.execute_aggregation_pipeline')
+    @patch('core.insights.get_mongodb_database')
+    def test_aggregation_failure_yields_empty_stats(self, mock_get_database, mock_execute):
+        mock_get_database.return_value = make_database([{"_id": "1", "price": 10}])
+        mock_execute.side_effect = Exception("aggregation failed")
+
+        insights = generate_insights("products", ["price"])
+
+        assert len(insights) == 1
+        assert insights[0].unique_values == 0
+        assert insights[0].null_count == 0
+        assert insights[0].most_common is None
+
+    @patch('core.insights.get_mongodb_database')
+    def test_invalid_field_name_rejected(self, mock_get_database):
+        mock_get_database.return_value = make_database([])
+
+        with pytest.raises(Exception) as exc_info:
+            generate_insights("products", ["$where"])
+
+        assert "Invalid field name" in str(exc_info.value)
+
+    @patch('core.insights.execute_aggregation_pipeline')
+    @patch('core.insights.get_mongodb_database')
+    def test_discovered_invalid_field_names_skipped(self, mock_get_database, mock_execute):
+        mock_get_database.return_value = make_database([{"_id": "1", "$bad": 1, "category": "Books"}])
+        mock_execute.side_effect = lambda collection_name, pipeline: facet_result_for(pipeline)
+
+        insights = generate_insights("products")
+
+        assert [insight.column_name for insight in insights] == ["category"]
+
+    @patch('core.insights.execute_aggregation_pipeline')
+    @patch('core.insights.get_mongodb_database')
+    def test_field_types_probed_with_one_query(self, mock_get_database, mock_execute):
+        mock_db = make_database([{"_id": "1", "price": 10, "category": "Books"}])
+        mock_get_database.return_value = mock_db
+        mock_execute.side_effect = lambda collection_name, pipeline: facet_result_for(pipeline)
+
+        insights = generate_insights("products", ["price", "category"])
+
+        mock_collection = mock_db["products"]
+        assert mock_collection.find_one.call_count == 1
+        assert [insight.data_type for insight in insights] == ["number", "string"]
+
+    @patch('core.insights.execute_aggregation_pipeline')
+    @patch('core.insights.get_mongodb_database')
+    def test_field_type_probe_with_no_document_having_every_field(self, mock_get_database, mock_execute):
+        # Mutually exclusive fields: the probe matches on any field, then one fallback fills the rest
+        sample_docs = [{"_id": "1", "price": 10}, {"_id": "2", "category": "Books"}]
+        mock_db = make_database(sample_docs)
+        mock_get_database.return_value = mock_db
+        mock_execute.side_effect = lambda collection_name, pipeline: facet_result_for(pipeline)
+
+        insights = generate_insights("products", ["price", "category"])
+
+        mock_collection = mock_db["products"]
+        assert [insight.data_type for insight in insights] == ["number", "string"]
+        assert mock_collection.find_one.call_count == 2
+        probe_filter = mock_collection.find_one.call_args_list[0][0][0]
+        assert probe_filter == {"$or": [
+            {"price": {"$exists": True, "$ne": None}},
+            {"category": {"$exists": True, "$ne": None}}
+        ]}
+
+    @patch('core.insights.execute_aggregation_pipeline')
+    @patch('core.insights.get_mongodb_database')
+    def test_field_type_probe_falls_back_per_field(self, mock_get_database, mock_execute):
+        sample_docs = [{"_id": "1", "price": 10, "category": None}, {"_id": "2", "price": None, "category": "Books"}]
+        mock_get_database.return_value = make_database(sample_docs)
+        mock_execute.side_effect = lambda collection_name, pipeline: facet_result_for(pipeline)
+
+        insights = generate_insights("products", ["price", "category", "missing"])
+
+        assert [insight.data_type for insight in insights] == ["number", "string", "unknown"]
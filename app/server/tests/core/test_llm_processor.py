@@ -1,26 +1,129 @@
+import asyncio
+import functools
 import pytest
 import os
-from unittest.mock import patch, MagicMock
+import anthropic
+import httpx
+import openai
+from types import SimpleNamespace
+from unittest.mock import ANY, patch, MagicMock, AsyncMock
 from core.llm_processor import (
     generate_mongodb_query_with_openai,
     generate_mongodb_query_with_anthropic,
     format_schema_for_prompt,
-    generate_mongodb_query
+    generate_mongodb_query,
+    get_openai_client,
+    get_anthropic_client,
+    parse_query_response,
+    reset_llm_clients,
+    close_llm_clients,
+    LLM_MAX_RETRIES,
+    clear_query_cache,
+    _format_schema_cached
 )
 from core.data_models import QueryRequest
 
 
+def _mock_client() -> MagicMock:
+    """Provider client whose completion calls are awaitable mocks"""
+    client = MagicMock()
+    client.chat.completions.create = AsyncMock()
+    client.messages.create = AsyncMock()
+    return client
+
+
+def _openai_response(text: str) -> SimpleNamespace:
+    """Minimal OpenAI chat completion carrying the given message text"""
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+
+def _anthropic_response(text: str) -> SimpleNamespace:
+    """Minimal Anthropic message carrying the given text block"""
+    return SimpleNamespace(content=[SimpleNamespace(text=text)])
+
+
+# Recorded provider response bodies, replayed through the real SDK parsers
+OPENAI_COMPLETION_BODY = {
+    "id": "chatcmpl-replay",
+    "object": "chat.completion",
+    "created": 1718000000,
+    "model": "gpt-4o-mini",
+    "choices": [{
+        "index": 0,
+        "message": {"role": "assistant", "content": '{"query_type": "find", "collection": "users", "query": {"age": {"$gt": 25}}, "limit": 100}'},
+        "finish_reason": "stop"
+    }],
+    "usage": {"prompt_tokens": 1200, "completion_tokens": 30, "total_tokens": 1230}
+}
+
+ANTHROPIC_MESSAGE_BODY = {
+    "id": "msg_replay",
+    "type": "message",
+    "role": "assistant",
+    "model": "claude-3-5-sonnet-20241022",
+    "content": [{"type": "text", "text": '```json\n{"query_type": "find", "collection": "orders", "query": {}, "limit": 100}\n```'}],
+    "stop_reason": "end_turn",
+    "stop_sequence": None,
+    "usage": {"input_tokens": 1200, "output_tokens": 30}
+}
+
+
+def _replay_client(sdk_class, body: dict, requests: list):
+    """Real SDK client class whose HTTP transport answers every request with body"""
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, json=body)
+
+    http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return functools.partial(sdk_class, http_client=http_client)
+
+
+@pytest.fixture(autouse=True)
+def fresh_llm_clients():
+    """Make every test build its own (possibly mocked) provider clients"""
+    reset_llm_clients()
+    clear_query_cache()
+    yield
+    reset_llm_clients()
+    clear_query_cache()
+
+
 class TestLLMProcessor:
-    
-    @patch('core.llm_processor.OpenAI')
+
+    @patch('core.llm_processor.AsyncOpenAI')
+    def test_openai_client_reused_across_calls(self, mock_openai_class):
+        # Test that the provider client is constructed once per API key
+        first = get_openai_client('test-key')
+        second = get_openai_client('test-key')
+        assert first is second
+        mock_openai_class.assert_called_once_with(api_key='test-key', max_retries=LLM_MAX_RETRIES)
+
+        get_openai_client('other-key')
+        assert mock_openai_class.call_count == 2
+
+    @patch('core.llm_processor.AsyncAnthropic')
+    @patch('core.llm_processor.AsyncOpenAI')
+    def test_close_llm_clients_closes_every_pool(self, mock_openai_class, mock_anthropic_class):
+        # Clients for every key seen, including replaced ones, are closed at shutdown
+        mock_openai_class.side_effect = lambda **kwargs: _mock_client()
+        mock_anthropic_class.side_effect = lambda **kwargs: _mock_client()
+        clients = [get_openai_client('old-key'), get_openai_client('new-key'), get_anthropic_client('test-key')]
+        for client in clients:
+            client.close = AsyncMock()
+
+        asyncio.run(close_llm_clients())
+
+        for client in clients:
+            client.close.assert_awaited_once()
+        assert get_openai_client('new-key') is not clients[1]
+
+    @patch('core.llm_processor.AsyncOpenAI')
     def test_generate_mongodb_query_with_openai_success(self, mock_openai_class):
         # Mock OpenAI client and response
-        mock_client = MagicMock()
+        mock_client = _mock_client()
         mock_openai_class.return_value = mock_client
 
-        mock_response = MagicMock()
-        mock_response.choices[0].message.content = '{"query_type": "find", "collection": "users", "query": {"age": {"$gt": 25}}, "limit": 100}'
-        mock_client.chat.completions.create.return_value = mock_response
+        mock_client.chat.completions.create.return_value = _openai_response('{"query_type": "find", "collection": "users", "query": {"age": {"$gt": 25}}, "limit": 100}')
 
         # Mock environment variable
         with patch.dict(os.environ, {'OPENAI_API_KEY': 'test-key'}):
@@ -32,7 +135,7 @@ class TestLLMProcessor:
                 }
             }
 
-            result = generate_mongodb_query_with_openai(query_text, schema_info)
+            result = asyncio.run(generate_mongodb_query_with_openai(query_text, schema_info))
 
             assert result['query_type'] == 'find'
             assert result['collection'] == 'users'
@@ -45,21 +148,118 @@ class TestLLMProcessor:
             assert call_args[1]['temperature'] == 0.1
             assert call_args[1]['max_tokens'] == 1000
     
-    @patch('core.llm_processor.OpenAI')
+    @patch('core.llm_processor.AsyncOpenAI')
+    def test_repeated_question_is_served_from_cache(self, mock_openai_class):
+        # Test that the same question on the same schema calls the provider once
+        mock_client = _mock_client()
+        mock_openai_class.return_value = mock_client
+
+        mock_client.chat.completions.create.return_value = _openai_response('{"query_type": "find", "collection": "users", "query": {}}')
+
+        schema_info = {'users': {'count': 1, 'fields': {'name': {'type': 'string'}}}}
+        with patch.dict(os.environ, {'OPENAI_API_KEY': 'test-key'}):
+            first = asyncio.run(generate_mongodb_query_with_openai("Show users", schema_info))
+            first['query']['name'] = 'mutated'
+            second = asyncio.run(generate_mongodb_query_with_openai("  Show\tusers\n", schema_info))
+            assert mock_client.chat.completions.create.call_count == 1
+            assert second['query'] == {}
+
+            asyncio.run(generate_mongodb_query_with_openai("Show Users", schema_info))
+            assert mock_client.chat.completions.create.call_count == 2
+
+            schema_info['users']['count'] = 2
+            asyncio.run(generate_mongodb_query_with_openai("Show users", schema_info))
+            assert mock_client.chat.completions.create.call_count == 3
+
+    @patch('core.llm_processor.AsyncAnthropic')
+    @patch('core.llm_processor.AsyncOpenAI')
+    def test_query_cache_is_keyed_by_provider(self, mock_openai_class, mock_anthropic_class):
+        # Test that the same question via two providers calls each provider once
+        openai_client = _mock_client()
+        openai_client.chat.completions.create.return_value = _openai_response('{"query_type": "find", "collection": "users", "query": {}}')
+        mock_openai_class.return_value = openai_client
+        anthropic_client = _mock_client()
+        anthropic_client.messages.create.return_value = _anthropic_response('{"query_type": "find", "collection": "people", "query": {}}')
+        mock_anthropic_class.return_value = anthropic_client
+
+        with patch.dict(os.environ, {'ANTHROPIC_API_KEY': 'test-key'}, clear=True):
+            request = QueryRequest(query="Show users", llm_provider="anthropic")
+            for _ in range(2):
+                assert asyncio.run(generate_mongodb_query(request, {}))['collection'] == 'people'
+        with patch.dict(os.environ, {'OPENAI_API_KEY': 'test-key'}, clear=True):
+            request = QueryRequest(query="Show users", llm_provider="openai")
+            for _ in range(2):
+                assert asyncio.run(generate_mongodb_query(request, {}))['collection'] == 'users'
+
+        assert anthropic_client.messages.create.call_count == 1
+        assert openai_client.chat.completions.create.call_count == 1
+
+    @patch('core.llm_processor.QUERY_CACHE_TTL_SECONDS', 0)
+    @patch('core.llm_processor.AsyncOpenAI')
+    def test_expired_queries_are_regenerated(self, mock_openai_class):
+        # Test that cached queries are not served past the TTL
+        mock_client = _mock_client()
+        mock_client.chat.completions.create.return_value = _openai_response('{"query_type": "find", "collection": "users", "query": {}}')
+        mock_openai_class.return_value = mock_client
+
+        with patch.dict(os.environ, {'OPENAI_API_KEY': 'test-key'}):
+            for _ in range(2):
+                asyncio.run(generate_mongodb_query_with_openai("Show users", {}))
+
+        assert mock_client.chat.completions.create.call_count == 2
+
+    @patch('core.llm_processor.AsyncOpenAI')
+    def test_generate_mongodb_query_with_openai_prompt_substitution(self, mock_openai_class):
+        # Test that the shared prompt template receives the schema and query text
+        mock_client = _mock_client()
+        mock_openai_class.return_value = mock_client
+
+        mock_client.chat.completions.create.return_value = _openai_response('{"query_type": "find", "collection": "users", "query": {}, "limit": 100}')
+
+        with patch.dict(os.environ, {'OPENAI_API_KEY': 'test-key'}):
+            schema_info = {'users': {'count': 3, 'fields': {'name': {'type': 'string', 'sample': 'John'}}}}
+
+            asyncio.run(generate_mongodb_query_with_openai("Show all users", schema_info))
+
+            system, user = mock_client.chat.completions.create.call_args[1]['messages']
+            assert system['role'] == "system" and user['role'] == "user"
+            assert 'Convert this natural language query to a MongoDB query: "Show all users"' in user['content']
+            assert "Collection: users" in system['content']
+            assert '"query_type": "find" or "aggregate"' in system['content']
+            assert "Show all users" not in system['content']
+
+            # Static instructions first, then the schema, so OpenAI's automatic
+            # prefix caching covers everything but the question
+            assert system['content'].index('"query_type": "find" or "aggregate"') < system['content'].index("Collection: users")
+
+    @patch('core.llm_processor.AsyncOpenAI')
+    def test_openai_system_prompt_is_byte_stable(self, mock_openai_class):
+        # The same schema must yield an identical system message whatever the question
+        mock_client = _mock_client()
+        mock_openai_class.return_value = mock_client
+
+        mock_client.chat.completions.create.return_value = _openai_response('{"query_type": "find", "collection": "users", "query": {}}')
+
+        with patch.dict(os.environ, {'OPENAI_API_KEY': 'test-key'}):
+            asyncio.run(generate_mongodb_query_with_openai("Show all users", {'users': {'count': 3, 'fields': {'name': {'type': 'string', 'sample': 'John'}, 'age': {'type': 'integer', 'sample': 30}}}}))
+            asyncio.run(generate_mongodb_query_with_openai("Count users", {'users': {'count': 3, 'fields': {'name': {'type': 'string', 'sample': 'John'}, 'age': {'type': 'integer', 'sample': 30}}}}))
+
+        first, second = (call[1]['messages'][0]['content'] for call in mock_client.chat.completions.create.call_args_list)
+        assert first.encode() == second.encode()
+
+    @patch('core.llm_processor.AsyncOpenAI')
     def test_generate_mongodb_query_with_openai_clean_markdown(self, mock_openai_class):
         # Test MongoDB query cleanup from markdown
-        mock_client = MagicMock()
+        mock_client = _mock_client()
         mock_openai_class.return_value = mock_client
 
-        mock_response = MagicMock()
-        mock_response.choices[0].message.content = '{"query_type": "find", "collection": "users", "query": {}, "limit": 100}'
-        mock_client.chat.completions.create.return_value = mock_response
+        mock_client.chat.completions.create.return_value = _openai_response('{"query_type": "find", "collection": "users", "query": {}, "limit": 100}')
 
         with patch.dict(os.environ, {'OPENAI_API_KEY': 'test-key'}):
             query_text = "Show all users"
             schema_info = {}
 
-            result = generate_mongodb_query_with_openai(query_text, schema_info)
+            result = asyncio.run(generate_mongodb_query_with_openai(query_text, schema_info))
 
             assert result['query_type'] == 'find'
             assert result['collection'] == 'users'
@@ -71,36 +271,31 @@ class TestLLMProcessor:
             query_text = "Show all users"
             schema_info = {}
 
-            with pytest.raises(Exception) as exc_info:
-                generate_mongodb_query_with_openai(query_text, schema_info)
-
-            assert "OPENAI_API_KEY environment variable not set" in str(exc_info.value)
+            with pytest.raises(Exception, match="OPENAI_API_KEY environment variable not set"):
+                asyncio.run(generate_mongodb_query_with_openai(query_text, schema_info))
     
-    @patch('core.llm_processor.OpenAI')
+    @patch('core.llm_processor.AsyncOpenAI')
     def test_generate_mongodb_query_with_openai_api_error(self, mock_openai_class):
         # Test API error handling
-        mock_client = MagicMock()
+        mock_client = _mock_client()
         mock_openai_class.return_value = mock_client
-        mock_client.chat.completions.create.side_effect = Exception("API Error")
+        # Raised once the SDK's own retries are exhausted
+        mock_client.chat.completions.create.side_effect = openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com"))
 
         with patch.dict(os.environ, {'OPENAI_API_KEY': 'test-key'}):
             query_text = "Show all users"
             schema_info = {}
 
-            with pytest.raises(Exception) as exc_info:
-                generate_mongodb_query_with_openai(query_text, schema_info)
-
-            assert "Error generating MongoDB query with OpenAI" in str(exc_info.value)
+            with pytest.raises(Exception, match="Error generating MongoDB query with OpenAI: Connection error"):
+                asyncio.run(generate_mongodb_query_with_openai(query_text, schema_info))
     
-    @patch('core.llm_processor.Anthropic')
+    @patch('core.llm_processor.AsyncAnthropic')
     def test_generate_mongodb_query_with_anthropic_success(self, mock_anthropic_class):
         # Mock Anthropic client and response
-        mock_client = MagicMock()
+        mock_client = _mock_client()
         mock_anthropic_class.return_value = mock_client
 
-        mock_response = MagicMock()
-        mock_response.content[0].text = '{"query_type": "find", "collection": "products", "query": {"price": {"$lt": 100}}, "limit": 100}'
-        mock_client.messages.create.return_value = mock_response
+        mock_client.messages.create.return_value = _anthropic_response('{"query_type": "find", "collection": "products", "query": {"price": {"$lt": 100}}, "limit": 100}')
 
         # Mock environment variable
         with patch.dict(os.environ, {'ANTHROPIC_API_KEY': 'test-key'}):
@@ -112,7 +307,7 @@ class TestLLMProcessor:
                 }
             }
 
-            result = generate_mongodb_query_with_anthropic(query_text, schema_info)
+            result = asyncio.run(generate_mongodb_query_with_anthropic(query_text, schema_info))
 
             assert result['query_type'] == 'find'
             assert result['collection'] == 'products'
@@ -124,22 +319,28 @@ class TestLLMProcessor:
             assert call_args[1]['model'] == 'claude-3-5-haiku-20241022'
             assert call_args[1]['temperature'] == 0.1
             assert call_args[1]['max_tokens'] == 1000
+
+            # The instructions and schema are a cacheable system block; only the question is in the user turn
+            system = call_args[1]['system']
+            assert system == [{"type": "text", "text": ANY, "cache_control": {"type": "ephemeral"}}]
+            assert "Collection: products" in system[0]['text']
+            assert query_text not in system[0]['text']
+            assert call_args[1]['messages'] == [{"role": "user", "content": ANY}]
+            assert query_text in call_args[1]['messages'][0]['content']
     
-    @patch('core.llm_processor.Anthropic')
+    @patch('core.llm_processor.AsyncAnthropic')
     def test_generate_mongodb_query_with_anthropic_clean_markdown(self, mock_anthropic_class):
         # Test MongoDB query cleanup from markdown
-        mock_client = MagicMock()
+        mock_client = _mock_client()
         mock_anthropic_class.return_value = mock_client
 
-        mock_response = MagicMock()
-        mock_response.content[0].text = '{"query_type": "find", "collection": "orders", "query": {}, "limit": 100}'
-        mock_client.messages.create.return_value = mock_response
+        mock_client.messages.create.return_value = _anthropic_response('{"query_type": "find", "collection": "orders", "query": {}, "limit": 100}')
 
         with patch.dict(os.environ, {'ANTHROPIC_API_KEY': 'test-key'}):
             query_text = "Show all orders"
             schema_info = {}
 
-            result = generate_mongodb_query_with_anthropic(query_text, schema_info)
+            result = asyncio.run(generate_mongodb_query_with_anthropic(query_text, schema_info))
 
             assert result['query_type'] == 'find'
             assert result['collection'] == 'orders'
@@ -150,27 +351,59 @@ class TestLLMProcessor:
             query_text = "Show all orders"
             schema_info = {}
 
-            with pytest.raises(Exception) as exc_info:
-                generate_mongodb_query_with_anthropic(query_text, schema_info)
-
-            assert "ANTHROPIC_API_KEY environment variable not set" in str(exc_info.value)
+            with pytest.raises(Exception, match="ANTHROPIC_API_KEY environment variable not set"):
+                asyncio.run(generate_mongodb_query_with_anthropic(query_text, schema_info))
 
-    @patch('core.llm_processor.Anthropic')
+    @patch('core.llm_processor.AsyncAnthropic')
     def test_generate_mongodb_query_with_anthropic_api_error(self, mock_anthropic_class):
         # Test API error handling
-        mock_client = MagicMock()
+        mock_client = _mock_client()
         mock_anthropic_class.return_value = mock_client
-        mock_client.messages.create.side_effect = Exception("API Error")
+        # Raised once the SDK's own retries are exhausted
+        mock_client.messages.create.side_effect = anthropic.APIConnectionError(request=httpx.Request("POST", "https://api.anthropic.com"))
 
         with patch.dict(os.environ, {'ANTHROPIC_API_KEY': 'test-key'}):
             query_text = "Show all orders"
             schema_info = {}
 
-            with pytest.raises(Exception) as exc_info:
-                generate_mongodb_query_with_anthropic(query_text, schema_info)
-
-            assert "Error generating MongoDB query with Anthropic" in str(exc_info.value)
+            with pytest.raises(Exception, match="Error generating MongoDB query with Anthropic: Connection error"):
+                asyncio.run(generate_mongodb_query_with_anthropic(query_text, schema_info))
     
+    def test_openai_response_parsed_by_real_sdk(self):
+        # Replay a recorded completion through the SDK's own HTTP and parsing layers
+        requests = []
+        with patch('core.llm_processor.AsyncOpenAI', new=_replay_client(openai.AsyncOpenAI, OPENAI_COMPLETION_BODY, requests)):
+            with patch.dict(os.environ, {'OPENAI_API_KEY': 'test-key'}):
+                result = asyncio.run(generate_mongodb_query_with_openai("Find users older than 25", {}))
+
+        assert result == {"query_type": "find", "collection": "users", "query": {"age": {"$gt": 25}}, "limit": 100}
+        assert len(requests) == 1
+        assert requests[0].url.path.endswith("/chat/completions")
+
+    def test_anthropic_response_parsed_by_real_sdk(self):
+        # Replay a recorded message through the SDK's own HTTP and parsing layers
+        requests = []
+        with patch('core.llm_processor.AsyncAnthropic', new=_replay_client(anthropic.AsyncAnthropic, ANTHROPIC_MESSAGE_BODY, requests)):
+            with patch.dict(os.environ, {'ANTHROPIC_API_KEY': 'test-key'}):
+                result = asyncio.run(generate_mongodb_query_with_anthropic("Show all orders", {}))
+
+        assert result == {"query_type": "find", "collection": "orders", "query": {}, "limit": 100}
+        assert len(requests) == 1
+        assert requests[0].url.path.endswith("/messages")
+
+    def test_parse_query_response_strips_markdown_fences(self):
+        # Test that fenced responses are parsed the same way for every provider
+        body = '{"query_type": "find", "collection": "users", "query": {}}'
+        expected = {"query_type": "find", "collection": "users", "query": {}}
+
+        for text in (f"```json\n{body}\n```", f"```\n{body}\n```", f"  {body}\n", body):
+            assert parse_query_response(text) == expected
+
+    def test_parse_query_response_rejects_missing_keys(self):
+        # Test that responses without the required keys are rejected
+        with pytest.raises(ValueError, match="Invalid query structure"):
+            parse_query_response('{"collection": "users"}')
+
     def test_format_schema_for_prompt(self):
         # Test schema formatting for LLM prompt
         schema_info = {
@@ -210,6 +443,20 @@ class TestLLMProcessor:
 
         assert result == ""
     
+    def test_format_schema_for_prompt_memoized_by_content(self):
+        # Test that equal schemas hit the cache and changed schemas do not
+        schema_info = {'users': {'count': 1, 'fields': {'name': {'type': 'string', 'sample': 'John'}}}}
+        _format_schema_cached.cache_clear()
+
+        first = format_schema_for_prompt(schema_info)
+        second = format_schema_for_prompt({'users': {'count': 1, 'fields': {'name': {'type': 'string', 'sample': 'John'}}}})
+
+        assert first is second
+        assert _format_schema_cached.cache_info().hits == 1
+
+        schema_info['users']['count'] = 2
+        assert "Document count: 2" in format_schema_for_prompt(schema_info)
+
     @patch('core.llm_processor.generate_mongodb_query_with_openai')
     def test_generate_mongodb_query_openai_key_priority(self, mock_openai_func):
         # Test that OpenAI is used when OpenAI key exists (regardless of request preference)
@@ -219,7 +466,7 @@ class TestLLMProcessor:
             request = QueryRequest(query="Show all users", llm_provider="anthropic")
             schema_info = {}
 
-            result = generate_mongodb_query(request, schema_info)
+            result = asyncio.run(generate_mongodb_query(request, schema_info))
 
             assert result['collection'] == 'users'
             mock_openai_func.assert_called_once_with("Show all users", schema_info)
@@ -233,7 +480,7 @@ class TestLLMProcessor:
             request = QueryRequest(query="Show all products", llm_provider="openai")
             schema_info = {}
 
-            result = generate_mongodb_query(request, schema_info)
+            result = asyncio.run(generate_mongodb_query(request, schema_info))
 
             assert result['collection'] == 'products'
             mock_anthropic_func.assert_called_once_with("Show all products", schema_info)
@@ -247,7 +494,7 @@ class TestLLMProcessor:
             request = QueryRequest(query="Show all orders", llm_provider="openai")
             schema_info = {}
 
-            result = generate_mongodb_query(request, schema_info)
+            result = asyncio.run(generate_mongodb_query(request, schema_info))
 
             assert result['collection'] == 'orders'
             mock_openai_func.assert_called_once_with("Show all orders", schema_info)
@@ -261,7 +508,7 @@ class TestLLMProcessor:
             request = QueryRequest(query="Show all customers", llm_provider="anthropic")
             schema_info = {}
 
-            result = generate_mongodb_query(request, schema_info)
+            result = asyncio.run(generate_mongodb_query(request, schema_info))
 
             assert result['collection'] == 'customers'
             mock_anthropic_func.assert_called_once_with("Show all customers", schema_info)
@@ -275,7 +522,7 @@ class TestLLMProcessor:
             request = QueryRequest(query="Show inventory", llm_provider="anthropic")
             schema_info = {}
 
-            result = generate_mongodb_query(request, schema_info)
+            result = asyncio.run(generate_mongodb_query(request, schema_info))
 
             assert result['collection'] == 'inventory'
             mock_openai_func.assert_called_once_with("Show inventory", schema_info)
@@ -289,7 +536,7 @@ class TestLLMProcessor:
             request = QueryRequest(query="Show sales data", llm_provider="anthropic")
             schema_info = {}
 
-            result = generate_mongodb_query(request, schema_info)
+            result = asyncio.run(generate_mongodb_query(request, schema_info))
 
             assert result['collection'] == 'sales'
             mock_openai_func.assert_called_once_with("Show sales data", schema_info)
\ No newline at end of file
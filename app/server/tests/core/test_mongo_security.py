@@ -0,0 +1,147 @@
+"""
+Tests for MongoDB security validation helpers
+"""
+
+from datetime import datetime
+
+import pytest
+from core.mongo_security import (
+    _validate_pipeline_cached,
+    sanitize_regex_pattern,
+    validate_collection_name,
+    validate_field_name,
+    validate_query_structure,
+    validate_aggregation_pipeline,
+    MongoSecurityError
+)
+
+
+class TestNameValidationCache:
+    """Test memoization of collection and field name validation"""
+
+    def setup_method(self):
+        validate_collection_name.cache_clear()
+        validate_field_name.cache_clear()
+
+    def test_valid_names_are_cached(self):
+        """Test that repeat validations of a valid name are served from the cache"""
+        for _ in range(3):
+            assert validate_collection_name("users") == "users"
+            assert validate_field_name("address.city") == "address.city"
+
+        assert validate_collection_name.cache_info().hits == 2
+        assert validate_field_name.cache_info().hits == 2
+
+    def test_invalid_names_raise_every_time(self):
+        """Test that rejected names are not cached and keep raising"""
+        for _ in range(2):
+            with pytest.raises(MongoSecurityError):
+                validate_collection_name("bad name")
+            with pytest.raises(MongoSecurityError):
+                validate_field_name("$where")
+
+        assert validate_collection_name.cache_info().currsize == 0
+        assert validate_field_name.cache_info().currsize == 0
+
+
+class TestQueryStructureValidation:
+    """Test iterative validation of nested queries and pipelines"""
+
+    def test_deeply_nested_query_does_not_recurse(self):
+        """Test that nesting beyond the recursion limit is still validated"""
+        query = {"name": "x"}
+        for _ in range(5000):
+            query = {"$and": [query]}
+
+        assert validate_query_structure(query) is query
+
+        query["$and"].append({"$where": "sleep(1000)"})
+        with pytest.raises(MongoSecurityError, match="Dangerous operator"):
+            validate_query_structure(query)
+
+    def test_operator_restriction_applies_to_top_level_only(self):
+        """Test that allow_operators=False only rejects top-level operators"""
+        validate_query_structure({"age": {"$gt": 3}}, allow_operators=False)
+
+        with pytest.raises(MongoSecurityError, match="not allowed in this context"):
+            validate_query_structure({"$or": [{"age": 3}]}, allow_operators=False)
+
+    def test_nested_lookup_pipelines_are_validated(self):
+        """Test that stages inside nested $lookup pipelines are checked"""
+        inner = [{"$lookup": {"from": "c", "as": "cs", "pipeline": [{"$function": {}}]}}]
+        pipeline = [{"$lookup": {"from": "b", "as": "bs", "pipeline": inner}}]
+
+        with pytest.raises(MongoSecurityError, match="Dangerous aggregation stage"):
+            validate_aggregation_pipeline(pipeline)
+
+    def test_deeply_nested_lookup_pipeline_does_not_recurse(self):
+        """Test that lookups nested beyond the recursion limit validate in place"""
+        pipeline = [{"$match": {"a": 1}}]
+        for _ in range(5000):
+            pipeline = [{"$lookup": {"from": "b", "as": "bs", "pipeline": pipeline}}]
+
+        assert validate_aggregation_pipeline(pipeline) is pipeline
+
+
+class TestPipelineValidationCache:
+    """Test memoization of aggregation pipeline validation"""
+
+    def setup_method(self):
+        _validate_pipeline_cached.cache_clear()
+
+    def test_equivalent_pipelines_share_a_cache_entry(self):
+        """Test that key order does not defeat the cache"""
+        validate_aggregation_pipeline([{"$lookup": {"from": "b", "as": "bs", "localField": "x", "foreignField": "y"}}])
+        validate_aggregation_pipeline([{"$lookup": {"foreignField": "y", "localField": "x", "as": "bs", "from": "b"}}])
+
+        assert _validate_pipeline_cached.cache_info().hits == 1
+
+    def test_rejected_pipelines_raise_every_time(self):
+        """Test that invalid pipelines are not cached"""
+        pipeline = [{"$lookup": {"from": "b", "as": "bs", "pipeline": [{"$function": {}}]}}]
+        for _ in range(2):
+            with pytest.raises(MongoSecurityError):
+                validate_aggregation_pipeline(pipeline)
+
+        assert _validate_pipeline_cached.cache_info().currsize == 0
+
+    def test_empty_pipeline_skips_the_cache(self):
+        """Test that an empty pipeline is returned without serializing it"""
+        pipeline = []
+        assert validate_aggregation_pipeline(pipeline) is pipeline
+        assert _validate_pipeline_cached.cache_info().misses == 0
+
+    def test_non_json_pipelines_are_validated_uncached(self):
+        """Test that pipelines with BSON values still go through validation"""
+        pipeline = [{"$match": {"created": {"$gt": datetime(2024, 1, 1)}}}]
+        assert validate_aggregation_pipeline(pipeline) is pipeline
+
+        with pytest.raises(MongoSecurityError):
+            validate_aggregation_pipeline(pipeline + [{"$function": {}}])
+        assert _validate_pipeline_cached.cache_info().currsize == 0
+
+
+class TestSanitizeRegexPattern:
+    """Test ReDoS screening of user-supplied regex patterns"""
+
+    def test_accepts_ordinary_patterns(self):
+        """Test that common patterns with a few quantifiers pass unchanged"""
+        for pattern in ["^john", "a*b*", "[0-9]+-[0-9]+", "a**", "x+\ny+\nz+"]:
+            assert sanitize_regex_pattern(pattern) == pattern
+
+    def test_rejects_chained_quantifiers(self):
+        """Test that three or more chained * or + quantifiers are rejected"""
+        for pattern in ["a*b*c*", "a+b+c+", ".*.*.*"]:
+            with pytest.raises(MongoSecurityError, match="dangerous repetition"):
+                sanitize_regex_pattern(pattern)
+
+    def test_rejects_nested_quantifiers(self):
+        """Test that (.*)* and (.+)+ are rejected"""
+        for pattern in ["(.*)*", "x(.+)+y"]:
+            with pytest.raises(MongoSecurityError, match="dangerous repetition"):
+                sanitize_regex_pattern(pattern)
+
+    def test_rejects_too_many_groups(self):
+        """Test the limit on parenthesized groups"""
+        with pytest.raises(MongoSecurityError, match="too many nested groups"):
+            sanitize_regex_pattern("(a)" * 21)
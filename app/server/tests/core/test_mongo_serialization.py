@@ -6,19 +6,79 @@ to JSON-serializable strings in various query scenarios including simple queries
 aggregation pipelines with $lookup, nested structures, and arrays.
 """
 
+import asyncio
 import json
 import pytest
-from unittest.mock import Mock, patch, MagicMock
-from bson import ObjectId
-
+from unittest.mock import patch, MagicMock, AsyncMock
+import bson
+from bson import Decimal128, ObjectId
+from datetime import datetime
+from pymongo.errors import BulkWriteError, OperationFailure
+
+from core.mongo_security import MongoSecurityError
+from tests.core._fakes import FakeCollection, fake_client
 from core.mongo_processor import (
     convert_objectids_to_strings,
     execute_mongodb_query,
     execute_aggregation_pipeline,
-    get_database_schema
+    iter_aggregation_pipeline,
+    execute_mongodb_query_async,
+    execute_aggregation_pipeline_async,
+    get_database_schema,
+    get_collection_stats,
+    build_schema_sample_pipeline,
+    get_mongodb_database,
+    invalidate_schema_cache,
+    get_schema_cache_age,
+    refresh_database_schema,
+    close_mongodb_connection,
+    get_async_mongodb_database,
+    close_async_mongodb_connection,
+    insert_documents,
+    drop_collection,
+    JSON_CODEC_OPTIONS,
+    IMPORT_WRITE_CONCERN,
+    SCHEMA_SAMPLE_SIZE,
+    SCHEMA_CACHE_TTL_SECONDS,
+    SAMPLE_STRING_LENGTH,
+    SAMPLE_ARRAY_LENGTH,
+    _optimize_pipeline,
+    to_json_bytes
 )
 
 
+@pytest.fixture(autouse=True)
+def fresh_schema_cache():
+    """Keep cached schemas and relationships from leaking between tests"""
+    invalidate_schema_cache(relationships=True)
+    yield
+    invalidate_schema_cache(relationships=True)
+
+
+@pytest.fixture(scope="module")
+def oid_pool():
+    """Distinct ObjectIds generated once and shared by the query tests"""
+    return tuple(ObjectId() for _ in range(16))
+
+
+def decoded(documents):
+    """Round-trip documents through BSON the way the driver decodes query results"""
+    return [bson.decode(bson.encode(doc), codec_options=JSON_CODEC_OPTIONS) for doc in documents]
+
+
+def schema_facet(documents):
+    """Emulate the server's answer to build_schema_sample_pipeline for the given documents"""
+    fields = {}
+    for doc in documents:
+        for key, value in doc.items():
+            fields.setdefault(key, value)
+    return [{
+        "fields": [{"_id": key, "sample": value} for key, value in fields.items()],
+        "sample_data": documents[:3],
+        "sampled": [{"n": len(documents)}] if documents else []
+    }]
+
+
 class TestConvertObjectIdsToStrings:
     """Test the ObjectId conversion utility function"""
 
@@ -110,6 +170,49 @@ class TestConvertObjectIdsToStrings:
         assert convert_objectids_to_strings({}) == {}
         assert convert_objectids_to_strings([]) == []
 
+    def test_convert_updates_containers_in_place(self):
+        """Test that containers are converted in place and deep nesting does not recurse"""
+        obj_id = ObjectId()
+        data = {"items": [{"_id": obj_id}]}
+        deep = current = {}
+        for _ in range(5000):
+            current["child"] = {"ref": ObjectId()}
+            current = current["child"]
+
+        result = convert_objectids_to_strings(data)
+
+        assert result is data
+        assert data["items"][0]["_id"] == str(obj_id)
+        assert isinstance(convert_objectids_to_strings(deep)["child"]["child"]["ref"], str)
+        assert isinstance(current["ref"], str)
+
+    def test_convert_handles_container_and_objectid_subclasses(self):
+        """Test that subclasses fall back to isinstance and are still converted"""
+        class TaggedId(ObjectId):
+            pass
+
+        tagged = TaggedId()
+        data = bson.SON([("ref", tagged), ("items", [ObjectId("507f1f77bcf86cd799439011")])])
+
+        result = convert_objectids_to_strings(data)
+
+        assert result["ref"] == str(tagged)
+        assert result["items"] == ["507f1f77bcf86cd799439011"]
+        assert convert_objectids_to_strings(tagged) == str(tagged)
+
+    def test_convert_without_objectids_allocates_nothing(self):
+        """Test that documents with no ObjectIds come back as the very same objects"""
+        nested = {"tags": ["a", "b"], "meta": {"score": 1.5}}
+        data = {"name": "x", "nested": nested}
+        snapshot = json.dumps(data, sort_keys=True)
+
+        result = convert_objectids_to_strings(data)
+
+        assert result is data
+        assert result["nested"] is nested
+        assert result["nested"]["tags"] is nested["tags"]
+        assert json.dumps(result, sort_keys=True) == snapshot
+
     def test_result_is_json_serializable(self):
         """Test that converted results can be serialized to JSON"""
         obj_id = ObjectId()
@@ -131,44 +234,63 @@ class TestConvertObjectIdsToStrings:
         assert parsed["_id"] == str(obj_id)
 
 
+class TestToJsonBytes:
+    """Test single-pass JSON serialization of query results"""
+
+    def test_bson_types_serialized_inline(self):
+        """Test that ObjectId, Decimal128 and datetime values need no pre-pass"""
+        obj_id = ObjectId()
+        data = [{"_id": obj_id, "price": Decimal128("9.99"), "at": datetime(2024, 1, 2, 3, 4, 5)}]
+
+        assert json.loads(to_json_bytes(data)) == [
+            {"_id": str(obj_id), "price": "9.99", "at": "2024-01-02T03:04:05"}
+        ]
+
+    def test_bytes_and_binary_decoded_as_text(self):
+        """Test that bytes and Binary values are written like FastAPI's encoder wrote them"""
+        data = {"raw": b"hello", "bin": bson.Binary(b"world"), "blob": bson.Binary(b"\xff\x00", 0)}
+
+        assert json.loads(to_json_bytes(data)) == {"raw": "hello", "bin": "world", "blob": "/wA="}
+
+    def test_timestamp_serialized_as_string(self):
+        """Test that bson Timestamps fall back to their string form"""
+        value = bson.Timestamp(1700000000, 1)
+        assert json.loads(to_json_bytes({"ts": value})) == {"ts": str(value)}
+
+    def test_regex_serialized_as_string(self):
+        """Test that bson Regex values fall back to their string form"""
+        value = bson.Regex("^abc", "i")
+        assert json.loads(to_json_bytes({"pattern": value})) == {"pattern": str(value)}
+
+    def test_int64_serialized_as_number(self):
+        """Test that Int64 (an int subclass) stays a JSON number"""
+        assert json.loads(to_json_bytes({"n": bson.Int64(2 ** 40)})) == {"n": 2 ** 40}
+
+    def test_unknown_types_still_rejected(self):
+        """Test that unsupported values raise instead of being silently stringified"""
+        with pytest.raises(TypeError):
+            to_json_bytes({"value": object()})
+
+
 class TestExecuteMongoDBQuery:
     """Test execute_mongodb_query with ObjectId serialization"""
 
     @patch('core.mongo_processor.get_mongodb_connection')
     @patch('core.mongo_processor.validate_collection_name')
     @patch('core.mongo_processor.validate_query_structure')
-    def test_query_converts_objectids(self, mock_validate_query, mock_validate_name, mock_get_connection):
+    def test_query_converts_objectids(self, mock_validate_query, mock_validate_name, mock_get_connection, oid_pool):
         """Test that simple queries properly convert ObjectIds"""
-        obj_id1 = ObjectId()
-        obj_id2 = ObjectId()
+        obj_id1 = oid_pool[0]
+        obj_id2 = oid_pool[1]
 
         # Mock cursor with documents containing ObjectIds
         mock_cursor = [
             {"_id": obj_id1, "name": "Doc 1"},
-            {"_id": obj_id2, "user_id": ObjectId(), "name": "Doc 2"}
+            {"_id": obj_id2, "user_id": oid_pool[2], "name": "Doc 2"}
         ]
 
-        # Setup mocks - create proper chain
-        mock_limit = MagicMock()
-        mock_limit.__iter__ = Mock(return_value=iter(mock_cursor))
-
-        mock_sort = MagicMock()
-        mock_sort.limit.return_value = mock_limit
-
-        mock_find = MagicMock()
-        mock_find.sort.return_value = mock_sort
-        mock_find.limit.return_value = mock_limit
-
-        mock_collection = MagicMock()
-        mock_collection.find.return_value = mock_find
-
-        mock_db = MagicMock()
-        mock_db.__getitem__.return_value = mock_collection
-
-        mock_client = MagicMock()
-        mock_client.__getitem__.return_value = mock_db
-
-        mock_get_connection.return_value = mock_client
+        # Setup fakes
+        mock_get_connection.return_value = client = fake_client(test_collection=FakeCollection(decoded(mock_cursor)))
 
         # Execute query
         results = execute_mongodb_query("test_collection", filter_query={"name": "test"})
@@ -180,22 +302,39 @@ class TestExecuteMongoDBQuery:
         assert isinstance(results[1]["user_id"], str)
         assert results[0]["_id"] == str(obj_id1)
         assert results[1]["_id"] == str(obj_id2)
+        assert client.db.get_collection_calls == [("test_collection", {"codec_options": JSON_CODEC_OPTIONS})]
 
         # Verify result is JSON serializable
         json.dumps(results)
 
 
+    @patch('core.mongo_processor.get_mongodb_connection')
+    @patch('core.mongo_processor.validate_collection_name')
+    @patch('core.mongo_processor.validate_query_structure')
+    def test_query_sorts_only_when_requested(self, mock_validate_query, mock_validate_name, mock_get_connection):
+        """Test that no sort stage is sent unless a sort is given"""
+        fake_collection = FakeCollection([{"name": "Doc"}])
+        mock_get_connection.return_value = fake_client(test_collection=fake_collection)
+
+        execute_mongodb_query("test_collection", limit=5)
+        execute_mongodb_query("test_collection", sort={"name": 1}, limit=5)
+
+        unsorted, sorted_ = fake_collection.cursors
+        assert unsorted.sorts == [] and unsorted.limits == [5]
+        assert sorted_.sorts == [[("name", 1)]] and sorted_.limits == [5]
+
+
 class TestExecuteAggregationPipeline:
     """Test execute_aggregation_pipeline with ObjectId serialization"""
 
     @patch('core.mongo_processor.get_mongodb_connection')
     @patch('core.mongo_processor.validate_collection_name')
     @patch('core.mongo_processor.validate_aggregation_pipeline')
-    def test_aggregation_converts_nested_objectids(self, mock_validate_pipeline, mock_validate_name, mock_get_connection):
+    def test_aggregation_converts_nested_objectids(self, mock_validate_pipeline, mock_validate_name, mock_get_connection, oid_pool):
         """Test that aggregation results with $lookup properly convert nested ObjectIds"""
-        user_id = ObjectId()
-        product_id1 = ObjectId()
-        product_id2 = ObjectId()
+        user_id = oid_pool[0]
+        product_id1 = oid_pool[1]
+        product_id2 = oid_pool[2]
 
         # Mock aggregation cursor simulating $lookup results
         mock_cursor = [
@@ -209,14 +348,8 @@ class TestExecuteAggregationPipeline:
             }
         ]
 
-        # Setup mocks
-        mock_collection = MagicMock()
-        mock_collection.aggregate.return_value = mock_cursor
-        mock_db = MagicMock()
-        mock_db.__getitem__.return_value = mock_collection
-        mock_client = MagicMock()
-        mock_client.__getitem__.return_value = mock_db
-        mock_get_connection.return_value = mock_client
+        # Setup fakes
+        mock_get_connection.return_value = fake_client(users=FakeCollection(aggregate_results=[decoded(mock_cursor)]))
 
         # Execute aggregation
         pipeline = [{"$lookup": {"from": "products", "localField": "product_ids", "foreignField": "_id", "as": "local_products"}}]
@@ -237,29 +370,23 @@ class TestExecuteAggregationPipeline:
     @patch('core.mongo_processor.get_mongodb_connection')
     @patch('core.mongo_processor.validate_collection_name')
     @patch('core.mongo_processor.validate_aggregation_pipeline')
-    def test_aggregation_converts_various_objectid_fields(self, mock_validate_pipeline, mock_validate_name, mock_get_connection):
+    def test_aggregation_converts_various_objectid_fields(self, mock_validate_pipeline, mock_validate_name, mock_get_connection, oid_pool):
         """Test that aggregation handles ObjectIds with different field names"""
         mock_cursor = [
             {
-                "_id": ObjectId(),
-                "user_id": ObjectId(),
-                "product_id": ObjectId(),
-                "category_id": ObjectId(),
+                "_id": oid_pool[0],
+                "user_id": oid_pool[1],
+                "product_id": oid_pool[2],
+                "category_id": oid_pool[3],
                 "metadata": {
-                    "created_by": ObjectId(),
-                    "updated_by": ObjectId()
+                    "created_by": oid_pool[4],
+                    "updated_by": oid_pool[5]
                 }
             }
         ]
 
-        # Setup mocks
-        mock_collection = MagicMock()
-        mock_collection.aggregate.return_value = mock_cursor
-        mock_db = MagicMock()
-        mock_db.__getitem__.return_value = mock_collection
-        mock_client = MagicMock()
-        mock_client.__getitem__.return_value = mock_db
-        mock_get_connection.return_value = mock_client
+        # Setup fakes
+        mock_get_connection.return_value = fake_client(test_collection=FakeCollection(aggregate_results=[decoded(mock_cursor)]))
 
         # Execute aggregation
         results = execute_aggregation_pipeline("test_collection", [{"$match": {}}])
@@ -276,10 +403,153 @@ class TestExecuteAggregationPipeline:
         # Verify result is JSON serializable
         json.dumps(results)
 
+    @patch('core.mongo_processor.get_mongodb_connection')
+    @patch('core.mongo_processor.validate_collection_name')
+    @patch('core.mongo_processor.validate_aggregation_pipeline')
+    def test_iter_aggregation_streams_with_batch_size(self, mock_validate_pipeline, mock_validate_name, mock_get_connection, oid_pool):
+        """Test that the streaming variant converts documents lazily and forwards batch_size"""
+        consumed = []
+
+        def cursor():
+            for i in range(3):
+                consumed.append(i)
+                yield decoded([{"_id": oid_pool[i], "n": i}])[0]
+
+        fake_collection = FakeCollection(aggregate_results=[cursor()])
+        mock_get_connection.return_value = fake_client(test_collection=fake_collection)
+
+        results = iter_aggregation_pipeline("test_collection", [{"$match": {}}], batch_size=50)
+
+        first = next(results)
+        assert isinstance(first["_id"], str)
+        assert consumed == [0]
+        assert [doc["n"] for doc in results] == [1, 2]
+        assert fake_collection.aggregate_calls == [([{"$match": {}}], {"batchSize": 50})]
+
+
+class TestOptimizePipeline:
+    """Test filter pushdown rewrites applied before aggregations run"""
+
+    def test_match_moves_above_lookup_and_unwind(self):
+        """Test that a filter on local fields runs before the join"""
+        lookup = {"$lookup": {"from": "orders", "localField": "id", "foreignField": "user_id", "as": "orders"}}
+        unwind = {"$unwind": "$orders"}
+        match = {"$match": {"city": "Paris"}}
+
+        assert _optimize_pipeline([lookup, unwind, match]) == [match, lookup, unwind]
+
+    @pytest.mark.parametrize("stage", [
+        pytest.param({"$lookup": {"from": "orders", "localField": "id", "foreignField": "user_id"}}, id="lookup_without_as"),
+        pytest.param({"$lookup": ["orders"]}, id="lookup_not_a_document"),
+        pytest.param({"$unwind": {"preserveNullAndEmptyArrays": True}}, id="unwind_without_path"),
+        pytest.param({"$unwind": 42}, id="unwind_not_a_document"),
+        pytest.param({"$unwind": {"path": "$a", "includeArrayIndex": 1}}, id="unwind_index_not_a_string"),
+    ])
+    def test_malformed_stage_blocks_moves(self, stage):
+        """Test that a malformed $lookup/$unwind is left for MongoDB to reject instead of raising"""
+        match = {"$match": {"city": "Paris"}}
+
+        assert _optimize_pipeline([stage, match]) == [stage, match]
+
+    def test_match_on_joined_field_stays_put(self):
+        """Test that filters reading the $lookup output or unwound path are not moved"""
+        lookup = {"$lookup": {"from": "orders", "localField": "id", "foreignField": "user_id", "as": "orders"}}
+        unwind = {"$unwind": {"path": "$orders", "includeArrayIndex": "idx"}}
+        on_orders = {"$match": {"$or": [{"orders.total": {"$gt": 10}}, {"city": "Paris"}]}}
+        on_index = {"$match": {"idx": 0}}
+
+        assert _optimize_pipeline([lookup, unwind, on_orders]) == [lookup, unwind, on_orders]
+        assert _optimize_pipeline([lookup, unwind, on_index]) == [lookup, unwind, on_index]
+
+    def test_adjacent_matches_are_merged(self):
+        """Test that consecutive filters collapse into one $and"""
+        pipeline = [{"$match": {"a": 1}}, {"$unwind": "$tags"}, {"$match": {"b": 2}}, {"$sort": {"a": 1}}]
+
+        assert _optimize_pipeline(pipeline) == [
+            {"$match": {"$and": [{"a": 1}, {"b": 2}]}},
+            {"$unwind": "$tags"},
+            {"$sort": {"a": 1}}
+        ]
+
+    def test_unknown_dependencies_block_moves(self):
+        """Test that $expr filters and other stages act as barriers"""
+        lookup = {"$lookup": {"from": "orders", "localField": "id", "foreignField": "user_id", "as": "orders"}}
+        expr = {"$match": {"$expr": {"$gt": ["$a", "$b"]}}}
+        group = {"$group": {"_id": "$city"}}
+
+        assert _optimize_pipeline([lookup, expr]) == [lookup, expr]
+        assert _optimize_pipeline([group, {"$match": {"_id": "Paris"}}]) == [group, {"$match": {"_id": "Paris"}}]
+
+    def test_already_optimal_pipeline_is_unchanged(self):
+        """Test that a pipeline filtering before its join is emitted as-is"""
+        pipeline = [
+            {"$match": {"money": {"$gte": 500}}},
+            {"$lookup": {
+                "from": "products",
+                "let": {"user_money": "$money"},
+                "pipeline": [{"$match": {"$expr": {"$lte": ["$price", "$$user_money"]}}}],
+                "as": "affordable_products"
+            }},
+            {"$match": {"affordable_products": {"$ne": []}}}
+        ]
+
+        assert _optimize_pipeline(pipeline) == pipeline
+
+
+class TestAsyncExecution:
+    """Test the event-loop friendly query executors"""
+
+    @patch('core.mongo_processor.get_async_mongodb_database')
+    def test_async_query_applies_sort_and_limit(self, mock_get_database):
+        """Test that the async find builds the same cursor and awaits its results"""
+        docs = decoded([{"_id": ObjectId(), "name": "Doc"}])
+        mock_cursor = MagicMock()
+        mock_cursor.sort.return_value = mock_cursor
+        mock_cursor.limit.return_value = mock_cursor
+        mock_cursor.to_list = AsyncMock(return_value=docs)
+        mock_db = MagicMock()
+        mock_db.get_collection.return_value.find.return_value = mock_cursor
+        mock_get_database.return_value = mock_db
+
+        results = asyncio.run(execute_mongodb_query_async("users", {"name": "Doc"}, sort={"name": 1}, limit=5))
+
+        assert results == docs
+        assert isinstance(results[0]["_id"], str)
+        mock_cursor.sort.assert_called_once_with([("name", 1)])
+        mock_cursor.limit.assert_called_once_with(5)
+        mock_db.get_collection.assert_called_once_with("users", codec_options=JSON_CODEC_OPTIONS)
+
+    @patch('core.mongo_processor.get_async_mongodb_database')
+    def test_async_aggregation_validates_before_querying(self, mock_get_database):
+        """Test that the async aggregation rejects dangerous stages without touching the database"""
+        with pytest.raises(MongoSecurityError):
+            asyncio.run(execute_aggregation_pipeline_async("users", [{"$function": {}}]))
+
+        mock_get_database.assert_not_called()
+
 
 class TestGetDatabaseSchema:
     """Test get_database_schema with ObjectId serialization"""
 
+    def test_schema_sample_pipeline_groups_fields_server_side(self):
+        """Test that sampling returns one row per field rather than whole documents"""
+        pipeline = build_schema_sample_pipeline()
+
+        assert pipeline[0] == {"$limit": SCHEMA_SAMPLE_SIZE}
+        facets = pipeline[1]["$facet"]
+        assert set(facets) == {"fields", "sample_data", "sampled"}
+        assert facets["fields"][0] == {"$project": {"kv": {"$objectToArray": "$$ROOT"}}}
+        assert facets["fields"][2]["$group"]["_id"] == "$kv.k"
+
+    def test_schema_sample_pipeline_trims_large_values(self):
+        """Test that sampled strings and arrays are truncated before leaving the server"""
+        facets = build_schema_sample_pipeline()[1]["$facet"]
+
+        field_trim = facets["fields"][-1]["$set"]["sample"]["$switch"]["branches"]
+        assert field_trim[0]["then"] == {"$substrCP": ["$sample", 0, SAMPLE_STRING_LENGTH]}
+        assert field_trim[1]["then"] == {"$slice": ["$sample", SAMPLE_ARRAY_LENGTH]}
+        assert "$replaceWith" in facets["sample_data"][-1]
+
     @patch('core.mongo_processor.get_mongodb_connection')
     @patch('core.mongo_processor.detect_all_relationships')
     def test_schema_sample_data_converts_objectids(self, mock_detect_relationships, mock_get_connection):
@@ -294,8 +564,8 @@ class TestGetDatabaseSchema:
 
         # Setup mocks
         mock_collection = MagicMock()
-        mock_collection.find.return_value.limit.return_value = sample_docs
-        mock_collection.count_documents.return_value = 2
+        mock_collection.aggregate.return_value = schema_facet(sample_docs)
+        mock_collection.estimated_document_count.return_value = 2
 
         mock_db = MagicMock()
         mock_db.list_collection_names.return_value = ["test_collection"]
@@ -322,9 +592,199 @@ class TestGetDatabaseSchema:
         assert isinstance(sample_data[1]["product_id"], str)
         assert sample_data[0]["_id"] == str(obj_id1)
         assert sample_data[1]["_id"] == str(obj_id2)
+        assert collection_schema["count"] == 2
 
         # Verify fields samples are also converted
         assert isinstance(collection_schema["fields"]["_id"]["sample"], str)
 
         # Verify entire schema is JSON serializable
         json.dumps(schema)
+
+    @patch('core.mongo_processor.get_mongodb_connection')
+    @patch('core.mongo_processor.detect_all_relationships')
+    def test_schema_counts_small_collections_from_sample(self, mock_detect_relationships, mock_get_connection):
+        """Test that only collections filling the sample need a metadata count"""
+        small = MagicMock()
+        small.aggregate.return_value = schema_facet([{"n": i} for i in range(3)])
+        large = MagicMock()
+        large.aggregate.return_value = schema_facet([{"n": i} for i in range(SCHEMA_SAMPLE_SIZE)])
+        large.estimated_document_count.return_value = 5000
+
+        mock_db = MagicMock()
+        mock_db.list_collection_names.return_value = ["small", "large"]
+        mock_db.__getitem__.side_effect = {"small": small, "large": large}.__getitem__
+        mock_client = MagicMock()
+        mock_client.__getitem__.return_value = mock_db
+        mock_get_connection.return_value = mock_client
+        mock_detect_relationships.return_value = []
+
+        collections = get_database_schema()["collections"]
+
+        assert collections["small"]["count"] == 3
+        assert collections["large"]["count"] == 5000
+        small.estimated_document_count.assert_not_called()
+
+    @patch('core.mongo_processor.get_mongodb_connection')
+    @patch('core.mongo_processor.detect_all_relationships')
+    def test_schema_cached_until_collection_write(self, mock_detect_relationships, mock_get_connection):
+        """Test that repeat calls reuse the schema until a write invalidates it"""
+        mock_collection = MagicMock()
+        mock_collection.aggregate.return_value = schema_facet([{"n": 1}])
+        mock_db = MagicMock()
+        mock_db.list_collection_names.return_value = ["numbers"]
+        mock_db.__getitem__.return_value = mock_collection
+        mock_client = MagicMock()
+        mock_client.__getitem__.return_value = mock_db
+        mock_get_connection.return_value = mock_client
+        mock_detect_relationships.return_value = []
+
+        first = get_database_schema()
+        assert get_database_schema() is first
+        assert mock_db.list_collection_names.call_count == 1
+
+        drop_collection("numbers")
+        assert get_schema_cache_age() is None
+        assert get_database_schema() is not first
+        assert mock_db.list_collection_names.call_count == 2
+        assert 0 <= get_schema_cache_age() < SCHEMA_CACHE_TTL_SECONDS
+
+    @patch('core.mongo_processor.get_mongodb_connection')
+    @patch('core.mongo_processor.detect_all_relationships')
+    def test_relationships_reused_until_fields_change(self, mock_detect_relationships, mock_get_connection):
+        """Test that schema rebuilds only re-detect relationships on field changes or refresh"""
+        mock_collection = MagicMock()
+        mock_collection.aggregate.side_effect = lambda pipeline: schema_facet([{"n": 1}])
+        mock_db = MagicMock()
+        mock_db.list_collection_names.return_value = ["numbers"]
+        mock_db.__getitem__.return_value = mock_collection
+        mock_client = MagicMock()
+        mock_client.__getitem__.return_value = mock_db
+        mock_get_connection.return_value = mock_client
+        mock_detect_relationships.return_value = []
+
+        get_database_schema()
+        invalidate_schema_cache()
+        get_database_schema()
+        assert mock_detect_relationships.call_count == 1
+
+        refresh_database_schema()
+        assert mock_detect_relationships.call_count == 2
+        assert get_schema_cache_age() is not None
+
+        mock_collection.aggregate.side_effect = lambda pipeline: schema_facet([{"n": 1, "label": "x"}])
+        invalidate_schema_cache()
+        get_database_schema()
+        assert mock_detect_relationships.call_count == 3
+
+
+class TestGetCollectionStats:
+    """Test collection statistics serialization"""
+
+    @patch('core.mongo_processor.get_mongodb_connection')
+    def test_index_documents_are_json_safe(self, mock_get_connection):
+        """Test that index specs come back as plain JSON-serializable data"""
+        mock_collection = MagicMock()
+        mock_collection.estimated_document_count.return_value = 4
+        mock_collection.list_indexes.return_value = iter([
+            {"v": 2, "key": {"_id": 1}, "name": "_id_"},
+            {"v": 2, "key": {"owner": 1}, "name": "owner_1", "partialFilterExpression": {"owner": {"$ne": ObjectId()}}}
+        ])
+        mock_db = MagicMock()
+        mock_db.__getitem__.return_value = mock_collection
+        mock_db.command.return_value = {"size": 10, "storageSize": 20}
+        mock_client = MagicMock()
+        mock_client.__getitem__.return_value = mock_db
+        mock_get_connection.return_value = mock_client
+
+        stats = get_collection_stats("owners")
+
+        assert [index["name"] for index in stats["indexes"]] == ["_id_", "owner_1"]
+        assert stats["count"] == 4
+        json.dumps(stats)
+
+
+class TestInsertDocuments:
+    """Test batched bulk inserts"""
+
+    @patch('core.mongo_processor.INSERT_BATCH_SIZE', 2)
+    @patch('core.mongo_processor.get_mongodb_connection')
+    def test_insert_documents_in_unordered_batches(self, mock_get_connection):
+        """Test that documents are split into unordered insert_many batches"""
+        mock_collection = MagicMock()
+        mock_collection.insert_many.side_effect = lambda batch, **kwargs: MagicMock(inserted_ids=[ObjectId() for _ in batch])
+        mock_db = MagicMock()
+        mock_db.get_collection.return_value = mock_collection
+        mock_client = MagicMock()
+        mock_client.__getitem__.return_value = mock_db
+        mock_get_connection.return_value = mock_client
+
+        documents = [{"n": i} for i in range(5)]
+        inserted = insert_documents("test_collection", documents)
+
+        assert inserted == 5
+        batches = [call.args[0] for call in mock_collection.insert_many.call_args_list]
+        assert [len(batch) for batch in batches] == [2, 2, 1]
+        assert all(call.kwargs['ordered'] is False for call in mock_collection.insert_many.call_args_list)
+        mock_db.get_collection.assert_called_once_with("test_collection", write_concern=IMPORT_WRITE_CONCERN)
+        assert IMPORT_WRITE_CONCERN.document == {"w": 1}
+
+    @patch('core.mongo_processor.INSERT_BATCH_SIZE', 2)
+    @patch('core.mongo_processor.get_mongodb_connection')
+    def test_insert_documents_reports_partial_success(self, mock_get_connection):
+        """Test that a bulk write error reports how many documents made it in"""
+        mock_collection = MagicMock()
+        mock_collection.insert_many.side_effect = [
+            MagicMock(inserted_ids=[ObjectId(), ObjectId()]),
+            BulkWriteError({"nInserted": 1, "writeErrors": [{"index": 1, "code": 11000}]})
+        ]
+        mock_db = MagicMock()
+        mock_db.get_collection.return_value = mock_collection
+        mock_client = MagicMock()
+        mock_client.__getitem__.return_value = mock_db
+        mock_get_connection.return_value = mock_client
+
+        with pytest.raises(OperationFailure, match="1 write errors, 3 of 5 documents inserted"):
+            insert_documents("test_collection", [{"n": i} for i in range(5)])
+
+
+class TestGetMongoDBDatabase:
+    """Test caching of the default database handle"""
+
+    @patch('core.mongo_processor.get_mongodb_connection')
+    def test_database_handle_cached_per_client(self, mock_get_connection):
+        """Test that the handle is reused until the client changes or is closed"""
+        def make_client():
+            client = MagicMock()
+            client.__getitem__.side_effect = lambda name: MagicMock(client=client, name=name)
+            return client
+
+        first_client = make_client()
+        mock_get_connection.return_value = first_client
+        close_mongodb_connection()
+
+        db = get_mongodb_database()
+        assert get_mongodb_database() is db
+        assert first_client.__getitem__.call_count == 1
+
+        mock_get_connection.return_value = make_client()
+        assert get_mongodb_database() is not db
+
+        close_mongodb_connection()
+
+    @patch('core.mongo_processor.AsyncMongoClient')
+    def test_async_database_handle_cached_with_client(self, mock_client_class):
+        """Test that the async handle is built once per client and dropped on close"""
+        asyncio.run(close_async_mongodb_connection())
+
+        db = get_async_mongodb_database()
+        assert get_async_mongodb_database() is db
+        mock_client_class.assert_called_once()
+        assert mock_client_class.return_value.__getitem__.call_count == 1
+
+        mock_client_class.return_value.close = AsyncMock()
+        asyncio.run(close_async_mongodb_connection())
+        mock_client_class.return_value.close.assert_awaited_once()
+        get_async_mongodb_database()
+        assert mock_client_class.call_count == 2
+
+        asyncio.run(close_async_mongodb_connection())
@@ -3,15 +3,17 @@ Unit tests for relationship detector module
 """
 
 import pytest
-from unittest.mock import Mock, MagicMock
 from core.relationship_detector import (
     detect_id_field_relationships,
     detect_name_based_relationships,
     detect_value_overlap_relationships,
     calculate_relationship_confidence,
-    detect_all_relationships
+    detect_all_relationships,
+    _sample_field_values_batch
 )
+from pymongo.errors import OperationFailure
 from core.data_models import FieldRelationship, RelationshipType
+from tests.core._fakes import FakeCollection, FakeDB
 
 
 @pytest.fixture
@@ -44,9 +46,8 @@ def sample_schema():
 
 @pytest.fixture
 def mock_db():
-    """Mock MongoDB database"""
-    db = MagicMock()
-    return db
+    """Fake MongoDB database"""
+    return FakeDB()
 
 
 def test_detect_id_field_relationships(sample_schema, mock_db):
@@ -100,32 +101,11 @@ def test_detect_name_based_relationships(sample_schema):
 
 def test_detect_value_overlap_relationships(mock_db):
     """Test value overlap calculation"""
-    # Mock source collection data
-    mock_db.__getitem__.return_value.find.return_value.limit.return_value = [
-        {"city": "New York"},
-        {"city": "Chicago"},
-        {"city": "Los Angeles"}
-    ]
-
-    # First call returns source data
-    source_docs = [
-        {"city": "New York"},
-        {"city": "Chicago"},
-        {"city": "Los Angeles"}
-    ]
-
-    # Second call returns target data
-    target_docs = [
-        {"location": "New York"},
-        {"location": "Chicago"},
-        {"location": "Boston"}
-    ]
-
-    mock_collection = MagicMock()
-    mock_db.__getitem__.return_value = mock_collection
-
-    # Configure mock to return different results for sequential calls
-    mock_collection.find.return_value.limit.side_effect = [source_docs, target_docs]
+    # The server returns the distinct source count and the intersection size;
+    # e.g. New York and Chicago shared out of New York, Chicago, Los Angeles
+    mock_collection = mock_db.collections["users"] = FakeCollection(
+        aggregate_results=[[{"source_count": 3, "overlap": 2}]]
+    )
 
     confidence = detect_value_overlap_relationships(
         "users", "city",
@@ -133,9 +113,23 @@ def test_detect_value_overlap_relationships(mock_db):
         mock_db
     )
 
-    # 2 out of 3 values overlap (New York, Chicago)
-    assert confidence > 0.5
-    assert confidence <= 1.0
+    assert confidence == pytest.approx(2 / 3)
+
+    # One round-trip: the target side is joined in with $lookup
+    assert mock_db.accessed == ["users"]
+    assert len(mock_collection.aggregate_calls) == 1
+    pipeline = mock_collection.aggregate_calls[0][0]
+    assert {"$group": {"_id": "$city"}} in pipeline
+    lookup = next(stage["$lookup"] for stage in pipeline if "$lookup" in stage)
+    assert lookup["from"] == "products"
+    assert {"$group": {"_id": "$location"}} in lookup["pipeline"]
+    assert "$setIntersection" in str(pipeline[-1])
+    assert mock_collection.find_calls == []
+
+
+def test_value_overlap_with_empty_source(mock_db):
+    """Test that a source field with no sampled values has no overlap"""
+    assert detect_value_overlap_relationships("users", "city", "products", "location", mock_db) == 0.0
 
 
 def test_relationship_confidence_scoring():
@@ -170,8 +164,7 @@ def test_no_false_positives():
         }
     }
 
-    mock_db = MagicMock()
-    relationships = detect_id_field_relationships(schema, mock_db)
+    relationships = detect_id_field_relationships(schema, FakeDB())
 
     # Should not create relationship between random_field and unrelated_field
     false_rel = next(
@@ -199,12 +192,8 @@ def test_bidirectional_relationships(mock_db):
     source_docs = [{"city": "New York"}, {"city": "Chicago"}]
     target_docs = [{"location": "New York"}, {"location": "Chicago"}]
 
-    mock_collection = MagicMock()
-    mock_db.__getitem__.return_value = mock_collection
-    mock_collection.find.return_value.limit.side_effect = [
-        source_docs, target_docs,
-        target_docs, source_docs  # Reverse direction
-    ]
+    mock_db.collections["users"] = FakeCollection(source_docs)
+    mock_db.collections["products"] = FakeCollection(target_docs)
 
     relationships = detect_all_relationships(schema, mock_db, min_confidence=0.3)
 
@@ -228,9 +217,8 @@ def test_min_confidence_threshold(mock_db):
     source_docs = [{"city": "New York"}]
     target_docs = [{"location": "Boston"}]  # No overlap
 
-    mock_collection = MagicMock()
-    mock_db.__getitem__.return_value = mock_collection
-    mock_collection.find.return_value.limit.side_effect = [source_docs, target_docs]
+    mock_db.collections["users"] = FakeCollection(source_docs)
+    mock_db.collections["products"] = FakeCollection(target_docs)
 
     # With high threshold, should not include low-confidence relationships
     relationships = detect_all_relationships(schema, mock_db, min_confidence=0.8)
@@ -252,10 +240,6 @@ def test_empty_collections(mock_db):
         "products": {"product_id": "number"}
     }
 
-    mock_collection = MagicMock()
-    mock_db.__getitem__.return_value = mock_collection
-    mock_collection.find.return_value.limit.return_value = []
-
     relationships = detect_all_relationships(schema, mock_db, min_confidence=0.3)
 
     # Should handle gracefully without errors
@@ -269,12 +253,7 @@ def test_single_document_collections(mock_db):
         "products": {"product_id": "number", "location": "string"}
     }
 
-    source_docs = [{"city": "New York"}]
-    target_docs = [{"location": "New York"}]
-
-    mock_collection = MagicMock()
-    mock_db.__getitem__.return_value = mock_collection
-    mock_collection.find.return_value.limit.side_effect = [source_docs, target_docs]
+    mock_db.collections["users"] = FakeCollection(aggregate_results=[[{"source_count": 1, "overlap": 1}]])
 
     confidence = detect_value_overlap_relationships(
         "users", "city",
@@ -293,11 +272,165 @@ def test_collections_with_no_relationships(mock_db):
         "collection_b": {"field3": "string", "field4": "number"}
     }
 
-    mock_collection = MagicMock()
-    mock_db.__getitem__.return_value = mock_collection
-    mock_collection.find.return_value.limit.return_value = []
-
     relationships = detect_all_relationships(schema, mock_db, min_confidence=0.3)
 
     # May have no relationships or only low-confidence ones
     assert isinstance(relationships, list)
+
+
+def test_sample_field_values_batch(mock_db):
+    """Test that several fields are sampled with a single $facet aggregation"""
+    mock_collection = mock_db.collections["users"] = FakeCollection(aggregate_results=[[{
+        "f0": [{"_id": "Paris"}, {"_id": "Lyon"}],
+        "f1": [{"_id": ["a"]}]
+    }]])
+
+    values = _sample_field_values_batch(mock_db, "users", ["city", "tags"])
+
+    assert values == {"city": {"Paris", "Lyon"}, "tags": set()}
+    assert len(mock_collection.aggregate_calls) == 1
+    facet = mock_collection.aggregate_calls[0][0][-1]["$facet"]
+    assert facet["f0"] == [
+        {"$match": {"city": {"$exists": True, "$ne": None}}},
+        {"$limit": 100},
+        {"$group": {"_id": "$city", "n": {"$sum": 1}}}
+    ]
+    assert facet["input"] == [{"$count": "n"}]
+
+
+def test_sample_field_values_batch_resamples_sparse_fields(mock_db):
+    """Test that a sparse field starved by a dense one is sampled again on its own"""
+    # All 200 documents let through the limit hold name; none holds city
+    mock_collection = mock_db.collections["users"] = FakeCollection(aggregate_results=[
+        [{
+            "input": [{"n": 200}],
+            "f0": [{"_id": f"user{i}", "n": 1} for i in range(100)],
+            "f1": []
+        }],
+        [{"_id": "Paris"}, {"_id": "Lyon"}]
+    ])
+
+    values = _sample_field_values_batch(mock_db, "users", ["name", "city"])
+
+    assert values["city"] == {"Paris", "Lyon"}
+    assert len(values["name"]) == 100
+    assert len(mock_collection.aggregate_calls) == 2
+    assert mock_collection.aggregate_calls[1][0][-1] == {"$group": {"_id": "$city"}}
+
+
+def test_sample_field_values_batch_keeps_short_fields_when_input_exhausted(mock_db):
+    """Test that no resampling happens when the whole collection fit under the limit"""
+    mock_collection = mock_db.collections["users"] = FakeCollection(aggregate_results=[[{
+        "input": [{"n": 3}],
+        "f0": [{"_id": "Ann", "n": 2}],
+        "f1": [{"_id": "Paris", "n": 1}]
+    }]])
+
+    values = _sample_field_values_batch(mock_db, "users", ["name", "city"])
+
+    assert values == {"name": {"Ann"}, "city": {"Paris"}}
+    assert len(mock_collection.aggregate_calls) == 1
+
+
+def test_sample_field_values_batch_bounds_facet_input(mock_db):
+    """Test that $facet only sees a bounded number of documents"""
+    mock_collection = mock_db.collections["users"] = FakeCollection(aggregate_results=[[{}]])
+
+    _sample_field_values_batch(mock_db, "users", ["city", "tags"], sample_size=50)
+
+    pipeline = mock_collection.aggregate_calls[0][0]
+    # $facet reads its whole input, so the scan must stop before it
+    assert [next(iter(stage)) for stage in pipeline] == ["$match", "$limit", "$facet"]
+    assert pipeline[0] == {"$match": {"$or": [
+        {"city": {"$exists": True, "$ne": None}},
+        {"tags": {"$exists": True, "$ne": None}}
+    ]}}
+    assert pipeline[1] == {"$limit": 100}
+
+
+def test_sample_field_values_batch_falls_back_per_field(mock_db):
+    """Test the per-field fallback when the server rejects the $facet output"""
+    mock_collection = mock_db.collections["users"] = FakeCollection(aggregate_results=[
+        OperationFailure("BSONObjectTooLarge", code=10334),
+        [{"_id": "Paris"}],
+        [{"_id": "a@b.c"}]
+    ])
+
+    values = _sample_field_values_batch(mock_db, "users", ["city", "email"])
+
+    assert values == {"city": {"Paris"}, "email": {"a@b.c"}}
+    assert len(mock_collection.aggregate_calls) == 3
+
+
+def test_detect_all_relationships_samples_each_collection_once():
+    """Test that overlap checks are served from one aggregation per collection"""
+    schema = {
+        "users": {"id": "number", "city": "string", "name": "string"},
+        "stores": {"id": "number", "city": "string", "name": "string"}
+    }
+
+    facet_results = {
+        "users": {"f0": [{"_id": "Paris"}, {"_id": "Lyon"}], "f1": [{"_id": "Ann"}]},
+        "stores": {"f0": [{"_id": "Paris"}, {"_id": "Lyon"}], "f1": [{"_id": "Shop"}]}
+    }
+    collections = {name: FakeCollection(aggregate_results=[[facet_results[name]]]) for name in schema}
+    db = FakeDB(collections)
+
+    relationships = detect_all_relationships(schema, db, min_confidence=0.3)
+
+    for collection in collections.values():
+        assert len(collection.aggregate_calls) == 1
+
+    city_rel = next(r for r in relationships if r.source_field == "city")
+    assert city_rel.confidence_score == 1.0
+    assert not any(r.source_field == "name" for r in relationships)
+
+
+def test_id_field_prefers_exact_then_plural_collection(mock_db):
+    """Test _id prefix resolution order and that fields never reference their own collection"""
+    schema = {
+        "categorys": {"id": "number"},
+        "category": {"id": "number"},
+        "items": {"category_id": "number", "item": "string"}
+    }
+
+    relationships = detect_id_field_relationships(schema, mock_db)
+
+    id_rel = next(r for r in relationships if r.source_field == "category_id")
+    assert id_rel.target_collection == "category"
+    assert not any(r.source_field == "item" for r in relationships)
+
+
+def test_name_based_prefix_matches_in_schema_order():
+    """Test that a prefix matches every collection starting with it, in schema order"""
+    schema = {
+        "products_archive": {"name": "string"},
+        "orders": {"prod_name": "string"},
+        "products": {"name": "string"},
+        "promotions": {"name": "string"}
+    }
+
+    relationships = detect_name_based_relationships(schema)
+
+    assert [r.target_collection for r in relationships] == ["products_archive", "products"]
+
+
+def test_incompatible_field_types_are_not_sampled():
+    """Test that pairs whose sampled types cannot match skip the overlap query"""
+    schema = {
+        "users": {"id": "int", "city": "str", "name": "str"},
+        "stores": {"id": "int", "city": "ObjectId", "name": "NoneType"}
+    }
+
+    collections = {name: FakeCollection(aggregate_results=[[{"f0": [{"_id": "Paris"}]}]]) for name in schema}
+    db = FakeDB(collections)
+
+    detect_all_relationships(schema, db, min_confidence=0.3)
+
+    # city (str vs ObjectId) is pruned; name is kept since a null sample says nothing
+    for collection in collections.values():
+        facet = collection.aggregate_calls[-1][0][-1]["$facet"]
+        assert [branch[0]["$match"] for name, branch in facet.items() if name != "input"] == [
+            {"name": {"$exists": True, "$ne": None}}
+        ]
+